@@ -0,0 +1,307 @@
+# pipeline/bulk_embedding.py
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import Iterable, Iterator, List
+
+import numpy as np
+
+from .embedding_storage import check_format, encode_embeddings
+from .log_util import log_info, log_warning
+
+
+class BulkEmbeddingError(RuntimeError):
+    pass
+
+
+# =============== Worker process ===============
+def _worker_main(backend: str, model_dir: str, threads: int, tasks, results):
+    """
+    Worker loop: load a private model with `threads` intra-op threads, then
+    encode (stream, seq, texts) tasks until a None arrives.
+    Every reply is (stream, seq, rows, error); rows are L2-normalized.
+    """
+    # pin the BLAS / OpenMP pools before torch or ONNX Runtime is imported
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    try:
+        if backend == "torch":
+            import torch
+
+            torch.set_num_threads(threads)
+            torch.set_num_interop_threads(1)
+        from .embedding_utils import load_embedding_model
+
+        model = load_embedding_model(backend, model_dir=model_dir, num_threads=threads)
+    except Exception as e:
+        results.put((None, None, None, f"model load failed: {e!r}"))
+        return
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        stream, seq, texts = task
+        try:
+            rows = np.asarray(model.encode(texts, batch_size=len(texts)), dtype=np.float32)
+            norms = np.linalg.norm(rows, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            results.put((stream, seq, rows / norms, None))
+        except Exception as e:
+            results.put((stream, seq, None, repr(e)))
+
+
+def _chunked(texts: Iterable[str], size: int) -> Iterator[List[str]]:
+    texts = iter(texts)
+    while True:
+        chunk = list(itertools.islice(texts, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# =============== Pool ===============
+class BulkEmbeddingPool:
+    """
+    Bulk embedding across worker processes, for large ingestions and
+    re-index jobs.
+
+    Each worker loads its own model and is pinned to threads_per_worker
+    intra-op threads, so n_workers x threads_per_worker should not exceed
+    the cores (the default fills them one thread per worker; that is what
+    scales close to linearly, since a single encode stops scaling well past
+    a few threads). Texts are cut into chunk_size tasks on a shared queue;
+    whichever worker is free takes the next one.
+
+    imap() streams the rows back in input order with backpressure: at most
+    max_in_flight chunks are queued, being encoded or waiting to be yielded,
+    so a lazy input (e.g. a Mongo cursor) is read only as fast as results
+    are consumed. One stream runs at a time; concurrent callers queue up.
+
+    Every worker holds a full model (~100 MB for MiniLM on ONNX, more on
+    torch). Workers are started with "spawn", so run the app through uvicorn
+    (or behind an `if __name__ == "__main__"` guard).
+    """
+
+    def __init__(self, n_workers=None, threads_per_worker=1, backend="torch", model_dir="onnx_model",
+                 chunk_size=64, max_in_flight=None, timeout=300.0, start_method="spawn"):
+        self.threads_per_worker = max(1, threads_per_worker)
+        self.n_workers = n_workers or max(1, (os.cpu_count() or 1) // self.threads_per_worker)
+        self.backend = backend
+        self.model_dir = model_dir
+        self.chunk_size = chunk_size
+        self.max_in_flight = max_in_flight or 2 * self.n_workers
+        # smaller jobs aren't worth the round trips; batch_embed_texts encodes them in-process
+        self.min_texts = 2 * chunk_size
+        self.timeout = timeout
+        self.texts = 0
+        self.seconds = 0.0
+        self._context = multiprocessing.get_context(start_method)
+        self._tasks = self._context.Queue()
+        self._results = self._context.Queue()
+        self._streams = itertools.count()
+        self._lock = threading.Lock()
+        self._processes = [None] * self.n_workers
+        self._start_workers()
+        log_info("BulkEmbeddingPool", f"{self.n_workers} workers x {self.threads_per_worker} threads ({backend})")
+
+    def _start_workers(self):
+        dead = [i for i, p in enumerate(self._processes) if p is not None and not p.is_alive()]
+        if dead:
+            # a worker killed inside tasks.get() can leave the queue's lock held:
+            # replace the queues and every worker
+            log_warning("BulkEmbeddingWorkerRestart", f"workers {dead} exited; restarting the pool")
+            for process in self._processes:
+                if process.is_alive():
+                    process.terminate()
+                process.join(timeout=5)
+            self._tasks = self._context.Queue()
+            self._results = self._context.Queue()
+            self._processes = [None] * self.n_workers
+        for i, process in enumerate(self._processes):
+            if process is not None:
+                continue
+            process = self._context.Process(
+                target=_worker_main, name=f"bulk-embedding-{i}", daemon=True,
+                args=(self.backend, self.model_dir, self.threads_per_worker, self._tasks, self._results)
+            )
+            process.start()
+            self._processes[i] = process
+
+    def _next_result(self, stream: int):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                result_stream, seq, rows, error = self._results.get(timeout=1.0)
+            except queue.Empty:
+                if not all(p.is_alive() for p in self._processes):
+                    raise BulkEmbeddingError("a bulk embedding worker exited")
+                if time.monotonic() > deadline:
+                    raise BulkEmbeddingError(f"no result within {self.timeout}s")
+                continue
+            if error is not None and (seq is None or result_stream == stream):
+                raise BulkEmbeddingError(error)
+            # left over from an abandoned stream
+            if result_stream == stream:
+                return seq, rows
+
+    # ---------- streaming ----------
+    def imap(self, texts: Iterable[str]) -> Iterator[np.ndarray]:
+        """
+        (chunk x dim) float32 arrays of L2-normalized rows, in input order.
+        """
+        with self._lock:
+            self._start_workers()
+            stream = next(self._streams)
+            chunks = _chunked(texts, self.chunk_size)
+            done = {}
+            submitted, yielded, exhausted = 0, 0, False
+            start = time.perf_counter()
+            while True:
+                while not exhausted and submitted - yielded < self.max_in_flight:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        exhausted = True
+                        break
+                    self._tasks.put((stream, submitted, chunk))
+                    submitted += 1
+                if yielded == submitted:
+                    break
+                while yielded not in done:
+                    seq, rows = self._next_result(stream)
+                    done[seq] = rows
+                rows = done.pop(yielded)
+                yielded += 1
+                self.texts += len(rows)
+                self.seconds += time.perf_counter() - start
+                yield rows
+                start = time.perf_counter()
+
+    def map(self, texts: List[str]) -> np.ndarray:
+        """
+        All rows at once, as one contiguous (len(texts) x dim) array.
+        """
+        parts = list(self.imap(texts))
+        if not parts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.concatenate(parts)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.n_workers,
+            "threads_per_worker": self.threads_per_worker,
+            "texts": self.texts,
+            "texts_per_second": (self.texts / self.seconds) if self.seconds else 0.0,
+        }
+
+    def close(self):
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            if process is not None:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+
+
+# =============== Re-index job ===============
+def reindex_embeddings(collection, pool: BulkEmbeddingPool, storage_format="array", query=None,
+                       write_batch=1000, progress=None) -> int:
+    """
+    Re-embed every chunk doc matching query (default: all) from its
+    chunk_text and rewrite its embedding in storage_format, e.g. after
+    switching models or backends. The cursor is consumed only as fast as
+    the pool returns rows. Returns how many docs were rewritten.
+
+    Search processes keep serving the old vectors until restarted; delete
+    the search snapshot (SEARCH_SNAPSHOT_PATH) first, since it holds them too.
+    """
+    from pymongo import UpdateOne
+
+    storage_format = check_format(storage_format)
+    ids = deque()
+
+    def texts():
+        cursor = collection.find(query or {}, {"_id": 1, "chunk_text": 1}).batch_size(write_batch)
+        for doc in cursor:
+            ids.append(doc["_id"])
+            yield doc.get("chunk_text", "")
+
+    reindexed = 0
+    ops = []
+    start = time.perf_counter()
+    for rows in pool.imap(texts()):
+        for fields in encode_embeddings(rows, storage_format):
+            update = {"$set": fields}
+            unset = {k: "" for k in ("embedding_format", "embedding_scale") if k not in fields}
+            if unset:
+                update["$unset"] = unset
+            ops.append(UpdateOne({"_id": ids.popleft()}, update))
+        reindexed += len(rows)
+        if len(ops) >= write_batch:
+            collection.bulk_write(ops, ordered=False)
+            ops = []
+        if progress is not None:
+            progress(reindexed, reindexed / max(time.perf_counter() - start, 1e-9))
+    if ops:
+        collection.bulk_write(ops, ordered=False)
+    log_info("EmbeddingsReindexed", f"{reindexed} chunks in {storage_format} "
+                                    f"({time.perf_counter() - start:.0f} s)")
+    return reindexed
+
+
+def benchmark_pool(texts: List[str], worker_counts=(1, 2, 4), backend="torch", model_dir="onnx_model") -> List[dict]:
+    """
+    Throughput of the same texts through pools of each size (one thread per
+    worker), to check the scaling on this machine. Model loading is excluded.
+    """
+    report = []
+    for n in worker_counts:
+        pool = BulkEmbeddingPool(n_workers=n, backend=backend, model_dir=model_dir)
+        try:
+            pool.map(texts[:pool.chunk_size * n])  # warm up: every worker loads its model
+            start = time.perf_counter()
+            pool.map(texts)
+            elapsed = time.perf_counter() - start
+        finally:
+            pool.close()
+        report.append({"workers": n, "texts_per_second": len(texts) / elapsed})
+    return report
+
+
+if __name__ == "__main__":
+    # python -m pipeline.bulk_embedding reindex [n_workers] [threads_per_worker]
+    # python -m pipeline.bulk_embedding bench [n_texts]
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "bench"
+    backend = os.getenv("EMBEDDING_BACKEND", "torch")
+    model_dir = os.getenv("ONNX_MODEL_DIR", "onnx_model")
+    if command == "reindex":
+        from pymongo.mongo_client import MongoClient
+        from pymongo.server_api import ServerApi
+
+        client = MongoClient(os.getenv("MONGO_URI", "mongodb://localhost:27017"), server_api=ServerApi('1'))
+        bulk = BulkEmbeddingPool(
+            n_workers=int(sys.argv[2]) if len(sys.argv) > 2 else None,
+            threads_per_worker=int(sys.argv[3]) if len(sys.argv) > 3 else 1,
+            backend=backend, model_dir=model_dir
+        )
+        try:
+            reindex_embeddings(client["testdb"]["chunks"], bulk,
+                               storage_format=os.getenv("EMBEDDING_STORAGE_FORMAT", "array"),
+                               progress=lambda n, rate: print(f"\r{n} chunks  {rate:.0f}/s", end="", flush=True))
+            print()
+        finally:
+            bulk.close()
+    else:
+        from .onnx_embeddings import SAMPLE_TEXTS
+
+        n_texts = int(sys.argv[2]) if len(sys.argv) > 2 else 4000
+        sample = [SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)] + f" {i}" for i in range(n_texts)]
+        counts = sorted({1, 2, os.cpu_count() or 1})
+        for row in benchmark_pool(sample, worker_counts=counts, backend=backend, model_dir=model_dir):
+            print(f"{row['workers']:3d} workers  {row['texts_per_second']:7.0f} texts/s")
@@ -0,0 +1,142 @@
+# pipeline/embedding_cache.py
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from .log_util import log_error
+
+_WHITESPACE_RE = re.compile(r"\s+")
+# SQLite caps host parameters per statement; look keys up in slices of this many
+_LOOKUP_SLICE = 500
+
+
+def normalize_chunk(text: str) -> str:
+    """
+    Collapse whitespace; the tokenizer splits on it anyway, so this never changes the embedding.
+    """
+    return _WHITESPACE_RE.sub(" ", text or "").strip()
+
+
+class EmbeddingCache:
+    """
+    Persistent chunk-embedding cache in a local SQLite file, shared by the
+    workers on a host.
+
+    Keys are SHA-256 of (model id, normalized chunk text), so re-ingesting an
+    unchanged PDF costs one lookup per chunk, and vectors from another model
+    or backend never mix. Values are raw float32 bytes.
+
+    Bounded by size: once the rows take more than max_bytes, the least
+    recently used are evicted in one batch, down to 90% of the bound, so
+    most puts skip eviction entirely.
+    """
+
+    # approximate per-row overhead beyond the vector (key, last_access, b-tree)
+    _ROW_OVERHEAD = 96
+
+    def __init__(self, sqlite_path: str, model_id: str, dim=384, max_bytes=512 * 1024 * 1024):
+        self.model_id = model_id
+        self.dim = dim
+        self.max_entries = max(1, max_bytes // (dim * 4 + self._ROW_OVERHEAD))
+        self._low_water = max(1, self.max_entries * 9 // 10)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(sqlite_path, check_same_thread=False, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS chunk_embeddings ("
+            " key BLOB PRIMARY KEY, vector BLOB, last_access REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS chunk_embeddings_access ON chunk_embeddings(last_access)")
+        self._db.commit()
+        # upper estimate of the row count (replaced keys and other workers' evictions aren't tracked);
+        # recounted exactly whenever it crosses max_entries
+        self._rows = self._count()
+
+    def _count(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM chunk_embeddings").fetchone()[0]
+
+    def keys(self, texts: List[str]) -> List[bytes]:
+        prefix = self.model_id.encode("utf-8") + b"\x00"
+        return [hashlib.sha256(prefix + normalize_chunk(t).encode("utf-8")).digest() for t in texts]
+
+    def get_many(self, keys: List[bytes]) -> Dict[int, np.ndarray]:
+        """
+        {position in keys: vector} for the keys that are cached.
+        """
+        found = {}
+        if not keys:
+            return found
+        positions = {}
+        for i, key in enumerate(keys):
+            positions.setdefault(key, []).append(i)
+        unique = list(positions)
+        now = time.time()
+        with self._lock:
+            try:
+                for start in range(0, len(unique), _LOOKUP_SLICE):
+                    part = unique[start:start + _LOOKUP_SLICE]
+                    rows = self._db.execute(
+                        f"SELECT key, vector FROM chunk_embeddings WHERE key IN ({','.join('?' * len(part))})",
+                        part
+                    ).fetchall()
+                    for key, vector in rows:
+                        vector = np.frombuffer(vector, dtype=np.float32)
+                        if vector.size == self.dim:
+                            for i in positions[key]:
+                                found[i] = vector
+                    if rows:
+                        self._db.executemany("UPDATE chunk_embeddings SET last_access = ? WHERE key = ?",
+                                             [(now, key) for key, _ in rows])
+                self._db.commit()
+            except sqlite3.Error as e:
+                log_error("EmbeddingCacheError", f"get: {str(e)}")
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, keys: List[bytes], vectors):
+        if not keys:
+            return
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        now = time.time()
+        with self._lock:
+            try:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO chunk_embeddings (key, vector, last_access) VALUES (?, ?, ?)",
+                    [(key, vector.tobytes(), now) for key, vector in zip(keys, vectors)]
+                )
+                self._rows += len(keys)
+                if self._rows > self.max_entries:
+                    self._evict()
+                self._db.commit()
+            except sqlite3.Error as e:
+                log_error("EmbeddingCacheError", f"put: {str(e)}")
+
+    def _evict(self):
+        # another worker may have added rows too: count for real before deleting
+        self._rows = self._count()
+        excess = self._rows - self._low_water
+        if self._rows <= self.max_entries or excess <= 0:
+            return
+        self._db.execute(
+            "DELETE FROM chunk_embeddings WHERE key IN ("
+            " SELECT key FROM chunk_embeddings ORDER BY last_access LIMIT ?)",
+            (excess,)
+        )
+        self._rows -= excess
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
@@ -0,0 +1,217 @@
+# pipeline/embedding_storage.py
+import os
+import sys
+import time
+from typing import List, Optional
+
+import numpy as np
+from bson import encode as bson_encode
+from bson.binary import Binary
+
+from .log_util import log_info
+
+# How chunk embeddings are written to Mongo:
+#   "array"   - BSON array of doubles (original layout, ~3.5 KB per 384-dim vector)
+#   "float32" - BSON binary vector (subtype 9), 4 bytes per dimension
+#   "int8"    - BSON binary int8 vector + "embedding_scale", 1 byte per dimension
+#   "float16" - packed half floats, 2 bytes per dimension; local backend only,
+#               Atlas $vectorSearch can't index it
+EMBEDDING_FORMATS = ("array", "float32", "int8", "float16")
+ATLAS_FORMATS = ("array", "float32", "int8")
+
+# BSON binary vector subtype and its dtype headers (dtype byte, padding byte)
+VECTOR_SUBTYPE = 9
+_INT8_HEADER = b"\x03\x00"
+_FLOAT32_HEADER = b"\x27\x00"
+
+
+def check_format(storage_format: str) -> str:
+    storage_format = (storage_format or "array").lower()
+    if storage_format not in EMBEDDING_FORMATS:
+        raise ValueError(f"Unknown embedding storage format: {storage_format}")
+    return storage_format
+
+
+def quantize_int8(matrix) -> tuple:
+    """
+    Symmetric per-vector scalar quantization: q = round(x / scale), scale = max|x| / 127.
+    Returns (int8 matrix, float32 scales).
+    """
+    matrix = np.asarray(matrix, dtype=np.float32).reshape(len(matrix), -1)
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+def encode_embeddings(embeddings, storage_format="array") -> List[dict]:
+    """
+    The embedding fields of one chunk doc per vector, e.g.
+    {"embedding": Binary(...), "embedding_format": "int8", "embedding_scale": 0.0031}.
+    Binary formats are built from the raw buffers, without per-element conversion.
+    """
+    storage_format = check_format(storage_format)
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    if matrix.size == 0:
+        return []
+    matrix = matrix.reshape(len(matrix), -1)
+
+    if storage_format == "array":
+        return [{"embedding": row} for row in matrix.tolist()]
+    if storage_format == "float32":
+        rows = matrix.astype("<f4")
+        return [
+            {"embedding": Binary(_FLOAT32_HEADER + row.tobytes(), VECTOR_SUBTYPE), "embedding_format": "float32"}
+            for row in rows
+        ]
+    if storage_format == "float16":
+        rows = matrix.astype("<f2")
+        return [{"embedding": Binary(row.tobytes()), "embedding_format": "float16"} for row in rows]
+
+    quantized, scales = quantize_int8(matrix)
+    return [
+        {
+            "embedding": Binary(_INT8_HEADER + row.tobytes(), VECTOR_SUBTYPE),
+            "embedding_format": "int8",
+            "embedding_scale": float(scale)
+        }
+        for row, scale in zip(quantized, scales)
+    ]
+
+
+def encode_query(query_vector, storage_format="array"):
+    """
+    queryVector for $vectorSearch: binary vectors are queried with the same vector type.
+    """
+    storage_format = check_format(storage_format)
+    if storage_format in ("float32", "int8"):
+        return encode_embeddings([query_vector], storage_format)[0]["embedding"]
+    return np.asarray(query_vector, dtype=np.float32).tolist()
+
+
+def decode_embedding(doc: dict) -> np.ndarray:
+    """
+    float32 vector from a chunk doc in any storage format.
+    """
+    value = doc["embedding"]
+    storage_format = doc.get("embedding_format", "array")
+    if storage_format == "array":
+        return np.asarray(value, dtype=np.float32)
+    raw = bytes(value)
+    if storage_format == "float16":
+        return np.frombuffer(raw, dtype="<f2").astype(np.float32)
+    if storage_format == "float32":
+        return np.frombuffer(raw[2:], dtype="<f4").astype(np.float32)
+    if storage_format == "int8":
+        return np.frombuffer(raw[2:], dtype=np.int8).astype(np.float32) * doc.get("embedding_scale", 1.0)
+    raise ValueError(f"Unknown embedding storage format: {storage_format}")
+
+
+# =============== Migration ===============
+def migrate_embeddings(collection, storage_format: str, batch_size=500) -> int:
+    """
+    Rewrite every chunk doc's embedding in storage_format, in bulk_write batches.
+    Docs already in that format are skipped, so the migration can be re-run
+    or resumed. Returns how many docs were rewritten.
+    """
+    from pymongo import UpdateOne
+
+    storage_format = check_format(storage_format)
+    if storage_format == "array":
+        query = {"embedding_format": {"$exists": True}}
+    else:
+        # $ne also matches legacy docs without the field
+        query = {"embedding_format": {"$ne": storage_format}}
+    query["embedding"] = {"$exists": True}
+
+    cursor = collection.find(query, {"_id": 1, "embedding": 1, "embedding_format": 1, "embedding_scale": 1})
+    migrated = 0
+    batch_ids, batch_vectors = [], []
+
+    def flush():
+        nonlocal migrated
+        if not batch_ids:
+            return
+        fields = encode_embeddings(np.vstack(batch_vectors), storage_format)
+        ops = []
+        for doc_id, new_fields in zip(batch_ids, fields):
+            unset = {k: "" for k in ("embedding_format", "embedding_scale") if k not in new_fields}
+            update = {"$set": new_fields}
+            if unset:
+                update["$unset"] = unset
+            ops.append(UpdateOne({"_id": doc_id}, update))
+        collection.bulk_write(ops, ordered=False)
+        migrated += len(ops)
+        batch_ids.clear()
+        batch_vectors.clear()
+
+    for doc in cursor:
+        batch_ids.append(doc["_id"])
+        batch_vectors.append(decode_embedding(doc))
+        if len(batch_ids) >= batch_size:
+            flush()
+    flush()
+    log_info("EmbeddingsMigrated", f"{migrated} chunk docs rewritten as {storage_format}")
+    return migrated
+
+
+# =============== Recall vs. size report ===============
+def recall_size_report(embeddings, n_queries=200, top_k=10, seed=0) -> List[dict]:
+    """
+    For each storage format: bytes per vector and recall@top_k of exact
+    cosine search over the decoded vectors, against float32 ground truth.
+    Queries are sampled from the embeddings themselves (self-match excluded).
+    """
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    rng = np.random.default_rng(seed)
+    query_rows = rng.choice(len(matrix), size=min(n_queries, len(matrix)), replace=False)
+    queries = matrix[query_rows]
+    k = min(top_k, len(matrix) - 1)
+
+    def top_ids(candidates):
+        sims = queries @ candidates.T
+        sims[np.arange(len(query_rows)), query_rows] = -np.inf
+        return np.argpartition(-sims, k - 1, axis=1)[:, :k]
+
+    truth = top_ids(matrix)
+    report = []
+    for storage_format in EMBEDDING_FORMATS:
+        start = time.perf_counter()
+        docs = encode_embeddings(matrix, storage_format)
+        decoded = np.vstack([decode_embedding(d) for d in docs])
+        round_trip_ms = (time.perf_counter() - start) * 1000
+        found = top_ids(decoded)
+        hits = sum(len(set(t) & set(f)) for t, f in zip(truth, found))
+        report.append({
+            "format": storage_format,
+            # BSON size of the embedding fields of one chunk doc
+            "bytes_per_vector": len(bson_encode(docs[0])) - len(bson_encode({})),
+            "recall_at_k": hits / float(truth.size),
+            "round_trip_ms": round_trip_ms
+        })
+    return report
+
+
+def _load_collection_embeddings(collection, limit: Optional[int] = None) -> np.ndarray:
+    cursor = collection.find({"embedding": {"$exists": True}},
+                             {"_id": 0, "embedding": 1, "embedding_format": 1, "embedding_scale": 1})
+    if limit:
+        cursor = cursor.limit(limit)
+    return np.vstack([decode_embedding(doc) for doc in cursor])
+
+
+if __name__ == "__main__":
+    # python -m pipeline.embedding_storage report
+    # python -m pipeline.embedding_storage migrate int8
+    from pymongo.mongo_client import MongoClient
+    from pymongo.server_api import ServerApi
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "report"
+    chunks = MongoClient(os.getenv("MONGO_URI"), server_api=ServerApi('1'))["testdb"]["chunks"]
+    if command == "migrate":
+        print(migrate_embeddings(chunks, sys.argv[2]))
+    else:
+        for row in recall_size_report(_load_collection_embeddings(chunks, limit=20000)):
+            print(f"{row['format']:8s} {row['bytes_per_vector']:6d} B/vector  "
+                  f"recall@10 {row['recall_at_k']:.4f}  round trip {row['round_trip_ms']:.1f} ms")
@@ -1,13 +1,356 @@
 # pipeline/embedding_utils.py
-from sentence_transformers import SentenceTransformer
-
-def get_embedding_model():
-    return SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-
-def batch_embed_texts(model, texts, batch_size=16):
-    all_embs = []
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i:i+batch_size]
-        embs = model.encode(batch)
-        all_embs.extend(embs)
-    return all_embs
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from typing import List, Union
+
+import numpy as np
+
+from .log_util import log_info, log_error
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+# "torch" => SentenceTransformer, "onnx" / "onnx-int8" => ONNX Runtime export (fp32 / int8 weights)
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+
+
+class EmbeddingService:
+    """
+    One loaded embedding model shared by every pipeline in the process,
+    with dynamic micro-batching for small requests.
+
+    Requests of fewer than max_batch_size texts (typically search queries)
+    are queued; a worker thread takes the first one, keeps collecting for
+    up to batch_window_ms or until max_batch_size texts are waiting, runs one
+    model.encode() for all of them and resolves each request's future with
+    its own rows. Larger requests (ingestion) are already batches and are
+    encoded directly in the caller's thread.
+
+    encode() is a drop-in for SentenceTransformer.encode(); submit() returns
+    a Future and encode_async() can be awaited from coroutines.
+    """
+
+    def __init__(self, model, batch_window_ms=5.0, max_batch_size=32):
+        self.model = model
+        self.batch_window = batch_window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+        self.batched_texts = 0
+        # persistent chunk cache for batch_embed_texts (EmbeddingCache), if configured
+        self.chunk_cache = None
+        # worker processes for large batch_embed_texts jobs (BulkEmbeddingPool), if configured
+        self.bulk_pool = None
+        threading.Thread(target=self._batch_loop, name="embedding-batcher", daemon=True).start()
+
+    def __getattr__(self, name):
+        # everything else (get_sentence_embedding_dimension, tokenizer, ...) comes from the model
+        return getattr(self.model, name)
+
+    # ---------- requests ----------
+    def submit(self, texts: List[str]) -> Future:
+        """
+        Future of a (len(texts) x dim) float32 array.
+        """
+        future = Future()
+        texts = list(texts)
+        if not texts:
+            future.set_result(np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32))
+        elif len(texts) >= self.max_batch_size:
+            try:
+                future.set_result(np.asarray(self.model.encode(texts, batch_size=self.max_batch_size),
+                                             dtype=np.float32))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            self._queue.put((texts, future))
+        with self._stats_lock:
+            self.requests += 1
+        return future
+
+    def encode(self, sentences: Union[str, List[str]], batch_size=None, **kwargs):
+        """
+        Same contract as SentenceTransformer.encode: a str gives one vector,
+        a list gives one row per text. Extra encode options bypass the batcher.
+        """
+        if kwargs:
+            if batch_size is not None:
+                kwargs["batch_size"] = batch_size
+            return self.model.encode(sentences, **kwargs)
+        if isinstance(sentences, str):
+            return self.submit([sentences]).result()[0]
+        return self.submit(sentences).result()
+
+    async def encode_async(self, sentences: List[str]):
+        return await asyncio.wrap_future(self.submit(sentences))
+
+    # ---------- batching ----------
+    def _batch_loop(self):
+        while True:
+            try:
+                self._collect_and_run()
+            except Exception as e:
+                # never let one bad batch end the thread every query encode waits on
+                log_error("EmbeddingBatcherError", repr(e))
+
+    @staticmethod
+    def _take(request) -> bool:
+        """
+        Mark a queued request running; False if its caller already cancelled it.
+        """
+        return request[1].set_running_or_notify_cancel()
+
+    def _collect_and_run(self):
+        request = self._queue.get()
+        if not self._take(request):
+            return
+        pending = [request]
+        n_texts = len(request[0])
+        deadline = time.perf_counter() + self.batch_window
+        while n_texts < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if self._take(request):
+                pending.append(request)
+                n_texts += len(request[0])
+        self._run_batch(pending)
+
+    @staticmethod
+    def _resolve(future: Future, result=None, error=None):
+        try:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        except InvalidStateError:
+            pass
+
+    def _run_batch(self, pending):
+        texts = [text for request_texts, _ in pending for text in request_texts]
+        try:
+            embs = np.asarray(self.model.encode(texts, batch_size=max(len(texts), 1)), dtype=np.float32)
+        except Exception as e:
+            log_error("EmbeddingBatchError", str(e))
+            for _, future in pending:
+                self._resolve(future, error=e)
+            return
+        start = 0
+        for request_texts, future in pending:
+            self._resolve(future, embs[start:start + len(request_texts)])
+            start += len(request_texts)
+        with self._stats_lock:
+            self.batches += 1
+            self.batched_texts += len(texts)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "requests": self.requests,
+                "batches": self.batches,
+                "mean_batch_size": (self.batched_texts / self.batches) if self.batches else 0.0,
+            }
+
+
+def load_embedding_model(backend="torch", model_dir="onnx_model", num_threads=None):
+    """
+    A new, unshared model with an encode() like SentenceTransformer's.
+    The ONNX backends export the model into model_dir on first use and
+    don't load torch once the export exists.
+    """
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend}")
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+
+        return SentenceTransformer(EMBEDDING_MODEL_NAME)
+    from .onnx_embeddings import OnnxEmbeddingModel
+
+    return OnnxEmbeddingModel(EMBEDDING_MODEL_NAME, model_dir, quantize=(backend == "onnx-int8"),
+                              num_threads=num_threads)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_embedding_model(batch_window_ms=5.0, max_batch_size=32, backend="torch", model_dir="onnx_model",
+                        num_threads=None, cache_path=None, cache_max_mb=512, bulk_workers=0,
+                        bulk_threads=1) -> EmbeddingService:
+    """
+    The process-wide EmbeddingService, loading the model on the first call
+    (later calls return the same instance; their settings are ignored).
+    cache_path enables the persistent chunk-embedding cache used by
+    batch_embed_texts, bulk_workers > 0 its multi-process encoding.
+    """
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = EmbeddingService(load_embedding_model(backend, model_dir=model_dir, num_threads=num_threads),
+                                        batch_window_ms=batch_window_ms, max_batch_size=max_batch_size)
+            log_info("EmbeddingModelLoaded", f"{EMBEDDING_MODEL_NAME} on {backend} (batch window "
+                                             f"{batch_window_ms} ms, max batch {max_batch_size})")
+            if cache_path:
+                from .embedding_cache import EmbeddingCache
+
+                # the backend is part of the key: int8 vectors must not be served to an fp32 deployment
+                _service.chunk_cache = EmbeddingCache(cache_path, f"{EMBEDDING_MODEL_NAME}:{backend}",
+                                                      dim=_service.get_sentence_embedding_dimension(),
+                                                      max_bytes=int(cache_max_mb * 1024 * 1024))
+            if bulk_workers:
+                from .bulk_embedding import BulkEmbeddingPool
+
+                _service.bulk_pool = BulkEmbeddingPool(n_workers=bulk_workers, threads_per_worker=bulk_threads,
+                                                       backend=backend, model_dir=model_dir)
+        return _service
+
+
+# MiniLM shape, for sizing batches: hidden size, attention heads, layers, max word pieces
+_HIDDEN, _HEADS, _LAYERS, _MAX_TOKENS = 384, 12, 6, 256
+
+
+def _adaptive_batch_size(n_chars: int, min_size=8, max_size=256, memory_fraction=0.1) -> int:
+    """
+    How many texts of about n_chars characters fit in memory_fraction of
+    the available RAM, from a rough per-text activation estimate (hidden
+    states of every layer plus the attention matrices of one layer).
+    """
+    try:
+        import psutil
+
+        available = psutil.virtual_memory().available
+    except ImportError:
+        return 32
+    tokens = min(_MAX_TOKENS, n_chars // 4 + 2)
+    per_text = 4 * (tokens * _HIDDEN * (_LAYERS + 4) * 4 + _HEADS * tokens * tokens * 2)
+    return int(min(max_size, max(min_size, available * memory_fraction // per_text)))
+
+
+def batch_embed_texts(model, texts, batch_size=None, progress=None, cache=None, pool=None) -> np.ndarray:
+    """
+    Embed texts into one contiguous (len(texts) x dim) float32 array with
+    L2-normalized rows, in input order.
+
+    Texts are encoded shortest first, so each batch holds similar lengths and
+    pads little; rows are written straight into the output at their original
+    positions. batch_size=None sizes each batch from available memory (short
+    texts get bigger batches). progress(done, total, texts_per_second) is
+    called after every batch.
+
+    With an EmbeddingCache (cache=, or the model's chunk_cache) texts seen
+    before are read from it and only the misses are encoded and stored.
+    With a BulkEmbeddingPool (pool=, or the model's bulk_pool) large jobs
+    are encoded by its worker processes, still shortest first.
+    """
+    texts = list(texts)
+    # bulk work doesn't need the shared micro-batcher; use the model directly
+    encoder = model.model if isinstance(model, EmbeddingService) else model
+    cache = cache or getattr(model, "chunk_cache", None)
+    pool = pool or getattr(model, "bulk_pool", None)
+    dim = encoder.get_sentence_embedding_dimension()
+    out = np.empty((len(texts), dim), dtype=np.float32)
+
+    keys, todo = None, np.arange(len(texts))
+    if cache is not None and texts:
+        keys = cache.keys(texts)
+        cached = cache.get_many(keys)
+        for i, vector in cached.items():
+            out[i] = vector
+        todo = np.array([i for i in range(len(texts)) if i not in cached], dtype=np.int64)
+
+    lengths = np.fromiter((len(texts[i]) for i in todo), dtype=np.int64, count=len(todo))
+    order = todo[np.argsort(lengths, kind="stable")]
+    lengths.sort(kind="stable")
+
+    start_time = time.perf_counter()
+    done = 0
+    if pool is not None and len(order) >= pool.min_texts:
+        for rows in pool.imap(texts[i] for i in order):
+            out[order[done:done + len(rows)]] = rows
+            done += len(rows)
+            if progress is not None:
+                progress(len(texts) - len(order) + done, len(texts),
+                         done / max(time.perf_counter() - start_time, 1e-9))
+    while done < len(order):
+        # size for the longest text a maximal batch from here could hold
+        size = batch_size or _adaptive_batch_size(int(lengths[min(done + 255, len(order) - 1)]))
+        rows = order[done:done + size]
+        out[rows] = encoder.encode([texts[i] for i in rows], batch_size=len(rows))
+        done += len(rows)
+        if progress is not None:
+            progress(len(texts) - len(order) + done, len(texts),
+                     done / max(time.perf_counter() - start_time, 1e-9))
+
+    if len(order):
+        encoded = out[order]
+        norms = np.linalg.norm(encoded, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        encoded /= norms
+        out[order] = encoded
+        if keys is not None:
+            cache.put_many([keys[i] for i in order], encoded)
+    return out
+
+
+def benchmark_embedding_service(service: EmbeddingService, n_threads=16, n_requests=512):
+    """
+    Throughput of one-query requests from n_threads threads, through the
+    micro-batcher vs. calling the model directly.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    queries = [f"need a plumber to fix a leaking sink {i}" for i in range(n_requests)]
+    report = {}
+    for name, encode in (("direct", lambda q: service.model.encode([q])), ("batched", lambda q: service.encode([q]))):
+        with ThreadPoolExecutor(max_workers=n_threads) as pool:
+            start = time.perf_counter()
+            list(pool.map(encode, queries))
+            report[f"{name}_per_second"] = n_requests / (time.perf_counter() - start)
+    report.update(service.stats())
+    return report
+
+
+def benchmark_bulk_embedding(model, texts) -> dict:
+    """
+    Time and peak Python allocation of batch_embed_texts vs. the former
+    fixed 16-text slices collected into a list of rows.
+    """
+    import tracemalloc
+
+    encoder = model.model if isinstance(model, EmbeddingService) else model
+    report = {}
+
+    def fixed_slices():
+        rows = []
+        for i in range(0, len(texts), 16):
+            rows.extend(encoder.encode(texts[i:i + 16]))
+        return np.array([row.tolist() for row in rows], dtype=np.float32)
+
+    for name, run in (("fixed_16", fixed_slices), ("bucketed", lambda: batch_embed_texts(model, texts))):
+        tracemalloc.start()
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        report[name] = {"texts_per_second": len(texts) / elapsed, "peak_mb": peak / 1e6}
+    return report
+
+
+if __name__ == "__main__":
+    # python -m pipeline.embedding_utils [pdf_path]
+    import sys
+
+    service = get_embedding_model()
+    print(benchmark_embedding_service(service))
+    if len(sys.argv) > 1:
+        from .chunking_utils import read_and_chunk_pdf_adaptive
+
+        print(benchmark_bulk_embedding(service, read_and_chunk_pdf_adaptive(sys.argv[1]) * 20))
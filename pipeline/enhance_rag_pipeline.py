@@ -1,21 +1,49 @@
 # pipeline/enhanced_rag_pipeline.py
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import openai
-from typing import List
+from typing import List, Optional
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
 import numpy as np
 
-from .embedding_utils import get_embedding_model
+from .embedding_utils import get_embedding_model, EMBEDDING_MODEL_NAME
+from .vector_store import build_vector_store
+from .llm_cache import LLMResponseCache
+from .service_router import EmbeddingServiceRouter
+from .service_catalog import ServiceCatalog
+from .reranker import CrossEncoderReranker, RERANK_MODES, rank_score, score_sort
+from .lexical_index import BM25Index, reciprocal_rank_fusion
+from .supplier_profiles import SupplierProfileIndex
+from .vector_partitions import PartitionedVectorStore
+from .search_snapshot import SearchChangeLog, SearchSnapshot
 from .log_util import log_info, log_error, log_event
 
+# model used by the routing / decomposition / multi-query calls (part of the cache key)
+LLM_MODEL = "gpt-3.5-turbo"
+
+# "vector" => embeddings only, "hybrid" => BM25 over chunk_text fused with the vector hits
+RETRIEVAL_MODES = ("vector", "hybrid")
+# reciprocal rank fusion constant (score = sum of 1 / (RRF_K + rank))
+RRF_K = 60
+# hybrid mode: min BM25 score for a chunk that only the lexical side found
+HYBRID_MIN_BM25 = 2.0
+
 # =============== OLD CODE: generate_multi_queries + decompose_query ===============
-def generate_multi_queries(user_query, num_queries=3, openai_api_key=None, log_event_fn=None):
+def generate_multi_queries(user_query, num_queries=3, openai_api_key=None, log_event_fn=None, cache=None):
     """
     Use OpenAI or any LLM to generate multiple variants of the user query.
+    If a cache (LLMResponseCache) is given, repeated queries skip the LLM call.
     """
     if not openai_api_key:
         return [user_query]
 
+    if cache is not None:
+        cached = cache.get("generate_multi_queries", LLM_MODEL, user_query, extra=num_queries)
+        if cached is not None:
+            return cached
+
     try:
         openai.api_key = openai_api_key
 
@@ -28,7 +56,7 @@ def generate_multi_queries(user_query, num_queries=3, openai_api_key=None, log_e
         Separate each query by a newline.
         """
         response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
+            model=LLM_MODEL,
             messages=[
                 {"role": "system", "content": "You are a helpful query rewriter."},
                 {"role": "user", "content": prompt},
@@ -43,19 +71,27 @@ def generate_multi_queries(user_query, num_queries=3, openai_api_key=None, log_e
         else:
             log_info("MultiQueryGenerated", f"Original: {user_query}, Queries: {multi_queries}")
 
+        if cache is not None:
+            cache.set("generate_multi_queries", LLM_MODEL, user_query, multi_queries, extra=num_queries)
         return multi_queries
     except Exception as e:
         log_error("UnexpectedError", f"generate_multi_queries: {str(e)}")
         return [user_query]
 
 
-def decompose_query(user_query, openai_api_key=None, log_event_fn=None):
+def decompose_query(user_query, openai_api_key=None, log_event_fn=None, cache=None):
     """
     Break a complex user query into sub-queries.
+    If a cache (LLMResponseCache) is given, repeated queries skip the LLM call.
     """
     if not openai_api_key:
         return [user_query]
 
+    if cache is not None:
+        cached = cache.get("decompose_query", LLM_MODEL, user_query)
+        if cached is not None:
+            return cached
+
     decomposition_prompt = f"""
     You are a helpful assistant. 
     The user query is: '{user_query}'
@@ -68,7 +104,7 @@ def decompose_query(user_query, openai_api_key=None, log_event_fn=None):
 
 
         resp = client.chat.completions.create(
-            model="gpt-3.5-turbo",
+            model=LLM_MODEL,
             messages=[{"role": "user", "content": decomposition_prompt}],
             temperature=0.7
         )
@@ -80,6 +116,8 @@ def decompose_query(user_query, openai_api_key=None, log_event_fn=None):
         else:
             log_info("QueryDecomposed", f"Original: {user_query}, Sub-queries: {sub_queries}")
 
+        if cache is not None:
+            cache.set("decompose_query", LLM_MODEL, user_query, sub_queries)
         return sub_queries
     except openai.error.OpenAIError as e:
         log_error("OpenAIError", f"decompose_query: {str(e)}")
@@ -90,14 +128,22 @@ def decompose_query(user_query, openai_api_key=None, log_event_fn=None):
 
 
 # =============== LLM-based routing ===============
-def route_query_llm(user_query: str, openai_api_key: str, known_services: List[str]):
+def route_query_llm(user_query: str, openai_api_key: str, known_services: List[str], cache=None):
     """
     LLM-based approach: ask GPT to pick the single best service from known_services, or 'all'.
+    Cached answers are keyed by the service list too, so a new service
+    never reuses a routing decision made without it.
     """
     if not openai_api_key or not known_services:
         # fallback to 'all'
         return "all"
 
+    services_key = sorted(known_services)
+    if cache is not None:
+        cached = cache.get("route_query_llm", LLM_MODEL, user_query, extra=services_key)
+        if cached is not None:
+            return cached
+
     prompt = f"""
     We have these services: {', '.join(known_services)}.
     The user query is: '{user_query}'
@@ -110,7 +156,7 @@ def route_query_llm(user_query: str, openai_api_key: str, known_services: List[s
         client = openai.Client(api_key=openai_api_key)
 
         resp = client.chat.completions.create(
-            model="gpt-3.5-turbo",
+            model=LLM_MODEL,
             messages=[
                 {"role": "system", "content":"You are a role classifier."},
                 {"role":"user","content":prompt}
@@ -126,6 +172,8 @@ def route_query_llm(user_query: str, openai_api_key: str, known_services: List[s
                 break
         if not match:
             match = "all"
+        if cache is not None:
+            cache.set("route_query_llm", LLM_MODEL, user_query, match, extra=services_key)
         return match
     except openai.error.OpenAIError as e:
         log_error("OpenAIError", f"route_query_llm: {str(e)}")
@@ -146,7 +194,7 @@ def re_rank_results_llm(user_query: str, results: List[dict], top_k=3, openai_ap
 
     if not openai_api_key:
         # fallback
-        sorted_res = sorted(results, key=lambda x: x["score"], reverse=True)
+        sorted_res = sorted(results, key=rank_score, reverse=True)
         return sorted_res[:top_k]
 
     # Build a text listing the docs
@@ -180,18 +228,31 @@ def re_rank_results_llm(user_query: str, results: List[dict], top_k=3, openai_ap
         # We do a naive parse. e.g. "1, 2, 3" or "Document 2, then 1, then 3" etc.
         # If we fail to parse, fallback
         # For simplicity, we fallback right away
-        sorted_res = sorted(results, key=lambda x: x["score"], reverse=True)
+        sorted_res = sorted(results, key=rank_score, reverse=True)
         return sorted_res[:top_k]
     except openai.error.OpenAIError as e:
         log_error("OpenAIError", f"re_rank_results_llm: {str(e)}")
-        return sorted(results, key=lambda x: x["score"], reverse=True)[:top_k]
+        return sorted(results, key=rank_score, reverse=True)[:top_k]
     except Exception as e:
         log_error("UnexpectedError", f"re_rank_results_llm: {str(e)}")
-        return sorted(results, key=lambda x: x["score"], reverse=True)[:top_k]
+        return sorted(results, key=rank_score, reverse=True)[:top_k]
 
 
 # =============== Structured Output Summaries ===============
-from .structured_output import ask_chatgpt_structured
+from .structured_output import (
+    ask_chatgpt_structured, ask_chatgpt_structured_batch, SUMMARY_MODEL, SUMMARY_PROMPT_VERSION
+)
+
+# how get_structured_summaries produces per-supplier summaries
+SUMMARY_MODES = ("batch", "concurrent")
+
+
+def _in_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
 
 
 # =============== The EnhancedRAGPipeline Class ===============
@@ -208,7 +269,29 @@ class EnhancedRAGPipeline:
                  mongo_uri: str, 
                  openai_api_key: str, 
                  db_session_factory,  # function to create DB session
-                 index_name="default"):
+                 index_name="default",
+                 concurrent_stages=False,
+                 vector_backend="atlas",
+                 llm_cache=None,
+                 router="embedding",
+                 router_min_confidence=0.5,
+                 service_catalog=None,
+                 rerank="llm",
+                 reranker=None,
+                 summary_cache=None,
+                 retrieval="vector",
+                 lexical_index=None,
+                 hybrid_min_bm25=HYBRID_MIN_BM25,
+                 embedding_format="array",
+                 vector_store_options=None,
+                 two_stage=False,
+                 profile_top_m=20,
+                 profile_index=None,
+                 partition_by_service=False,
+                 partition_max_bytes=256 * 1024 * 1024,
+                 snapshot_path=None,
+                 snapshot_interval=0,
+                 semantic_cache=None):
         self.mongo_uri = mongo_uri
         self.client = MongoClient(mongo_uri, server_api=ServerApi('1'))
         self.db_mongo = self.client["testdb"]
@@ -216,41 +299,276 @@ class EnhancedRAGPipeline:
         self.embedding_model = get_embedding_model()
         self.openai_api_key = openai_api_key
         self.index_name = index_name
+        # warm start: restore the search-side state saved by an earlier process and
+        # catch up from the shared change log, instead of rebuilding it all
+        self.snapshot, self.changelog, snapshot = None, None, None
+        if snapshot_path:
+            self.changelog = SearchChangeLog(self.db_mongo["search_changelog"])
+            self.snapshot = SearchSnapshot(snapshot_path, meta={
+                "embedding_model": EMBEDDING_MODEL_NAME, "vector_backend": vector_backend
+            })
+            snapshot = self.snapshot.read()
+        states = snapshot["components"] if snapshot else {}
+        # "atlas" => $vectorSearch, "local" => in-process NumPy index, "hnsw" => in-process ANN graph,
+        # "sharded" => exact search over local shard processes
+        self.vector_store = build_vector_store(
+            vector_backend, self.collection, index_name=index_name, storage_format=embedding_format,
+            load="vector_store" not in states, **(vector_store_options or {})
+        )
         self.db_session_factory = db_session_factory
+        # run independent LLM / DB stages of advanced_search concurrently
+        self.concurrent_stages = concurrent_stages
+        # cache for route / decompose / multi-query answers (memory-only by default)
+        self.llm_cache = llm_cache if llm_cache is not None else LLMResponseCache()
+        # structured summaries keyed by (query, chunk texts, prompt version, model), tagged per supplier
+        self.summary_cache = summary_cache if summary_cache is not None else LLMResponseCache(
+            max_entries=2048, ttl_seconds=6 * 3600
+        )
+        # final results of near-duplicate queries (a SemanticResultCache; None => off)
+        self.semantic_cache = semantic_cache
+        # "embedding" => nearest-centroid router with LLM fallback, "llm" => always ask GPT
+        self.service_router = None
+        if router == "embedding":
+            self.service_router = EmbeddingServiceRouter(
+                self.embedding_model, min_confidence=router_min_confidence, state=states.get("service_router")
+            )
+        # in-memory services + service -> suppliers map, kept current by ORM events
+        if service_catalog is None:
+            service_catalog = ServiceCatalog(db_session_factory)
+            service_catalog.attach()
+            if "service_catalog" not in states:
+                service_catalog.load()
+        self.service_catalog = service_catalog
+        self.service_catalog.subscribe(self._on_catalog_change)
+        # routed searches scan only the chosen service's shard of the vectors
+        if partition_by_service:
+            self.vector_store = PartitionedVectorStore(
+                self.vector_store, self.collection, self.service_catalog, max_bytes=partition_max_bytes
+            )
+        # default re-rank mode ("cross_encoder", "score" or "llm"); requests may override it
+        if rerank not in RERANK_MODES:
+            raise ValueError(f"Unknown rerank mode: {rerank}")
+        self.rerank = rerank
+        self._reranker = reranker
+        self._reranker_lock = threading.Lock()
+        # lexical side of hybrid retrieval, rebuilt from the chunks collection on startup
+        if retrieval not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {retrieval}")
+        self.retrieval = retrieval
+        self.lexical_index = lexical_index
+        self.hybrid_min_bm25 = hybrid_min_bm25
+        if retrieval == "hybrid" and lexical_index is None:
+            self.lexical_index = BM25Index()
+            if "lexical_index" not in states:
+                self.lexical_index.load_from_collection(self.collection)
+        self._lexical_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="lexical-search")
+        # two-stage retrieval: rank suppliers by profile vector first, then
+        # score only the top profile_top_m suppliers' chunks
+        self.two_stage = two_stage
+        self.profile_top_m = profile_top_m
+        self.profile_index = profile_index
+        if two_stage and profile_index is None:
+            self.profile_index = SupplierProfileIndex(self.db_mongo["supplier_profiles"])
+            if "profile_index" not in states and not self.profile_index.load_from_collection():
+                # first start with profiles enabled: backfill from the existing chunks
+                self.profile_index.rebuild_from_chunks(self.collection)
+        if snapshot:
+            self._warm_start(states, snapshot["header"]["position"])
+        if self.snapshot is not None and snapshot_interval:
+            self.snapshot.start_timer(self.save_snapshot, snapshot_interval)
+
+    # ---------- snapshots ----------
+    def _snapshot_components(self) -> dict:
+        return {
+            "vector_store": getattr(self.vector_store, "base", self.vector_store),
+            "service_catalog": self.service_catalog,
+            "service_router": self.service_router,
+            "lexical_index": self.lexical_index,
+            "profile_index": self.profile_index,
+            "llm_cache": self.llm_cache,
+            "summary_cache": self.summary_cache,
+            "semantic_cache": self.semantic_cache,
+        }
+
+    def save_snapshot(self):
+        """
+        Write the search-side state to the snapshot file (on a timer and at shutdown).
+        The change-log position is read first, so a warm start replays at
+        least every change the snapshot might have missed.
+        """
+        if self.snapshot is None:
+            return None
+        position = self.changelog.position()
+        return self.snapshot.save(self._snapshot_components(), position)
+
+    def _warm_start(self, states: dict, position):
+        components = self._snapshot_components()
+        components.pop("service_router")  # restored by its constructor
+        restored = SearchSnapshot.restore(components, states)
+
+        # anything whose state didn't restore was not loaded either: load it cold
+        cold_loads = {
+            "vector_store": lambda: components["vector_store"].load_from_collection(),
+            "service_catalog": self.service_catalog.load,
+            "lexical_index": lambda: self.lexical_index.load_from_collection(self.collection),
+            "profile_index": lambda: self.profile_index.load_from_collection(),
+        }
+        for name, load in cold_loads.items():
+            component = components[name]
+            if name in states and name not in restored and hasattr(component, "restore_state"):
+                load()
+
+        entries = self.changelog.since(position)
+        supplier_ids = {e["supplier_id"] for e in entries if e.get("kind") == "supplier"}
+        if any(e.get("kind") == "catalog" for e in entries):
+            self.service_catalog.load()
+            self.llm_cache.invalidate("route_query_llm")
+        if supplier_ids:
+            self._refresh_suppliers(supplier_ids)
+        log_info("SearchWarmStart", f"restored {restored}; replayed {len(entries)} changes "
+                                    f"({len(supplier_ids)} suppliers)")
+
+    def _refresh_suppliers(self, supplier_ids):
+        """
+        Re-read changed suppliers from Mongo into the restored in-memory structures.
+        """
+        store = getattr(self.vector_store, "base", self.vector_store)
+        if hasattr(store, "refresh_suppliers"):
+            store.refresh_suppliers(supplier_ids)
+        if self.lexical_index is not None:
+            texts = {sid: [] for sid in supplier_ids}
+            for doc in self.collection.find({"supplier_id": {"$in": list(supplier_ids)}},
+                                            {"_id": 0, "supplier_id": 1, "chunk_text": 1}):
+                texts[doc["supplier_id"]].append(doc.get("chunk_text", ""))
+            for supplier_id, chunk_texts in texts.items():
+                self.lexical_index.replace_supplier(supplier_id, chunk_texts)
+        if self.profile_index is not None:
+            self.profile_index.refresh_suppliers(supplier_ids)
+        for supplier_id in supplier_ids:
+            self.invalidate_supplier(supplier_id)
+
+    def _record_change(self, kind: str, **fields):
+        if self.changelog is not None:
+            self.changelog.append(kind, **fields)
+
+    def _on_catalog_change(self, event_name: str, **details):
+        """
+        Drop cached routing answers whenever the services table changes and
+        give new services a centroid in the embedding router right away.
+        Changes picked up by a catalog reload were logged by the worker that made them.
+        """
+        if not details.get("reloaded"):
+            self._record_change("catalog", event=event_name)
+        if event_name == "service_added":
+            self.llm_cache.invalidate("route_query_llm")
+            if self.service_router is not None:
+                self.service_router.add_service(details["name"], details["description"])
+        elif event_name == "service_removed":
+            self.llm_cache.invalidate("route_query_llm")
+        if self.semantic_cache is not None:
+            if event_name in ("link_added", "link_removed"):
+                self.semantic_cache.invalidate_supplier(details["supplier_id"], services=[details["name"]])
+            else:
+                # the set of services changed, so cached routing may be stale
+                self.semantic_cache.clear()
+
+    def on_supplier_ingested(self, supplier_id: str, chunk_texts: List[str], embeddings=None,
+                             pdf_summary=None, skills=None):
+        """
+        Called by the ingestion functions once a supplier's chunks were replaced
+        in the vector store: update the lexical index and the supplier profile,
+        and drop stale caches.
+        """
+        if self.lexical_index is not None:
+            self.lexical_index.replace_supplier(supplier_id, chunk_texts)
+        if self.profile_index is not None and embeddings is not None:
+            self.profile_index.update(supplier_id, chunk_embeddings=np.asarray(embeddings, dtype=np.float32))
+        self._update_profile_texts(supplier_id, pdf_summary=pdf_summary, skills=skills)
+        self.invalidate_supplier(supplier_id)
+        self._record_change("supplier", supplier_id=supplier_id)
+
+    def update_supplier_profile(self, supplier_id: str, pdf_summary=None, skills=None):
+        """
+        Refresh the summary / skills parts of a supplier's profile vector
+        (one encode call for both). Empty values leave that part unchanged.
+        """
+        if self._update_profile_texts(supplier_id, pdf_summary=pdf_summary, skills=skills):
+            self.invalidate_supplier(supplier_id)
+            self._record_change("supplier", supplier_id=supplier_id)
+
+    def _update_profile_texts(self, supplier_id: str, pdf_summary=None, skills=None) -> bool:
+        if self.profile_index is None:
+            return False
+        texts = {}
+        if pdf_summary:
+            texts["summary"] = pdf_summary
+        if skills:
+            texts["skills"] = ", ".join(skills) if isinstance(skills, (list, tuple)) else str(skills)
+        if not texts:
+            return False
+        embs = dict(zip(texts, self.embedding_model.encode(list(texts.values()))))
+        self.profile_index.update(
+            supplier_id, summary_embedding=embs.get("summary"), skills_embedding=embs.get("skills")
+        )
+        return True
+
+    def invalidate_supplier(self, supplier_id: str):
+        """
+        Called after a supplier re-ingests: drop everything derived from its old chunks.
+        """
+        self.summary_cache.invalidate_tag(supplier_id)
+        if self.semantic_cache is not None:
+            self.semantic_cache.invalidate_supplier(
+                supplier_id, services=self.service_catalog.services_for_supplier(supplier_id)
+            )
 
     def _get_known_services(self):
         """
-        Access Postgres to get the list of services stored in 'services' table.
-        We'll just return their name in a list.
+        Names of all rows in the 'services' table (from the in-memory catalog).
         """
-        db = self.db_session_factory()
-        try:
-            from models import Service
-            rows = db.query(Service.name).all()
-            # rows is list of (name,) tuples
-            svc_names = [r[0].lower() for r in rows]
-            return svc_names
-        finally:
-            db.close()
+        return self.service_catalog.service_names()
 
     def _get_suppliers_for_service(self, service_name: str):
         """
-        Return a set/list of supplier_ids from the 'supplier_services' 
-        association that match service_name.
-        If the service doesn't exist, returns an empty list => means no match.
+        Return the set of supplier_ids linked to service_name in 'supplier_services'.
+        If the service doesn't exist, returns an empty set => means no match.
         """
-        db = self.db_session_factory()
-        try:
-            from repository import get_service_by_name, get_suppliers_for_service
-            svc_obj = get_service_by_name(db, service_name.lower())
-            if not svc_obj:
-                return []
-            supplier_ids = get_suppliers_for_service(db, service_name.lower())
-            return supplier_ids
-        finally:
-            db.close()
+        return self.service_catalog.suppliers_for(service_name)
+
+    def _route(self, user_query: str, known_services: List[str]) -> str:
+        """
+        Pick the service for a query: the embedding router when it is
+        confident enough, otherwise route_query_llm.
+        """
+        if self.service_router is not None:
+            descriptions = self.service_catalog.descriptions()
+            self.service_router.sync({n: descriptions.get(n, "") for n in known_services})
+            chosen, confidence = self.service_router.route(user_query)
+            if chosen is not None and chosen in known_services:
+                log_info("EmbeddingRouter", f"{chosen} (cosine {confidence:.2f})")
+                return chosen
+            log_info("EmbeddingRouter", f"below threshold (cosine {confidence:.2f}), asking LLM")
+        return route_query_llm(user_query, self.openai_api_key, known_services, cache=self.llm_cache)
+
+    def advanced_search(self, user_query: str, top_k=3, concurrent=None, rerank=None):
+        """
+        Run the full search. With concurrent=True (or self.concurrent_stages)
+        the stages are scheduled by advanced_search_async instead of one after
+        another; both paths return the same results. Called from a thread
+        that is already running an event loop, it takes the serial path
+        (asyncio.run can't nest); async callers should await
+        advanced_search_async instead.
+        rerank overrides the pipeline's default re-rank mode for this call.
+        """
+        if concurrent is None:
+            concurrent = self.concurrent_stages
+        if concurrent and not _in_event_loop():
+            return asyncio.run(self.advanced_search_async(user_query, top_k=top_k, rerank=rerank))
+
+        query_vector, cached, generation = self._cached_search(user_query, top_k, rerank)
+        if cached is not None:
+            return cached
 
-    def advanced_search(self, user_query: str, top_k=3):
         # 1) known services from DB
         known_services = self._get_known_services()
         if not known_services:
@@ -258,7 +576,7 @@ class EnhancedRAGPipeline:
             return []
 
         # 2) route
-        chosen_service = route_query_llm(user_query, self.openai_api_key, known_services)
+        chosen_service = self._route(user_query, known_services)
         log_info("RoutingResult", f"Chosen service: {chosen_service}")
         if chosen_service == "all" or chosen_service not in known_services:
             return []
@@ -269,19 +587,143 @@ class EnhancedRAGPipeline:
             # no suppliers => fallback
             return []
         # 3) decomposition
-        sub_queries = decompose_query(user_query, self.openai_api_key, log_event_fn=log_event) or [user_query] 
+        sub_queries = decompose_query(user_query, self.openai_api_key, log_event_fn=log_event, cache=self.llm_cache) or [user_query] 
 
         # 4) multi-query expansions on the first sub-query
-        expansions = generate_multi_queries(sub_queries[0], num_queries=2, openai_api_key=self.openai_api_key, log_event_fn=log_event)
+        expansions = generate_multi_queries(sub_queries[0], num_queries=2, openai_api_key=self.openai_api_key, log_event_fn=log_event, cache=self.llm_cache)
+
+        # 5) gather docs from vector DB for every expansion + sub-query
+        # in one embedding call and one batched search => combine => re-rank.
+        # Only suppliers offering the chosen service are searched.
+        queries = self._retrieval_queries(sub_queries, expansions)
+        all_results = self._vector_search_many(
+            queries, top_k=top_k*2, supplier_ids=valid_supplier_ids, service=chosen_service,
+            known_vectors=self._known_vectors(user_query, query_vector)
+        )
+
+        results = self._merge_and_rank(user_query, all_results, valid_supplier_ids, top_k, rerank)
+        self._cache_search(query_vector, top_k, rerank, chosen_service, results, generation)
+        return results
+
+    def _cached_search(self, user_query: str, top_k: int, rerank=None):
+        """
+        (query embedding, cached results of a near-duplicate query or None,
+        cache generation to store this search's results under).
+        """
+        if self.semantic_cache is None:
+            return None, None, None
+        # read before anything is searched, so an invalidation during the search is noticed
+        generation = self.semantic_cache.generation
+        query_vector = self.embedding_model.encode([user_query])[0]
+        cached = self.semantic_cache.get(query_vector, extra=(top_k, rerank or self.rerank))
+        if cached is not None:
+            log_info("SemanticCacheHit", user_query)
+        return query_vector, cached, generation
+
+    def _cache_search(self, query_vector, top_k: int, rerank, service: str, results: list, generation=None):
+        if self.semantic_cache is None or not results:
+            return
+        self.semantic_cache.set(
+            query_vector, results, extra=(top_k, rerank or self.rerank),
+            supplier_ids=[r["supplier_id"] for r in results if "supplier_id" in r], service=service,
+            generation=generation
+        )
 
-        # 5) gather docs from vector DB
-        # We'll do a simple gather from expansions => combine => re-rank
-        all_results = []
-        for eq in expansions:
-            partial = self._vector_search(eq, top_k=top_k*2)
-            all_results.extend(partial)
+    @staticmethod
+    def _known_vectors(user_query: str, query_vector) -> Optional[dict]:
+        # the raw query was already embedded for the cache lookup
+        return None if query_vector is None else {user_query: query_vector}
 
-        # 5.5) Filter out docs whose supplier_id not in valid_supplier_ids
+    async def advanced_search_async(self, user_query: str, top_k=3, rerank=None):
+        """
+        Same stages as advanced_search, scheduled by their dependencies:
+
+            known services -> route -> suppliers for service -> vector search on the raw query (speculative)
+            decompose -> multi-query -> (+ suppliers for service) -> one batched vector search
+
+        Searches are pre-filtered to the routed suppliers, so they wait for the
+        (cheap) routing chain but never for the LLM chain unless they need its
+        queries. End-to-end latency is roughly the slower chain instead of the
+        sum of every call.
+        Blocking OpenAI / Postgres / Mongo calls run in worker threads.
+        """
+        def stage(fn, *args, **kwargs):
+            return asyncio.create_task(asyncio.to_thread(fn, *args, **kwargs))
+
+        query_vector, cached, generation = await asyncio.to_thread(self._cached_search, user_query, top_k, rerank)
+        if cached is not None:
+            return cached
+
+        async def route_chain():
+            known_services = await asyncio.to_thread(self._get_known_services)
+            if not known_services:
+                return None, None
+            chosen_service = await asyncio.to_thread(self._route, user_query, known_services)
+            log_info("RoutingResult", f"Chosen service: {chosen_service}")
+            if chosen_service == "all" or chosen_service not in known_services:
+                return None, None
+            return chosen_service, set(await asyncio.to_thread(self._get_suppliers_for_service, chosen_service))
+
+        async def expansion_chain():
+            sub_queries = await asyncio.to_thread(
+                decompose_query, user_query, self.openai_api_key,
+                log_event_fn=log_event, cache=self.llm_cache
+            ) or [user_query]
+            expansions = await asyncio.to_thread(
+                generate_multi_queries, sub_queries[0], num_queries=2,
+                openai_api_key=self.openai_api_key, log_event_fn=log_event, cache=self.llm_cache
+            )
+            return self._retrieval_queries(sub_queries, expansions)
+
+        async def speculative_search():
+            # The raw query is what the expansion chain falls back to, so its
+            # vector search starts once routing is done, without waiting for two LLM calls.
+            service, supplier_ids = await routing
+            if not supplier_ids:
+                return []
+            return await asyncio.to_thread(
+                self._vector_search, user_query, top_k=top_k*2, supplier_ids=supplier_ids, service=service,
+                known_vectors=self._known_vectors(user_query, query_vector)
+            )
+
+        routing = asyncio.create_task(route_chain())
+        speculative = asyncio.create_task(speculative_search())
+        expanding = asyncio.create_task(expansion_chain())
+        pending = [speculative, routing, expanding]
+        try:
+            chosen_service, valid_supplier_ids = await routing
+            if not valid_supplier_ids:
+                return []
+
+            queries = await expanding
+            rest = [q for q in queries if q != user_query]
+            per_query = {}
+            if rest:
+                batch = stage(self._vector_search_batch, rest, top_k=top_k*2,
+                              supplier_ids=valid_supplier_ids, service=chosen_service)
+                pending.append(batch)
+                per_query.update(zip(rest, await batch))
+            if user_query in queries:
+                per_query[user_query] = await speculative
+            # merge in query order, so the result matches the serial path
+            all_results = self._merge_query_results(queries, [per_query[q] for q in queries])
+        finally:
+            for task in pending:
+                if not task.done():
+                    task.cancel()
+
+        results = await asyncio.to_thread(
+            self._merge_and_rank, user_query, all_results, valid_supplier_ids, top_k, rerank
+        )
+        self._cache_search(query_vector, top_k, rerank, chosen_service, results, generation)
+        return results
+
+    def _merge_and_rank(self, user_query: str, all_results: list, valid_supplier_ids: set, top_k: int, rerank=None):
+        """
+        Shared tail of both search paths: service filter, supplier dedup, re-rank.
+        """
+        # 5.5) The search is already pre-filtered; this only guards against a
+        # backend that ignores the filter.
         # e.g. a doc from a supplier who doesn't offer 'electrician' => skip
         filtered_by_service = []
         for doc in all_results:
@@ -291,52 +733,188 @@ class EnhancedRAGPipeline:
                 
         # 6) deduplicate by supplier_id
         deduped_by_supplier = {}
-        for r in all_results:
+        for r in filtered_by_service:
             if "supplier_id" not in r:
                 continue
             sup = r["supplier_id"]
             # if we haven't stored that supplier yet, or if we want the best score chunk
-            if sup not in deduped_by_supplier or r["score"] > deduped_by_supplier[sup]["score"]:
+            if sup not in deduped_by_supplier or rank_score(r) > rank_score(deduped_by_supplier[sup]):
                 deduped_by_supplier[sup] = r
         final_list = list(deduped_by_supplier.values())
         
         # 6.5) re-rank
-        final = re_rank_results_llm(user_query, final_list, top_k=top_k, openai_api_key=self.openai_api_key)
-        return final
-
-    def _vector_search(self, query_text: str, top_k=3, min_score=0.6):
-        q_emb = self.embedding_model.encode([query_text])[0].tolist()
-        pipeline = [
-            {
-                "$vectorSearch": {
-                    "index": self.index_name,
-                    "queryVector": q_emb,
-                    "path": "embedding",
-                    "limit": top_k,
-                    "numCandidates": 50
-                }
-            },
-            {
-                "$project":{
-                    "_id":0,
-                    "supplier_id":1,
-                    "chunk_text":1,
-                    "score":{"$meta":"vectorSearchScore"}
-                }
-            }
-        ]
-        docs = list(self.collection.aggregate(pipeline))
+        return self._rerank(user_query, final_list, top_k, rerank or self.rerank)
+
+    def _get_reranker(self) -> CrossEncoderReranker:
+        # loaded on first use, so pipelines that never use it don't pay for the model
+        with self._reranker_lock:
+            if self._reranker is None:
+                self._reranker = CrossEncoderReranker()
+            return self._reranker
+
+    def _rerank(self, user_query: str, candidates: list, top_k: int, mode: str):
+        """
+        "cross_encoder" => local batched cross-encoder, "llm" => re_rank_results_llm,
+        "score" => sort by vector score.
+        """
+        if mode not in RERANK_MODES:
+            raise ValueError(f"Unknown rerank mode: {mode}")
+        if mode == "cross_encoder":
+            try:
+                return self._get_reranker().rerank(user_query, candidates, top_k=top_k)
+            except Exception as e:
+                log_error("RerankError", f"cross_encoder: {str(e)}")
+                return score_sort(candidates, top_k=top_k)
+        if mode == "llm":
+            return re_rank_results_llm(user_query, candidates, top_k=top_k, openai_api_key=self.openai_api_key)
+        return score_sort(candidates, top_k=top_k)
+
+    def _vector_search(self, query_text: str, top_k=3, min_score=0.6, supplier_ids=None, service=None,
+                       known_vectors=None):
+        return self._vector_search_batch(
+            [query_text], top_k=top_k, min_score=min_score, supplier_ids=supplier_ids, service=service,
+            known_vectors=known_vectors
+        )[0]
+
+    def _vector_search_batch(self, query_texts: List[str], top_k=3, min_score=0.6, supplier_ids=None, service=None,
+                             known_vectors=None):
+        """
+        Embed all queries in one encode call and run them as one batched search.
+        supplier_ids restricts the search to those suppliers' chunks; with
+        partition_by_service, service picks the shard that is scanned.
+        With two_stage, each query's chunk search only covers the suppliers
+        whose profile vectors rank in its own top profile_top_m, so a query's
+        results don't depend on which other queries share the batch.
+        In hybrid mode BM25 runs for the same queries in parallel and each
+        query's two rankings are fused (see _fuse_hybrid).
+        known_vectors ({query text: embedding}) skips encoding those queries.
+        Returns one result list per query, in order.
+        """
+        if not query_texts:
+            return []
+        query_texts = list(query_texts)
+        lexical = None
+        if self.retrieval == "hybrid" and self.lexical_index is not None:
+            lexical = self._lexical_executor.submit(
+                self.lexical_index.search_many, query_texts, top_k=top_k, supplier_ids=supplier_ids
+            )
+        known_vectors = known_vectors or {}
+        missing = list(dict.fromkeys(q for q in query_texts if q not in known_vectors))
+        encoded = dict(zip(missing, self.embedding_model.encode(missing))) if missing else {}
+        q_embs = np.asarray(
+            [known_vectors[q] if q in known_vectors else encoded[q] for q in query_texts], dtype=np.float32
+        )
+        if self.two_stage and self.profile_index is not None and len(self.profile_index):
+            # stage 1: each query's best suppliers by profile vector; stage 2 only
+            # scores their chunks, one batched search per distinct supplier set
+            selected, _ = self.profile_index.top_suppliers(
+                q_embs, top_m=self.profile_top_m, supplier_ids=supplier_ids
+            )
+            by_selection = {}
+            for i, chosen in enumerate(selected):
+                by_selection.setdefault(frozenset(chosen), []).append(i)
+            groups = list(by_selection.items())
+        else:
+            groups = [(supplier_ids, list(range(len(query_texts))))]
+        per_query = [None] * len(query_texts)
+        for chunk_supplier_ids, rows in groups:
+            for i, docs in zip(rows, self._search_chunks(q_embs[rows], top_k, chunk_supplier_ids, service)):
+                per_query[i] = docs
         # Filter out docs below the threshold
-        results = [d for d in docs if d["score"] >= min_score]
-        return results
+        passed = [[d for d in docs if d["score"] >= min_score] for docs in per_query]
+        if lexical is None:
+            return passed
+        return [
+            self._fuse_hybrid(vector_docs, lexical_docs, top_k, min_bm25=self.hybrid_min_bm25, all_vector_docs=docs)
+            for vector_docs, lexical_docs, docs in zip(passed, lexical.result(), per_query)
+        ]
+
+    def _search_chunks(self, q_embs, top_k: int, supplier_ids, service):
+        if service is not None and isinstance(self.vector_store, PartitionedVectorStore):
+            return self.vector_store.search_many(q_embs, top_k=top_k, supplier_ids=supplier_ids, service=service)
+        return self.vector_store.search_many(q_embs, top_k=top_k, supplier_ids=supplier_ids)
+
+    @staticmethod
+    def _fuse_hybrid(vector_docs: List[dict], lexical_docs: List[dict], top_k: int,
+                     min_bm25=HYBRID_MIN_BM25, all_vector_docs=()) -> List[dict]:
+        """
+        Reciprocal rank fusion of one query's vector and BM25 rankings.
+        vector_docs passed min_score; lexical hits need bm25_score >= min_bm25,
+        so an exact rare term ("NICEIC") is found even at a low cosine, while a
+        weak match on a common word isn't. "rrf_score" (the fused value results
+        are ranked by) and "bm25_score" (None without a lexical hit) are added;
+        "score" stays the cosine, taken from all_vector_docs (the unfiltered
+        vector results) for a BM25-only chunk, or None if it wasn't among them.
+        """
+        def key(d):
+            return (d.get("supplier_id"), d.get("chunk_text"))
+
+        lexical_docs = [d for d in lexical_docs if d["bm25_score"] >= min_bm25]
+        by_vector = {key(d): d for d in vector_docs}
+        by_lexical = {key(d): d for d in lexical_docs}
+        cosine = {key(d): d["score"] for d in all_vector_docs}
+        keys, scores = reciprocal_rank_fusion(
+            [[key(d) for d in vector_docs], [key(d) for d in lexical_docs]], k=RRF_K
+        )
+        fused = []
+        for k, rrf in zip(keys[:top_k], scores):
+            if k in by_vector:
+                doc = dict(by_vector[k], bm25_score=by_lexical[k]["bm25_score"] if k in by_lexical else None)
+            else:
+                doc = dict(by_lexical[k], score=cosine.get(k))
+            doc["rrf_score"] = float(rrf)
+            fused.append(doc)
+        return fused
+
+    def _vector_search_many(self, query_texts: List[str], top_k=3, min_score=0.6, supplier_ids=None, service=None,
+                            known_vectors=None):
+        """
+        Batched retrieval for several queries, merged into one candidate list.
+        """
+        per_query = self._vector_search_batch(
+            query_texts, top_k=top_k, min_score=min_score, supplier_ids=supplier_ids, service=service,
+            known_vectors=known_vectors
+        )
+        return self._merge_query_results(query_texts, per_query)
+
+    @staticmethod
+    def _retrieval_queries(sub_queries: List[str], expansions: List[str]) -> List[str]:
+        """
+        Expansions first, then the sub-queries, without repeats.
+        """
+        return list(dict.fromkeys(q for q in list(expansions) + list(sub_queries) if q))
+
+    @staticmethod
+    def _merge_query_results(query_texts: List[str], per_query: List[List[dict]]) -> List[dict]:
+        """
+        Deduplicate chunks hit by several queries. Each chunk keeps its best
+        score, and "matched_queries" records which queries retrieved it.
+        """
+        merged = {}
+        for query_text, docs in zip(query_texts, per_query):
+            for d in docs:
+                key = (d.get("supplier_id"), d.get("chunk_text"))
+                if key not in merged:
+                    merged[key] = dict(d, matched_queries=[query_text])
+                    continue
+                best = merged[key]
+                best["matched_queries"].append(query_text)
+                if rank_score(d) > rank_score(best):
+                    best.update(d)
+        return list(merged.values())
 
     def get_structured_summary(self, user_query: str, final_sorted_results: list):
         """
         Optionally call ask_chatgpt_structured to produce a single summary across
         multiple top docs or do it doc-by-doc. We'll do a single summary for the top doc for demonstration.
+        Answers are served from summary_cache when the same docs were summarized for the same query.
         """
         # If you want multiple docs summary, pass them all. We'll do top 3 for demonstration.
         top_docs = final_sorted_results[:3]
+        extra, tags = self._summary_cache_key(top_docs)
+        cached = self.summary_cache.get("structured_summary", SUMMARY_MODEL, user_query, extra=extra)
+        if cached is not None:
+            return cached
         structured = ask_chatgpt_structured(
             user_query=user_query,
             retrieved_docs=top_docs,
@@ -344,4 +922,96 @@ class EnhancedRAGPipeline:
             method="pydantic",
             log_event_fn=log_event
         )
+        if top_docs:
+            self.summary_cache.set("structured_summary", SUMMARY_MODEL, user_query, structured, extra=extra, tags=tags)
         return structured
+
+    @staticmethod
+    def _summary_cache_key(docs: list):
+        """
+        (extra, tags) for summary_cache: the key covers the set of chunk texts and
+        the prompt version; the tags are the suppliers the chunks came from.
+        """
+        extra = {
+            "chunks": sorted({d.get("chunk_text", "") for d in docs}),
+            "prompt_version": SUMMARY_PROMPT_VERSION
+        }
+        tags = sorted({d["supplier_id"] for d in docs if "supplier_id" in d})
+        return extra, tags
+
+    @staticmethod
+    def _docs_by_supplier(matches: list) -> dict:
+        """
+        supplier_id -> [its match doc]; each supplier is summarized from its own doc only.
+        """
+        docs_by_supplier = {}
+        for m in matches:
+            if "supplier_id" in m:
+                docs_by_supplier.setdefault(m["supplier_id"], [m])
+        return docs_by_supplier
+
+    def get_structured_summaries(self, user_query: str, matches: list, mode="batch", max_concurrency=4):
+        """
+        One structured summary per supplier in matches (each based on that
+        supplier's doc only), returned as {supplier_id: summary}.
+
+        mode="batch"      => a single ask_chatgpt_structured_batch call for all of them;
+                             suppliers it misses are filled in concurrently.
+        mode="concurrent" => the per-supplier calls run in parallel, at most
+                             max_concurrency at a time.
+        Either way the summary phase costs about one LLM round trip instead of N.
+        """
+        if mode not in SUMMARY_MODES:
+            raise ValueError(f"Unknown summary mode: {mode}")
+        docs_by_supplier = self._docs_by_supplier(matches)
+        if not docs_by_supplier:
+            return {}
+
+        summaries = {}
+        for supplier_id, docs in docs_by_supplier.items():
+            extra, _ = self._summary_cache_key(docs)
+            cached = self.summary_cache.get("structured_summary", SUMMARY_MODEL, user_query, extra=extra)
+            if cached is not None:
+                summaries[supplier_id] = cached
+        uncached = {sid: docs for sid, docs in docs_by_supplier.items() if sid not in summaries}
+
+        if mode == "batch" and uncached:
+            batch = ask_chatgpt_structured_batch(
+                user_query, uncached, openai_api_key=self.openai_api_key, log_event_fn=log_event
+            )
+            for supplier_id, summary in batch.items():
+                extra, tags = self._summary_cache_key(uncached[supplier_id])
+                self.summary_cache.set("structured_summary", SUMMARY_MODEL, user_query, summary, extra=extra, tags=tags)
+            summaries.update(batch)
+        missing = {sid: docs for sid, docs in uncached.items() if sid not in summaries}
+        if missing:
+            # a thread pool rather than asyncio.run, so this also works under a running event loop
+            with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                futures = {
+                    supplier_id: executor.submit(self.get_structured_summary, user_query, docs)
+                    for supplier_id, docs in missing.items()
+                }
+            summaries.update({supplier_id: future.result() for supplier_id, future in futures.items()})
+        return summaries
+
+    def iter_structured_summaries(self, user_query: str, matches: list, max_concurrency=4):
+        """
+        Per-supplier summaries run concurrently, yielded as (supplier_id, summary)
+        in completion order, for streaming responses.
+        """
+        docs_by_supplier = self._docs_by_supplier(matches)
+        if not docs_by_supplier:
+            return
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            futures = {
+                executor.submit(self.get_structured_summary, user_query, docs): supplier_id
+                for supplier_id, docs in docs_by_supplier.items()
+            }
+            for future in as_completed(futures):
+                try:
+                    summary = future.result()
+                except Exception as e:
+                    log_error("StructuredOutputError", f"iter_structured_summaries: {str(e)}")
+                    summary = None
+                yield futures[future], summary
@@ -0,0 +1,225 @@
+# pipeline/lexical_index.py
+import math
+import pickle
+import re
+import threading
+from collections import Counter
+from typing import List, Sequence
+
+import numpy as np
+
+from .log_util import log_info
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+# function words and request phrasing ("I need a ...") that would match every chunk
+STOPWORDS = frozenset("""
+a an and any are as at be been but by can could do does for from get got has have i im in into is it its
+looking me my need needs of on or our please so some someone that the their them there these they this to
+us want was we were what when where which who will with would you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased alphanumeric tokens without stopwords;
+    "NICEIC-approved" => ["niceic", "approved"].
+    """
+    return [t for t in _TOKEN_RE.findall((text or "").lower()) if t not in STOPWORDS]
+
+
+def reciprocal_rank_fusion(ranked_lists: Sequence[Sequence], k=60):
+    """
+    Fuse ranked lists of hashable keys. Each key scores sum(1 / (k + rank)),
+    rank starting at 1, accumulated with one np.add.at over all lists.
+
+    Returns (keys, scores) ordered by descending fused score.
+    """
+    position = {}
+    ids, ranks = [], []
+    for ranked in ranked_lists:
+        for rank, key in enumerate(ranked, start=1):
+            ids.append(position.setdefault(key, len(position)))
+            ranks.append(rank)
+    if not position:
+        return [], np.zeros(0, dtype=np.float64)
+
+    scores = np.zeros(len(position), dtype=np.float64)
+    np.add.at(scores, np.asarray(ids), 1.0 / (k + np.asarray(ranks, dtype=np.float64)))
+    order = np.argsort(-scores, kind="stable")
+    keys = list(position)
+    return [keys[i] for i in order], scores[order]
+
+
+class BM25Index:
+    """
+    In-process inverted index over chunk_text, scored with Okapi BM25.
+
+    Postings are term -> {doc_id: term frequency}; per-document lengths and
+    supplier codes live in NumPy arrays, so a query gathers the postings of
+    its terms and scores every matching chunk with one np.add.at.
+
+    Kept current per supplier with replace_supplier() / delete_supplier()
+    (called from ingestion), and rebuilt from the chunks collection on startup.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._postings = {}        # term -> {doc_id: tf}
+        self._doc_terms = []       # doc_id -> Counter (None once deleted)
+        self._texts = []           # doc_id -> chunk_text
+        self._lengths = np.zeros(0, dtype=np.float32)
+        self._codes = np.zeros(0, dtype=np.int32)
+        self._docs_of = {}         # supplier_id -> [doc_id]
+        self._code_of = {}         # supplier_id -> code
+        self._id_of = []           # code -> supplier_id
+        self._n_docs = 0
+        self._total_length = 0
+
+    def __len__(self):
+        return self._n_docs
+
+    def _code(self, supplier_id: str) -> int:
+        code = self._code_of.get(supplier_id)
+        if code is None:
+            code = len(self._id_of)
+            self._code_of[supplier_id] = code
+            self._id_of.append(supplier_id)
+        return code
+
+    # ---------- writes ----------
+    def load_from_collection(self, collection):
+        """
+        Rebuild the index from every chunk doc in the collection.
+        """
+        by_supplier = {}
+        for doc in collection.find({}, {"_id": 0, "supplier_id": 1, "chunk_text": 1}):
+            if "supplier_id" in doc:
+                by_supplier.setdefault(doc["supplier_id"], []).append(doc.get("chunk_text", ""))
+        # build aside, then swap in, so searches keep using the old index meanwhile
+        fresh = BM25Index(k1=self.k1, b=self.b)
+        for supplier_id, chunk_texts in by_supplier.items():
+            fresh._add(supplier_id, chunk_texts)
+        with self._lock:
+            for name, value in vars(fresh).items():
+                if name != "_lock":
+                    setattr(self, name, value)
+        log_info("LexicalIndexLoaded", f"{self._n_docs} chunks, {len(self._postings)} terms")
+        return self._n_docs
+
+    def _add(self, supplier_id: str, chunk_texts: List[str]):
+        code = self._code(supplier_id)
+        start = len(self._texts)
+        lengths, new_ids = [], []
+        for offset, chunk_text in enumerate(chunk_texts):
+            doc_id = start + offset
+            terms = Counter(tokenize(chunk_text))
+            for term, tf in terms.items():
+                self._postings.setdefault(term, {})[doc_id] = tf
+            self._doc_terms.append(terms)
+            self._texts.append(chunk_text)
+            length = sum(terms.values())
+            lengths.append(length)
+            new_ids.append(doc_id)
+            self._total_length += length
+        self._lengths = np.concatenate([self._lengths, np.asarray(lengths, dtype=np.float32)])
+        self._codes = np.concatenate([self._codes, np.full(len(new_ids), code, dtype=np.int32)])
+        self._docs_of.setdefault(supplier_id, []).extend(new_ids)
+        self._n_docs += len(new_ids)
+
+    def _remove(self, supplier_id: str):
+        # doc ids are never reused; deleted docs just drop out of the postings
+        for doc_id in self._docs_of.pop(supplier_id, []):
+            terms = self._doc_terms[doc_id]
+            if terms is None:
+                continue
+            for term in terms:
+                postings = self._postings.get(term)
+                if postings is not None:
+                    postings.pop(doc_id, None)
+                    if not postings:
+                        del self._postings[term]
+            self._doc_terms[doc_id] = None
+            self._texts[doc_id] = None
+            self._total_length -= int(self._lengths[doc_id])
+            self._n_docs -= 1
+
+    def replace_supplier(self, supplier_id: str, chunk_texts: List[str]):
+        with self._lock:
+            self._remove(supplier_id)
+            self._add(supplier_id, list(chunk_texts))
+
+    def delete_supplier(self, supplier_id: str):
+        with self._lock:
+            self._remove(supplier_id)
+
+    # ---------- snapshots ----------
+    def snapshot_state(self) -> bytes:
+        with self._lock:
+            return pickle.dumps({name: value for name, value in vars(self).items()
+                                 if name.startswith("_") and name != "_lock"},
+                                protocol=pickle.HIGHEST_PROTOCOL)
+
+    def restore_state(self, state: bytes):
+        state = pickle.loads(state)
+        with self._lock:
+            for name, value in state.items():
+                setattr(self, name, value)
+        log_info("LexicalIndexRestored", f"{self._n_docs} chunks, {len(self._postings)} terms")
+
+    # ---------- reads ----------
+    def search(self, query_text: str, top_k=3, supplier_ids=None) -> List[dict]:
+        """
+        Top-k chunks by BM25 as {"supplier_id", "chunk_text", "bm25_score"}.
+        Only chunks sharing at least one term with the query are returned.
+        supplier_ids restricts the candidates to those suppliers.
+        """
+        terms = set(tokenize(query_text))
+        with self._lock:
+            if not terms or self._n_docs == 0 or top_k <= 0:
+                return []
+            avg_length = self._total_length / self._n_docs
+            ids_parts, weight_parts = [], []
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                ids = np.fromiter(postings.keys(), dtype=np.int64, count=len(postings))
+                tfs = np.fromiter(postings.values(), dtype=np.float32, count=len(postings))
+                idf = math.log(1.0 + (self._n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                norm = self.k1 * (1.0 - self.b + self.b * self._lengths[ids] / avg_length)
+                ids_parts.append(ids)
+                weight_parts.append(idf * tfs * (self.k1 + 1.0) / (tfs + norm))
+            if not ids_parts:
+                return []
+            ids = np.concatenate(ids_parts)
+            if supplier_ids is not None:
+                allowed = [self._code_of[s] for s in supplier_ids if s in self._code_of]
+                lookup = np.zeros(len(self._id_of), dtype=bool)
+                lookup[allowed] = True
+                keep = lookup[self._codes[ids]]
+                ids = ids[keep]
+                weight_parts = [np.concatenate(weight_parts)[keep]]
+                if ids.size == 0:
+                    return []
+
+            # sum the per-term contributions of each matching doc
+            docs, inverse = np.unique(ids, return_inverse=True)
+            scores = np.zeros(docs.size, dtype=np.float32)
+            np.add.at(scores, inverse, np.concatenate(weight_parts))
+
+            k = min(top_k, docs.size)
+            top = np.argpartition(-scores, k - 1)[:k] if k < docs.size else np.arange(docs.size)
+            top = top[np.argsort(-scores[top], kind="stable")]
+            return [
+                {
+                    "supplier_id": self._id_of[self._codes[docs[i]]],
+                    "chunk_text": self._texts[docs[i]],
+                    "bm25_score": float(scores[i])
+                }
+                for i in top
+            ]
+
+    def search_many(self, query_texts: List[str], top_k=3, supplier_ids=None) -> List[List[dict]]:
+        return [self.search(q, top_k=top_k, supplier_ids=supplier_ids) for q in query_texts]
@@ -0,0 +1,241 @@
+# pipeline/llm_cache.py
+import hashlib
+import json
+import pickle
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from .log_util import log_error
+
+
+def normalize_query(text: str) -> str:
+    """
+    Lowercase, collapse whitespace and drop surrounding punctuation, so
+    "Need a plumber!" and "need a  plumber" share a cache entry.
+    """
+    text = re.sub(r"\s+", " ", (text or "").lower()).strip()
+    return text.strip(" .,!?;:'\"")
+
+
+class LLMResponseCache:
+    """
+    Cache for LLM answers keyed by (function, model, normalized query, extra).
+
+    Two tiers:
+      - memory: size-bounded LRU with TTL, per process
+      - disk (optional): SQLite file shared by workers and kept across restarts
+
+    Only successful LLM answers should be stored; callers keep returning
+    their fallbacks uncached when the API call fails.
+
+    Entries can carry tags (e.g. supplier ids) so everything derived from one
+    supplier can be dropped with invalidate_tag().
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=24 * 3600, sqlite_path: Optional[str] = None,
+                 max_disk_entries=50000):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_entries = max_disk_entries
+        self._lock = threading.RLock()
+        self._memory = OrderedDict()  # key -> (expires_at, function, value, tags)
+        self._tagged = {}  # tag -> set(key), for the keys in _memory
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+        self._db = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False, timeout=5)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                " key TEXT PRIMARY KEY, function TEXT, value TEXT,"
+                " expires_at REAL, last_access REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS llm_cache_function ON llm_cache(function)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS llm_cache_tags (tag TEXT, key TEXT)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS llm_cache_tags_tag ON llm_cache_tags(tag)")
+            self._db.commit()
+
+    @staticmethod
+    def make_key(function: str, model: str, query: str, extra: Any = None) -> str:
+        raw = json.dumps([function, model, normalize_query(query), extra], sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, function: str, model: str, query: str, extra: Any = None):
+        key = self.make_key(function, model, query, extra)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return entry[2]
+                self._memory_drop(key)
+
+            value, tags = self._disk_get(key, now)
+            if value is not None:
+                self._memory_put(key, function, value, now, tags)
+                self.hits += 1
+                self.disk_hits += 1
+                return value
+
+            self.misses += 1
+            return None
+
+    def set(self, function: str, model: str, query: str, value, extra: Any = None, tags=()):
+        if value is None:
+            return
+        key = self.make_key(function, model, query, extra)
+        now = time.time()
+        with self._lock:
+            self._memory_put(key, function, value, now, tags)
+            self._disk_put(key, function, value, now, tags)
+
+    def invalidate_tag(self, tag: str):
+        """
+        Drop every entry stored with this tag.
+        """
+        with self._lock:
+            for key in list(self._tagged.get(tag, ())):
+                self._memory_drop(key)
+            if self._db is not None:
+                try:
+                    # also entries another worker tagged, if this one holds them in memory
+                    for (key,) in self._db.execute("SELECT key FROM llm_cache_tags WHERE tag = ?", (tag,)).fetchall():
+                        self._memory_drop(key)
+                    self._db.execute(
+                        "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache_tags WHERE tag = ?)",
+                        (tag,)
+                    )
+                    self._db.execute("DELETE FROM llm_cache_tags WHERE tag = ?", (tag,))
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    log_error("LLMCacheError", f"invalidate_tag: {str(e)}")
+
+    def invalidate(self, function: Optional[str] = None):
+        """
+        Drop every entry of one function (e.g. "route_query_llm"), or all entries.
+        """
+        with self._lock:
+            if function is None:
+                self._memory.clear()
+                self._tagged.clear()
+            else:
+                stale = [k for k, entry in self._memory.items() if entry[1] == function]
+                for k in stale:
+                    self._memory_drop(k)
+            if self._db is not None:
+                try:
+                    if function is None:
+                        self._db.execute("DELETE FROM llm_cache")
+                        self._db.execute("DELETE FROM llm_cache_tags")
+                    else:
+                        self._db.execute("DELETE FROM llm_cache WHERE function = ?", (function,))
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    log_error("LLMCacheError", f"invalidate: {str(e)}")
+
+    def snapshot_state(self) -> bytes:
+        """
+        Unexpired memory-tier entries (the disk tier persists on its own).
+        """
+        now = time.time()
+        with self._lock:
+            memory = [(k, entry) for k, entry in self._memory.items() if entry[0] > now]
+            return pickle.dumps({"memory": memory}, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def restore_state(self, state: bytes):
+        state = pickle.loads(state)
+        now = time.time()
+        with self._lock:
+            for key, (expires_at, function, value, tags) in state["memory"]:
+                if expires_at > now and key not in self._memory:
+                    self._memory_put(key, function, value, now, tags, expires_at=expires_at)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "memory_entries": len(self._memory),
+            }
+
+    # ---------- tiers ----------
+    def _memory_put(self, key, function, value, now, tags=(), expires_at=None):
+        self._memory_drop(key)
+        tags = tuple(tags)
+        self._memory[key] = (expires_at or now + self.ttl_seconds, function, value, tags)
+        for tag in tags:
+            self._tagged.setdefault(tag, set()).add(key)
+        while len(self._memory) > self.max_entries:
+            self._memory_drop(next(iter(self._memory)))
+
+    def _memory_drop(self, key):
+        entry = self._memory.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[3]:
+            keys = self._tagged.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tagged[tag]
+
+    def _disk_get(self, key, now):
+        """
+        (value, tags) of an unexpired disk entry, or (None, ()).
+        """
+        if self._db is None:
+            return None, ()
+        try:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None, ()
+            if row[1] <= now:
+                self._db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._db.commit()
+                return None, ()
+            tags = [tag for (tag,) in self._db.execute("SELECT tag FROM llm_cache_tags WHERE key = ?", (key,))]
+            self._db.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            return json.loads(row[0]), tags
+        except sqlite3.Error as e:
+            log_error("LLMCacheError", f"get: {str(e)}")
+            return None, ()
+
+    def _disk_put(self, key, function, value, now, tags=()):
+        if self._db is None:
+            return
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, function, value, expires_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, function, json.dumps(value), now + self.ttl_seconds, now)
+            )
+            if tags:
+                self._db.executemany(
+                    "INSERT INTO llm_cache_tags (tag, key) VALUES (?, ?)", [(tag, key) for tag in tags]
+                )
+            # size bound: drop expired rows, then the least recently used ones
+            self._db.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+            self._db.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                " SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_disk_entries,)
+            )
+            self._db.execute("DELETE FROM llm_cache_tags WHERE key NOT IN (SELECT key FROM llm_cache)")
+            self._db.commit()
+        except sqlite3.Error as e:
+            log_error("LLMCacheError", f"set: {str(e)}")
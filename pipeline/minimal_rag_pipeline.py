@@ -6,6 +6,7 @@ from pymongo.server_api import ServerApi
 
 from .chunking_utils import read_and_chunk_pdf_adaptive
 from .embedding_utils import get_embedding_model, batch_embed_texts
+from .vector_store import build_vector_store
 
 class MinimalRAGPipeline:
     """
@@ -13,62 +14,43 @@ class MinimalRAGPipeline:
     2) Direct vector search -> return top docs
     """
 
-    def __init__(self, mongo_uri, openai_api_key=None):
+    def __init__(self, mongo_uri, openai_api_key=None, vector_backend="atlas", embedding_format="array"):
         self.mongo_uri = mongo_uri
         self.client = MongoClient(self.mongo_uri, server_api=ServerApi('1'))
         self.db = self.client["testdb"]
         self.collection = self.db["chunks"]
+        self.vector_store = build_vector_store(vector_backend, self.collection, storage_format=embedding_format)
         self.embedding_model = get_embedding_model()
         self.openai_api_key = openai_api_key
         if openai_api_key:
             openai.api_key = openai_api_key
 
     def ingest_supplier_pdf(self, pdf_path: str, supplier_id: str):
-        # Remove old docs for that supplier
-        self.collection.delete_many({"supplier_id": supplier_id})
-
         # chunk
         chunks = read_and_chunk_pdf_adaptive(pdf_path)
         if not chunks:
+            # Remove old docs for that supplier
+            self.vector_store.delete_supplier(supplier_id)
             return "unknown"
 
         # embed
-        embs = batch_embed_texts(self.embedding_model, chunks, batch_size=16)
+        embs = batch_embed_texts(self.embedding_model, chunks)
 
-        # store
-        docs = []
-        for i, chunk_text in enumerate(chunks):
-            docs.append({
-                "supplier_id": supplier_id,
-                "chunk_text": chunk_text,
-                "embedding": embs[i].tolist()
-            })
-        if docs:
-            self.collection.insert_many(docs)
+        # store (replaces the supplier's old docs)
+        self.vector_store.replace_supplier(supplier_id, chunks, embs)
         return "done"
 
+    # no lexical index, profiles or derived caches here; these hooks exist so the
+    # shared ingestion functions (e.g. ingest_supplier_pdf_with_summary) accept this pipeline
+    def on_supplier_ingested(self, supplier_id: str, chunk_texts, embeddings=None, pdf_summary=None, skills=None):
+        pass
+
+    def update_supplier_profile(self, supplier_id: str, pdf_summary=None, skills=None):
+        pass
+
     def search_suppliers(self, query: str, top_k=10):
         # 1) embed the query
-        q_emb = self.embedding_model.encode([query])[0].tolist()
-        # 2) do a vector search in mongo
-        pipeline = [
-            {
-                "$vectorSearch": {
-                    "index": "default",  # must exist in MongoDB Atlas
-                    "queryVector": q_emb,
-                    "path": "embedding",
-                    "limit": top_k * 2,
-                    "numCandidates": 50
-                }
-            },
-            {
-                "$project": {
-                    "_id": 0,
-                    "supplier_id": 1,
-                    "chunk_text": 1,
-                    "score": {"$meta": "vectorSearchScore"}
-                }
-            }
-        ]
-        results = list(self.collection.aggregate(pipeline))
+        q_emb = self.embedding_model.encode([query])[0]
+        # 2) do a vector search (Atlas index "default" or the local index)
+        results = self.vector_store.search(q_emb, top_k=top_k * 2)
         return results
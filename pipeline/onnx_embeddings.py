@@ -0,0 +1,195 @@
+# pipeline/onnx_embeddings.py
+import os
+import time
+from typing import List, Union
+
+import numpy as np
+
+from .log_util import log_info
+
+# matches the SentenceTransformer config of all-MiniLM-L6-v2:
+# 256 word pieces, mean pooling over the attention mask, then L2 normalization
+MAX_SEQ_LENGTH = 256
+_INPUT_NAMES = ["input_ids", "attention_mask", "token_type_ids"]
+
+
+def export_onnx(model_name: str, model_dir: str, quantize=False) -> str:
+    """
+    Export the transformer to model_dir/model.onnx (once), and with quantize
+    also model_dir/model.int8.onnx (dynamic int8 weights, activations
+    quantized at run time). Returns the path to load. Files are written
+    under a temp name and swapped in, so concurrent workers can race safely.
+    """
+    os.makedirs(model_dir, exist_ok=True)
+    fp32_path = os.path.join(model_dir, "model.onnx")
+    int8_path = os.path.join(model_dir, "model.int8.onnx")
+
+    if not os.path.exists(fp32_path):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name)
+        model.config.return_dict = False
+        model.eval()
+        sample = tokenizer(["export sample"], return_tensors="pt")
+        tmp = f"{fp32_path}.{os.getpid()}.tmp"
+        with torch.no_grad():
+            torch.onnx.export(
+                model, tuple(sample[name] for name in _INPUT_NAMES), tmp,
+                input_names=_INPUT_NAMES,
+                output_names=["last_hidden_state", "pooler_output"],
+                dynamic_axes={
+                    **{name: {0: "batch", 1: "sequence"} for name in _INPUT_NAMES},
+                    "last_hidden_state": {0: "batch", 1: "sequence"},
+                    "pooler_output": {0: "batch"},
+                },
+                opset_version=14,
+            )
+        tokenizer.save_pretrained(model_dir)
+        os.replace(tmp, fp32_path)
+        log_info("OnnxExported", f"{model_name} -> {fp32_path}")
+
+    if not quantize:
+        return fp32_path
+    if not os.path.exists(int8_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        tmp = f"{int8_path}.{os.getpid()}.tmp"
+        quantize_dynamic(fp32_path, tmp, weight_type=QuantType.QInt8)
+        os.replace(tmp, int8_path)
+        log_info("OnnxQuantized", f"{fp32_path} -> {int8_path}")
+    return int8_path
+
+
+class OnnxEmbeddingModel:
+    """
+    all-MiniLM-L6-v2 on ONNX Runtime (CPU), as a drop-in for
+    SentenceTransformer.encode: same tokenizer, mean pooling and
+    normalization, so its vectors are interchangeable with the torch ones.
+
+    quantize=True runs the dynamic int8 export. num_threads sets ONNX
+    Runtime's intra-op threads (default: all cores); inter-op parallelism is
+    off since a single BERT graph doesn't benefit from it.
+    """
+
+    def __init__(self, model_name: str, model_dir: str, quantize=False, num_threads=None):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        path = export_onnx(model_name, model_dir, quantize=quantize)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = num_threads or os.cpu_count() or 1
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self._input_names = {i.name for i in self.session.get_inputs()}
+        self._dim = self.session.get_outputs()[0].shape[-1]
+        self.model_path = path
+        log_info("OnnxModelLoaded", f"{path} ({options.intra_op_num_threads} threads)")
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self._dim
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        tokens = self.tokenizer(texts, padding=True, truncation=True, max_length=MAX_SEQ_LENGTH,
+                                return_tensors="np")
+        feed = {name: tokens[name].astype(np.int64) for name in _INPUT_NAMES if name in self._input_names}
+        hidden = self.session.run(["last_hidden_state"], feed)[0]
+        mask = tokens["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        return pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+
+    def encode(self, sentences: Union[str, List[str]], batch_size=32, **kwargs) -> np.ndarray:
+        """
+        Texts are encoded longest first so each batch pads to similar lengths;
+        rows come back in input order.
+        """
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        out = np.zeros((len(texts), self._dim), dtype=np.float32)
+        order = np.argsort([-len(t) for t in texts], kind="stable")
+        for start in range(0, len(texts), batch_size):
+            rows = order[start:start + batch_size]
+            out[rows] = self._encode_batch([texts[i] for i in rows])
+        return out[0] if single else out
+
+
+# =============== Parity / throughput ===============
+SAMPLE_TEXTS = [
+    "need a plumber to fix a leaking sink",
+    "Gas Safe registered engineer for boiler servicing and repairs",
+    "NICEIC-approved electrician, rewiring and consumer unit upgrades",
+    "Qualified accountant offering bookkeeping, payroll and self-assessment tax returns",
+    "wedding photographer",
+    "We are a family-run landscaping business covering patios, fencing, turfing and garden clearance "
+    "across Greater Manchester, fully insured with over fifteen years of experience.",
+]
+
+
+def parity_report(onnx_model, torch_model, texts=None) -> dict:
+    """
+    Cosine between ONNX and torch embeddings of the same texts.
+    The backend is usable if min_cosine >= 0.99.
+    """
+    texts = texts or SAMPLE_TEXTS
+    a = np.asarray(onnx_model.encode(texts), dtype=np.float32)
+    b = np.asarray(torch_model.encode(texts), dtype=np.float32)
+    a /= np.linalg.norm(a, axis=1, keepdims=True)
+    b /= np.linalg.norm(b, axis=1, keepdims=True)
+    cosines = (a * b).sum(axis=1)
+    return {"min_cosine": float(cosines.min()), "mean_cosine": float(cosines.mean()), "ok": bool(cosines.min() >= 0.99)}
+
+
+def _measure_backend(backend: str, model_dir: str, n_texts: int, queue):
+    # runs in its own process, so the resident set is the backend's alone
+    import psutil
+    from .embedding_utils import load_embedding_model
+
+    model = load_embedding_model(backend, model_dir=model_dir)
+    texts = [SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)] + f" {i}" for i in range(n_texts)]
+    model.encode(texts[:32])  # warm up
+    start = time.perf_counter()
+    for text in texts[:200]:
+        model.encode([text])
+    query_ms = (time.perf_counter() - start) * 1000 / min(200, n_texts)
+    start = time.perf_counter()
+    model.encode(texts, batch_size=32)
+    bulk = n_texts / (time.perf_counter() - start)
+    queue.put({"backend": backend, "query_ms": query_ms, "texts_per_second": bulk,
+               "rss_mb": psutil.Process().memory_info().rss / 1e6})
+
+
+def benchmark_backends(backends=("torch", "onnx", "onnx-int8"), model_dir="onnx_model", n_texts=2000) -> List[dict]:
+    """
+    Single-query latency, bulk throughput and resident set of each backend,
+    each measured in a fresh process.
+    """
+    import multiprocessing
+
+    context = multiprocessing.get_context("spawn")
+    report = []
+    for backend in backends:
+        queue = context.Queue()
+        process = context.Process(target=_measure_backend, args=(backend, model_dir, n_texts, queue))
+        process.start()
+        report.append(queue.get())
+        process.join()
+    return report
+
+
+if __name__ == "__main__":
+    # python -m pipeline.onnx_embeddings [model_dir]
+    import sys
+
+    from .embedding_utils import load_embedding_model
+
+    directory = sys.argv[1] if len(sys.argv) > 1 else "onnx_model"
+    reference = load_embedding_model("torch")
+    for name in ("onnx", "onnx-int8"):
+        print(name, parity_report(load_embedding_model(name, model_dir=directory), reference))
+    for row in benchmark_backends(model_dir=directory):
+        print(f"{row['backend']:9s} {row['query_ms']:6.2f} ms/query  {row['texts_per_second']:7.0f} texts/s  "
+              f"RSS {row['rss_mb']:.0f} MB")
@@ -0,0 +1,76 @@
+# pipeline/reranker.py
+import threading
+import time
+from typing import List
+
+from .log_util import log_info, log_warning
+
+# modes accepted by EnhancedRAGPipeline.advanced_search(rerank=...)
+RERANK_MODES = ("cross_encoder", "score", "llm")
+
+
+def rank_score(doc: dict) -> float:
+    """
+    What retrieval ranked a doc by: the fused "rrf_score" of hybrid results,
+    else the vector "score" (cosine).
+    """
+    rrf = doc.get("rrf_score")
+    return doc["score"] if rrf is None else rrf
+
+
+def score_sort(results: List[dict], top_k=3) -> List[dict]:
+    """
+    Plain fallback: order by retrieval score (see rank_score).
+    """
+    return sorted(results, key=rank_score, reverse=True)[:top_k]
+
+
+class CrossEncoderReranker:
+    """
+    Re-rank (query, chunk_text) pairs with a small local cross-encoder,
+    scored in one batched forward pass on CPU.
+
+    - max_candidates caps how many of the best vector hits get scored.
+    - latency_budget_ms shrinks that cap further, using the measured cost per
+      pair of earlier calls, so one request stays within the budget.
+
+    Each returned doc keeps its vector "score" and gets a "rerank_score".
+    """
+
+    def __init__(self, model_name="cross-encoder/ms-marco-MiniLM-L-6-v2",
+                 max_candidates=20, latency_budget_ms=150.0, max_length=256):
+        from sentence_transformers import CrossEncoder
+
+        self.model = CrossEncoder(model_name, max_length=max_length)
+        self.max_candidates = max_candidates
+        self.latency_budget_ms = latency_budget_ms
+        self._ms_per_pair = None  # moving average of the measured cost
+        self._lock = threading.Lock()
+
+    def _candidate_cap(self, top_k: int) -> int:
+        cap = self.max_candidates
+        if self._ms_per_pair and self.latency_budget_ms:
+            cap = min(cap, int(self.latency_budget_ms / self._ms_per_pair))
+        return max(cap, top_k)
+
+    def rerank(self, user_query: str, results: List[dict], top_k=3) -> List[dict]:
+        if not results:
+            return []
+        candidates = score_sort(results, top_k=self._candidate_cap(top_k))
+        pairs = [(user_query, r.get("chunk_text", "")) for r in candidates]
+
+        start = time.perf_counter()
+        scores = self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        with self._lock:
+            per_pair = elapsed_ms / len(pairs)
+            self._ms_per_pair = per_pair if self._ms_per_pair is None else 0.8 * self._ms_per_pair + 0.2 * per_pair
+        if self.latency_budget_ms and elapsed_ms > self.latency_budget_ms:
+            log_warning("RerankOverBudget", f"{len(pairs)} pairs took {elapsed_ms:.1f}ms")
+        else:
+            log_info("Reranked", f"{len(pairs)} pairs in {elapsed_ms:.1f}ms")
+
+        ranked = [dict(r, rerank_score=float(s)) for r, s in zip(candidates, scores)]
+        ranked.sort(key=lambda x: x["rerank_score"], reverse=True)
+        return ranked[:top_k]
@@ -684,8 +684,12 @@ def process_role(raw: str) -> list:
 
 # Process each raw role and flatten the list
 processed_roles = []
+# lowercase role -> the full taxonomy lines it came from (e.g. "Accountant - Private Practice - Accountancy")
+ROLE_CONTEXT = {}
 for role in _RAW_ROLES:
-    processed_roles.extend(process_role(role))
+    for name in process_role(role):
+        processed_roles.append(name)
+        ROLE_CONTEXT.setdefault(name.lower(), []).append(role)
 
 # Remove duplicates while preserving order
 KNOWN_ROLES = list(dict.fromkeys(processed_roles))
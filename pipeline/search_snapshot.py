@@ -0,0 +1,157 @@
+# pipeline/search_snapshot.py
+import datetime
+import os
+import pickle
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from .log_util import log_info, log_warning, log_error
+
+# bump whenever the pickled state of a component changes shape;
+# snapshots written with another version are ignored (cold start)
+SNAPSHOT_VERSION = 3
+
+
+class SearchChangeLog:
+    """
+    Append-only log of changes to search-side state, in a Mongo collection
+    shared by every worker:
+      {"kind": "supplier", "supplier_id": ...}  chunks / profile re-ingested or deleted
+      {"kind": "catalog", "event": ...}         services or supplier links changed
+
+    Entries are ordered by their ObjectId, so a snapshot records the last
+    _id it has seen and a warm start replays only what came after it.
+    A TTL index drops entries after retention_seconds; snapshots older than
+    that are not restored.
+    """
+
+    def __init__(self, collection, retention_seconds=7 * 24 * 3600):
+        self.collection = collection
+        self.retention_seconds = retention_seconds
+        try:
+            collection.create_index("at", expireAfterSeconds=retention_seconds)
+        except Exception as e:
+            log_warning("ChangeLogIndex", str(e))
+
+    def append(self, kind: str, **fields):
+        try:
+            self.collection.insert_one(dict(fields, kind=kind, at=datetime.datetime.utcnow()))
+        except Exception as e:
+            # a missed entry only costs freshness after the next warm start
+            log_error("ChangeLogAppendFailed", f"{kind} {fields}: {str(e)}")
+
+    def position(self):
+        """
+        _id of the newest entry (None if the log is empty).
+        """
+        last = self.collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+        return last["_id"] if last else None
+
+    def since(self, position) -> list:
+        query = {"_id": {"$gt": position}} if position is not None else {}
+        return list(self.collection.find(query).sort("_id", 1))
+
+
+class SearchSnapshot:
+    """
+    Versioned snapshot file of the in-memory search state.
+
+    The file is one pickle: a header (format version, embedding model and
+    anything else in `meta`, creation time, change-log position) and the
+    per-component states. Each component pickles its own state under its
+    own lock (snapshot_state()), so a snapshot can be taken while serving.
+    Writes go to a temp file swapped in with os.replace, so readers never
+    see a partial snapshot.
+    """
+
+    def __init__(self, path: str, meta: Optional[dict] = None, max_age_seconds=7 * 24 * 3600):
+        self.path = path
+        self.meta = meta or {}
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def save(self, components: Dict[str, object], position) -> dict:
+        start = time.perf_counter()
+        states = {}
+        for name, component in components.items():
+            if component is not None and hasattr(component, "snapshot_state"):
+                states[name] = component.snapshot_state()
+        header = {
+            "version": SNAPSHOT_VERSION,
+            "meta": self.meta,
+            "created_at": time.time(),
+            "position": position,
+        }
+        with self._lock:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                pickle.dump({"header": header, "components": states}, f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        size = os.path.getsize(self.path)
+        log_info("SearchSnapshotSaved", f"{sorted(states)} -> {self.path} "
+                                        f"({size / 1e6:.1f} MB, {(time.perf_counter() - start) * 1000:.0f} ms)")
+        return header
+
+    def read(self) -> Optional[dict]:
+        """
+        {"header": ..., "components": {name: state}} or None if there is no
+        usable snapshot (missing, unreadable, other version / model, too old).
+        """
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, "rb") as f:
+                snapshot = pickle.load(f)
+        except Exception as e:
+            log_warning("SearchSnapshotUnreadable", f"{self.path}: {str(e)}")
+            return None
+        header = snapshot.get("header", {})
+        if header.get("version") != SNAPSHOT_VERSION or header.get("meta") != self.meta:
+            log_info("SearchSnapshotIgnored", f"version {header.get('version')} / {header.get('meta')} "
+                                              f"does not match {SNAPSHOT_VERSION} / {self.meta}")
+            return None
+        if time.time() - header.get("created_at", 0) > self.max_age_seconds:
+            log_info("SearchSnapshotIgnored", "older than the change-log retention")
+            return None
+        return snapshot
+
+    @staticmethod
+    def restore(components: Dict[str, object], states: Dict[str, bytes]) -> list:
+        """
+        Hand each component its saved state; returns the names restored.
+        """
+        restored = []
+        for name, component in components.items():
+            if component is None or name not in states or not hasattr(component, "restore_state"):
+                continue
+            try:
+                component.restore_state(states[name])
+                restored.append(name)
+            except Exception as e:
+                log_warning("SearchSnapshotRestoreFailed", f"{name}: {str(e)}")
+        return restored
+
+    def start_timer(self, save: Callable, interval: float):
+        """
+        Call save() every interval seconds from a daemon thread.
+        """
+        def loop():
+            while not stop.wait(interval):
+                try:
+                    save()
+                except Exception as e:
+                    log_error("SearchSnapshotFailed", str(e))
+
+        stop = threading.Event()
+        self._timer = stop
+        threading.Thread(target=loop, name="search-snapshot", daemon=True).start()
+
+    def stop_timer(self):
+        if self._timer is not None:
+            self._timer.set()
@@ -0,0 +1,193 @@
+# pipeline/semantic_cache.py
+import copy
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Iterable, Optional
+
+import numpy as np
+
+# tag of entries whose search was not routed to a single service
+ANY_SERVICE = "*"
+
+
+def service_tag(service: Optional[str]) -> str:
+    return f"service:{service or ANY_SERVICE}"
+
+
+class SemanticResultCache:
+    """
+    Final advanced_search results keyed by the query embedding.
+
+    A lookup is one (max_entries x dim) matrix-vector product: the nearest
+    unexpired entry with the same `extra` (e.g. top_k and re-rank mode) is a
+    hit if its cosine similarity to the query is at least `threshold`, so
+    "plumber to fix leaking sink" can reuse "need plumber for sink leak".
+
+    Entries are tagged with the suppliers they returned and the service the
+    search was routed to. invalidate_supplier() drops every entry listing the
+    supplier or routed to one of its services (a re-ingested or newly linked
+    supplier can enter those results), plus unrouted entries.
+
+    Per process and memory-only; ttl_seconds bounds how long another
+    worker's writes can go unseen.
+
+    Every invalidation bumps `generation`. A search reads it before it
+    starts and passes it to set(), which drops the result if an
+    invalidation happened meanwhile (it may predate a re-ingest).
+    """
+
+    def __init__(self, dim=384, threshold=0.92, ttl_seconds=600, max_entries=1024):
+        self.dim = dim
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.RLock()
+        # fixed slots; a slot is free when its expiry is 0
+        self._vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self._expires = np.zeros(max_entries, dtype=np.float64)
+        self._extra_ids = np.full(max_entries, -1, dtype=np.int64)
+        self._extra_of = {}                       # extra key -> small int
+        self._entries = [None] * max_entries      # slot -> (result, tags)
+        self._tagged = {}                         # tag -> set(slot)
+        self._lru = OrderedDict()                 # slot -> None, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _extra_id(self, extra: Any) -> int:
+        key = repr(extra)
+        if key not in self._extra_of:
+            self._extra_of[key] = len(self._extra_of)
+        return self._extra_of[key]
+
+    def _nearest(self, query: np.ndarray, extra_id: int, now: float):
+        """
+        (slot, cosine) of the closest live entry with this extra, or (None, -1.0).
+        """
+        live = (self._extra_ids == extra_id) & (self._expires > now)
+        if not live.any():
+            return None, -1.0
+        sims = self._vectors @ query
+        sims[~live] = -np.inf
+        slot = int(np.argmax(sims))
+        return slot, float(sims[slot])
+
+    # ---------- reads ----------
+    def get(self, query_vector, extra: Any = None):
+        """
+        Cached result of a near-duplicate query, or None.
+        """
+        query = self._normalize(query_vector)
+        with self._lock:
+            slot, similarity = self._nearest(query, self._extra_id(extra), time.time())
+            if slot is None or similarity < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._lru.move_to_end(slot)
+            return copy.deepcopy(self._entries[slot][0])
+
+    # ---------- writes ----------
+    def set(self, query_vector, result, extra: Any = None, supplier_ids: Iterable[str] = (),
+            service: Optional[str] = None, generation: Optional[int] = None):
+        query = self._normalize(query_vector)
+        now = time.time()
+        tags = set(supplier_ids) | {service_tag(service)}
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            extra_id = self._extra_id(extra)
+            slot, similarity = self._nearest(query, extra_id, now)
+            if slot is None or similarity < self.threshold:
+                slot = self._free_slot(now)
+            self._drop(slot)
+            self._vectors[slot] = query
+            self._expires[slot] = now + self.ttl_seconds
+            self._extra_ids[slot] = extra_id
+            self._entries[slot] = (copy.deepcopy(result), tags)
+            for tag in tags:
+                self._tagged.setdefault(tag, set()).add(slot)
+            self._lru[slot] = None
+
+    def _free_slot(self, now: float) -> int:
+        free = np.flatnonzero(self._expires <= now)
+        if free.size:
+            return int(free[0])
+        return next(iter(self._lru))  # evict the least recently used entry
+
+    def _drop(self, slot: int):
+        entry = self._entries[slot]
+        if entry is not None:
+            for tag in entry[1]:
+                slots = self._tagged.get(tag)
+                if slots is not None:
+                    slots.discard(slot)
+                    if not slots:
+                        del self._tagged[tag]
+        self._entries[slot] = None
+        self._expires[slot] = 0.0
+        self._extra_ids[slot] = -1
+        self._lru.pop(slot, None)
+
+    def invalidate_tag(self, tag: str):
+        with self._lock:
+            self.generation += 1
+            for slot in list(self._tagged.get(tag, ())):
+                self._drop(slot)
+
+    def invalidate_supplier(self, supplier_id: str, services: Iterable[str] = ()):
+        with self._lock:
+            for tag in [supplier_id, service_tag(None)] + [service_tag(s) for s in services]:
+                self.invalidate_tag(tag)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            for slot in list(self._lru):
+                self._drop(slot)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "entries": int((self._expires > time.time()).sum()),
+            }
+
+    # ---------- snapshots ----------
+    def snapshot_state(self) -> bytes:
+        now = time.time()
+        with self._lock:
+            extras = {v: k for k, v in self._extra_of.items()}
+            entries = [
+                (self._vectors[slot].copy(), float(self._expires[slot]), extras[int(self._extra_ids[slot])],
+                 self._entries[slot])
+                for slot in self._lru if self._expires[slot] > now
+            ]
+            return pickle.dumps(entries, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def restore_state(self, state: bytes):
+        now = time.time()
+        with self._lock:
+            for vector, expires, extra_key, (result, tags) in pickle.loads(state):
+                if expires <= now or vector.shape[0] != self.dim:
+                    continue
+                slot = self._free_slot(now)
+                self._drop(slot)
+                self._vectors[slot] = vector
+                self._expires[slot] = expires
+                self._extra_ids[slot] = self._extra_of.setdefault(extra_key, len(self._extra_of))
+                self._entries[slot] = (result, tags)
+                for tag in tags:
+                    self._tagged.setdefault(tag, set()).add(slot)
+                self._lru[slot] = None
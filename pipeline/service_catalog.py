@@ -0,0 +1,230 @@
+# pipeline/service_catalog.py
+import pickle
+import threading
+import time
+from typing import Callable, Dict, List, Set
+
+from .log_util import log_info, log_error
+
+
+class ServiceCatalog:
+    """
+    In-memory copy of the 'services' and 'supplier_services' tables for the
+    search hot path: service names, descriptions and service -> supplier sets.
+
+    Loaded once at startup, then kept current by SQLAlchemy events, so
+    create_service, link_supplier_service, store_and_link_service (or any other
+    ORM write) update it incrementally once their transaction commits.
+    A periodic full reload picks up writes made by other worker processes;
+    it runs in one request thread at a time while the others keep reading
+    the current copy.
+
+    Other components subscribe() to changes, e.g. to invalidate caches:
+    callback(event, **details) with event in
+    "service_added", "service_removed", "link_added", "link_removed".
+    Changes found by a reload are emitted the same way, with reloaded=True.
+    """
+
+    def __init__(self, db_session_factory, refresh_interval=300):
+        self.db_session_factory = db_session_factory
+        self.refresh_interval = refresh_interval
+        self._lock = threading.RLock()
+        self._services = {}   # service_id -> (name, description)
+        self._by_name = {}    # name -> service_id
+        self._members = {}    # service_id -> set(supplier_id)
+        self._listeners: List[Callable] = []
+        self._loaded_at = 0.0
+        self._reload_lock = threading.Lock()
+
+    # ---------- loading ----------
+    def load(self):
+        """
+        Full reload: one query per table.
+        """
+        from models import Service, SupplierService
+
+        db = self.db_session_factory()
+        try:
+            services = db.query(Service.id, Service.name, Service.description).all()
+            links = db.query(SupplierService.service_id, SupplierService.supplier_id).all()
+        finally:
+            db.close()
+
+        members = {}
+        for service_id, supplier_id in links:
+            members.setdefault(service_id, set()).add(supplier_id)
+        fresh = {sid: (name.lower(), desc or "") for sid, name, desc in services if name}
+        with self._lock:
+            # the first load has nothing to diff against and no subscribers yet
+            changes = self._diff(fresh, members) if self._loaded_at else []
+            self._services = fresh
+            self._by_name = {name: sid for sid, (name, _) in self._services.items()}
+            self._members = members
+            self._loaded_at = time.time()
+        log_info("ServiceCatalogLoaded", f"{len(self._services)} services, {len(links)} supplier links"
+                                         f"{f', {len(changes)} changes' if changes else ''}")
+        for event_name, details in changes:
+            self._notify(event_name, reloaded=True, **details)
+
+    def _diff(self, services: dict, members: dict) -> list:
+        """
+        Events turning the current maps into the given ones (caller holds the lock).
+        """
+        changes = []
+        for sid, (name, _) in self._services.items():
+            if sid not in services:
+                changes.append(("service_removed", {
+                    "service_id": sid, "name": name, "supplier_ids": set(self._members.get(sid, ()))
+                }))
+        for sid, (name, description) in services.items():
+            if self._services.get(sid) != (name, description):
+                changes.append(("service_added", {"service_id": sid, "name": name, "description": description}))
+        for sid, (name, _) in services.items():
+            old, new = self._members.get(sid, set()), members.get(sid, set())
+            for supplier_id in new - old:
+                changes.append(("link_added", {"supplier_id": supplier_id, "service_id": sid, "name": name}))
+            for supplier_id in old - new:
+                changes.append(("link_removed", {"supplier_id": supplier_id, "service_id": sid, "name": name}))
+        return changes
+
+    def snapshot_state(self) -> bytes:
+        with self._lock:
+            return pickle.dumps({
+                "services": self._services, "members": self._members, "loaded_at": self._loaded_at
+            }, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def restore_state(self, state: bytes):
+        """
+        Restored maps are as fresh as the snapshot's load: the periodic reload
+        still runs once they are older than refresh_interval.
+        """
+        state = pickle.loads(state)
+        with self._lock:
+            self._services = state["services"]
+            self._by_name = {name: sid for sid, (name, _) in self._services.items()}
+            self._members = state["members"]
+            self._loaded_at = state["loaded_at"]
+        log_info("ServiceCatalogRestored", f"{len(self._services)} services")
+
+    def _ensure_fresh(self):
+        if time.time() - self._loaded_at <= self.refresh_interval:
+            return
+        # one reload at a time; other requests keep serving the current copy
+        if not self._reload_lock.acquire(blocking=False):
+            return
+        try:
+            if time.time() - self._loaded_at > self.refresh_interval:
+                self.load()
+        except Exception as e:
+            # keep serving the last good copy
+            log_error("ServiceCatalogError", f"reload: {str(e)}")
+            with self._lock:
+                self._loaded_at = time.time()
+        finally:
+            self._reload_lock.release()
+
+    # ---------- reads ----------
+    def service_names(self) -> List[str]:
+        self._ensure_fresh()
+        with self._lock:
+            return list(self._by_name)
+
+    def descriptions(self) -> Dict[str, str]:
+        self._ensure_fresh()
+        with self._lock:
+            return {name: desc for name, desc in self._services.values()}
+
+    def suppliers_for(self, service_name: str) -> Set[str]:
+        self._ensure_fresh()
+        with self._lock:
+            service_id = self._by_name.get((service_name or "").lower())
+            return set(self._members.get(service_id, ()))
+
+    def services_for_supplier(self, supplier_id: str) -> Set[str]:
+        self._ensure_fresh()
+        with self._lock:
+            return {
+                self._services[sid][0]
+                for sid, suppliers in self._members.items()
+                if supplier_id in suppliers and sid in self._services
+            }
+
+    # ---------- incremental updates ----------
+    def subscribe(self, callback: Callable):
+        self._listeners.append(callback)
+
+    def _notify(self, event_name: str, **details):
+        for callback in self._listeners:
+            try:
+                callback(event_name, **details)
+            except Exception as e:
+                log_error("ServiceCatalogListenerError", f"{event_name}: {str(e)}")
+
+    def add_service(self, service_id: str, name: str, description: str = ""):
+        if not name:
+            return
+        name = name.lower()
+        with self._lock:
+            old = self._services.get(service_id)
+            if old and old[0] != name:
+                self._by_name.pop(old[0], None)
+            self._services[service_id] = (name, description or "")
+            self._by_name[name] = service_id
+        self._notify("service_added", service_id=service_id, name=name, description=description or "")
+
+    def remove_service(self, service_id: str):
+        with self._lock:
+            old = self._services.pop(service_id, None)
+            if old:
+                self._by_name.pop(old[0], None)
+            suppliers = self._members.pop(service_id, set())
+        if old:
+            self._notify("service_removed", service_id=service_id, name=old[0], supplier_ids=suppliers)
+
+    def link(self, supplier_id: str, service_id: str):
+        with self._lock:
+            self._members.setdefault(service_id, set()).add(supplier_id)
+            name = self._services.get(service_id, ("", ""))[0]
+        self._notify("link_added", supplier_id=supplier_id, service_id=service_id, name=name)
+
+    def unlink(self, supplier_id: str, service_id: str):
+        with self._lock:
+            self._members.get(service_id, set()).discard(supplier_id)
+            name = self._services.get(service_id, ("", ""))[0]
+        self._notify("link_removed", supplier_id=supplier_id, service_id=service_id, name=name)
+
+    def attach(self):
+        """
+        Hook the catalog to ORM writes. Changes are queued per session and
+        applied only after a successful commit (dropped on rollback).
+        """
+        from sqlalchemy import event
+        from sqlalchemy.orm import Session, object_session
+        from models import Service, SupplierService
+
+        def queue(target, change):
+            session = object_session(target)
+            if session is None:
+                return
+            session.info.setdefault("service_catalog_changes", []).append(change)
+
+        event.listen(Service, "after_insert",
+                     lambda m, c, t: queue(t, (self.add_service, t.id, t.name, t.description)))
+        event.listen(Service, "after_update",
+                     lambda m, c, t: queue(t, (self.add_service, t.id, t.name, t.description)))
+        event.listen(Service, "after_delete",
+                     lambda m, c, t: queue(t, (self.remove_service, t.id)))
+        event.listen(SupplierService, "after_insert",
+                     lambda m, c, t: queue(t, (self.link, t.supplier_id, t.service_id)))
+        event.listen(SupplierService, "after_delete",
+                     lambda m, c, t: queue(t, (self.unlink, t.supplier_id, t.service_id)))
+
+        def apply_changes(session):
+            for fn, *args in session.info.pop("service_catalog_changes", []):
+                fn(*args)
+
+        def drop_changes(session):
+            session.info.pop("service_catalog_changes", None)
+
+        event.listen(Session, "after_commit", apply_changes)
+        event.listen(Session, "after_rollback", drop_changes)
@@ -0,0 +1,146 @@
+# pipeline/service_router.py
+import pickle
+import threading
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from .roles import ROLE_CONTEXT
+from .log_util import log_info
+
+
+def _normalize(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class EmbeddingServiceRouter:
+    """
+    Local replacement for route_query_llm.
+
+    Every known service gets a centroid: the mean of the normalized MiniLM
+    embeddings of its name, its description (if any) and its KNOWN_ROLES
+    taxonomy lines (e.g. "Plumber - Building Services"). A query is routed to
+    the nearest centroid by cosine similarity; below min_confidence route()
+    returns None so the caller can fall back to the LLM.
+
+    state: a snapshot_state() from an earlier process; restoring it skips
+    embedding the taxonomy and the known services again.
+    """
+
+    def __init__(self, embedding_model, min_confidence=0.5, state: Optional[bytes] = None):
+        self.embedding_model = embedding_model
+        self.min_confidence = min_confidence
+        self._lock = threading.RLock()
+        if state is not None:
+            self.restore_state(state)
+            return
+        self._role_vectors = self._embed_taxonomy()
+        self._names = []
+        self._index = {}
+        self._centroids = np.zeros((0, self._dim), dtype=np.float32)
+
+    def _embed_taxonomy(self) -> Dict[str, np.ndarray]:
+        """
+        Embed every taxonomy line once (one batched encode) and average per role.
+        """
+        lines = sorted({line for role_lines in ROLE_CONTEXT.values() for line in role_lines})
+        embs = _normalize(self.embedding_model.encode(lines))
+        self._dim = embs.shape[1]
+        row = {line: i for i, line in enumerate(lines)}
+        role_vectors = {}
+        for role, role_lines in ROLE_CONTEXT.items():
+            role_vectors[role] = _normalize(embs[[row[l] for l in role_lines]].mean(axis=0))
+        log_info("RouterTaxonomyEmbedded", f"{len(role_vectors)} roles from {len(lines)} taxonomy lines")
+        return role_vectors
+
+    def _centroids_for(self, services: Dict[str, str]) -> np.ndarray:
+        names = list(services)
+        descriptions = [(services[n] or "").strip() for n in names]
+        texts = names + [d for d in descriptions if d]
+        embs = _normalize(self.embedding_model.encode(texts)) if texts else None
+
+        centroids = []
+        desc_row = len(names)
+        for i, name in enumerate(names):
+            parts = [embs[i]]
+            if descriptions[i]:
+                parts.append(embs[desc_row])
+                desc_row += 1
+            if name in self._role_vectors:
+                parts.append(self._role_vectors[name])
+            centroids.append(_normalize(np.mean(parts, axis=0)))
+        return np.array(centroids, dtype=np.float32).reshape(-1, self._dim)
+
+    def add_service(self, name: str, description: str = ""):
+        """
+        Add (or refresh) one service without touching the other centroids.
+        """
+        name = (name or "").strip().lower()
+        if not name:
+            return
+        centroid = self._centroids_for({name: description})
+        with self._lock:
+            if name in self._index:
+                centroids = self._centroids.copy()
+                centroids[self._index[name]] = centroid[0]
+            else:
+                self._index[name] = len(self._names)
+                self._names = self._names + [name]
+                centroids = np.vstack([self._centroids, centroid])
+            self._centroids = centroids
+
+    def sync(self, services: Dict[str, str]):
+        """
+        Make the router match the given {name: description} catalog,
+        embedding only services it hasn't seen.
+        """
+        services = {n.strip().lower(): d for n, d in services.items() if n}
+        with self._lock:
+            current = set(self._names)
+        if set(services) == current:
+            return
+        new = {n: d for n, d in services.items() if n not in current}
+        new_centroids = self._centroids_for(new) if new else np.zeros((0, self._dim), dtype=np.float32)
+        with self._lock:
+            keep = [n for n in self._names if n in services]
+            rows = [self._centroids[self._index[n]] for n in keep]
+            names = keep + list(new)
+            self._centroids = np.vstack(rows + [new_centroids]) if rows else new_centroids
+            self._names = names
+            self._index = {n: i for i, n in enumerate(names)}
+
+    def snapshot_state(self) -> bytes:
+        with self._lock:
+            return pickle.dumps({
+                "role_vectors": self._role_vectors, "names": self._names, "centroids": self._centroids
+            }, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def restore_state(self, state: bytes):
+        state = pickle.loads(state)
+        with self._lock:
+            self._role_vectors = state["role_vectors"]
+            self._centroids = state["centroids"]
+            self._dim = self._centroids.shape[1]
+            self._names = list(state["names"])
+            self._index = {n: i for i, n in enumerate(self._names)}
+        log_info("RouterRestored", f"{len(self._role_vectors)} roles, {len(self._names)} services")
+
+    def route(self, query_text: str) -> Tuple[Optional[str], float]:
+        """
+        Return (service_name, cosine) for the nearest service, or
+        (None, cosine) when the best match is below min_confidence.
+        """
+        with self._lock:
+            names, centroids = self._names, self._centroids
+        if not names:
+            return None, 0.0
+        q = _normalize(self.embedding_model.encode([query_text])[0])
+        sims = centroids @ q
+        best = int(np.argmax(sims))
+        confidence = float(sims[best])
+        if confidence < self.min_confidence:
+            return None, confidence
+        return names[best], confidence
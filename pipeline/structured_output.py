@@ -1,10 +1,16 @@
 ##########################################################
 # pipeline/structured_output/structured_out.py
 ##########################################################
+import json
 import openai
-from typing import Optional
+from typing import Dict, List, Optional
 from .log_util import log_info, log_error
 
+# model behind the structured summaries; together with the prompt version it is
+# part of the summary cache key, so bump SUMMARY_PROMPT_VERSION when a prompt changes
+SUMMARY_MODEL = "gpt-3.5-turbo-0125"
+SUMMARY_PROMPT_VERSION = 1
+
 def build_summary_prompt(user_query, docs):
     combined_docs = "\n\n".join([f"- {d['chunk_text']}" for d in docs])
     few_shot_example = """
@@ -64,7 +70,7 @@ def ask_chatgpt_structured(user_query, retrieved_docs, openai_api_key=None, meth
         try:
             client = openai.Client(api_key=openai_api_key)
             response = client.chat.completions.create(
-                model="gpt-3.5-turbo-0125",
+                model=SUMMARY_MODEL,
                 messages=[
                     {"role": "system", "content": "You are a helpful assistant."},
                     {"role": "user", "content": prompt_content}
@@ -110,12 +116,11 @@ def ask_chatgpt_structured(user_query, retrieved_docs, openai_api_key=None, meth
         try:
             client = openai.Client(api_key=openai_api_key)
             response = client.chat.completions.create(
-                model="gpt-3.5-turbo-0125",
+                model=SUMMARY_MODEL,
                 messages=[{"role": "user", "content": full_prompt}],
                 temperature=0.7
             )
             content = response.choices[0].message.content
-            import json
             structured_data = json.loads(content)
 
             if log_event_fn:
@@ -131,6 +136,88 @@ def ask_chatgpt_structured(user_query, retrieved_docs, openai_api_key=None, meth
                 log_error("StructuredOutputError", str(e))
             return None
 
+def build_batch_summary_prompt(user_query, docs_by_supplier: Dict[str, List[dict]]):
+    sections = []
+    for supplier_id, docs in docs_by_supplier.items():
+        combined_docs = "\n".join([f"- {d['chunk_text']}" for d in docs])
+        sections.append(f"[Candidate supplier_id={supplier_id}]\n{combined_docs}")
+    candidates = "\n\n".join(sections)
+    prompt = f"""
+    You are a helpful AI that reads candidate resumes. Each candidate below is
+    identified by a supplier_id. Summarize every candidate separately, using only
+    that candidate's context, in relation to the user's query.
+
+    [User Query]
+    {user_query}
+
+    [Candidates]
+    {candidates}
+
+    Return valid JSON of the form:
+    {{
+        "candidates": [
+            {{
+                "supplier_id": "<supplier_id exactly as given>",
+                "candidate_name": "<string>",
+                "key_strengths": ["<string>", "<string>"],
+                "reasoning": "<string>"
+            }}
+        ]
+    }}
+    with exactly one entry per candidate.
+    """
+    return prompt
+
+def ask_chatgpt_structured_batch(user_query, docs_by_supplier: Dict[str, List[dict]], openai_api_key=None, log_event_fn=None):
+    """
+    One structured call for several candidates at once.
+
+    Args:
+        docs_by_supplier: supplier_id -> the chunk docs to summarize for that supplier.
+
+    Returns:
+        dict supplier_id -> {"candidate_name", "key_strengths", "reasoning"}.
+        Suppliers the model left out (or everything, on error) are simply
+        missing, so the caller can fall back to per-supplier calls.
+    """
+    if not docs_by_supplier:
+        return {}
+
+    prompt_content = build_batch_summary_prompt(user_query, docs_by_supplier)
+    try:
+        client = openai.Client(api_key=openai_api_key)
+        response = client.chat.completions.create(
+            model=SUMMARY_MODEL,
+            messages=[{"role": "user", "content": prompt_content}],
+            response_format={"type": "json_object"},
+            temperature=0.7
+        )
+        content = response.choices[0].message.content
+        entries = json.loads(content).get("candidates", [])
+
+        summaries = {}
+        for entry in entries:
+            supplier_id = str(entry.get("supplier_id", ""))
+            if supplier_id in docs_by_supplier:
+                summaries[supplier_id] = {
+                    "candidate_name": entry.get("candidate_name", ""),
+                    "key_strengths": entry.get("key_strengths", []),
+                    "reasoning": entry.get("reasoning", "")
+                }
+
+        if log_event_fn:
+            log_event_fn("StructuredOutputBatch", summaries)
+        else:
+            log_info("StructuredOutputBatch", str(summaries))
+
+        return summaries
+    except Exception as e:
+        if log_event_fn:
+            log_event_fn("StructuredOutputError", str(e))
+        else:
+            log_error("StructuredOutputError", str(e))
+        return {}
+
 def summarize_uploaded_pdf_for_supplier(
     pipeline,
     supplier_id: str,
@@ -2,7 +2,7 @@
 import os
 import openai
 import re
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 from sqlalchemy.orm import Session
 from .chunking_utils import read_and_chunk_pdf_adaptive
 from .embedding_utils import batch_embed_texts
@@ -110,20 +110,10 @@ def ingest_supplier_pdf(
     if not chunks:
         return "No text found"
 
-    # Step B: remove old docs from the vector DB for that supplier
-    pipeline.collection.delete_many({"supplier_id": supplier_id})
-
-    # Step C: embed & store in vector DB
-    embs = batch_embed_texts(pipeline.embedding_model, chunks, batch_size=16)
-    docs_to_insert = []
-    for i, chunk_text in enumerate(chunks):
-        docs_to_insert.append({
-            "supplier_id": supplier_id,
-            "chunk_text": chunk_text,
-            "embedding": embs[i].tolist()
-        })
-    if docs_to_insert:
-        pipeline.collection.insert_many(docs_to_insert)
+    # Step B+C: embed & replace the supplier's old docs in the vector DB
+    embs = batch_embed_texts(pipeline.embedding_model, chunks)
+    pipeline.vector_store.replace_supplier(supplier_id, chunks, embs)
+    pipeline.on_supplier_ingested(supplier_id, chunks, embeddings=embs)
 
     # Step D: combine chunk text into a snippet for role detection
     combined_text = " ".join(chunks[:3])  # just first 3 chunks
@@ -140,7 +130,7 @@ def ingest_supplier_pdf(
         # link
         repository.link_supplier_service(db, supplier_id, svc.id)
 
-    return f"Ingested {len(docs_to_insert)} chunks, detected roles: {roles_detected}"
+    return f"Ingested {len(chunks)} chunks, detected roles: {roles_detected}"
 
 def detect_skills_from_text(text_snippet: str, openai_api_key: str, num_skills: int = 5) -> List[str]:
     """
@@ -191,8 +181,15 @@ def summarize_text(text: str, openai_api_key: str, max_tokens: int = 512) -> str
     Use OpenAI to summarize the given text snippet.
     Focus on highlighting the candidate's job roles, skills, and professional experience.
     """
+    return _summarize(text, openai_api_key, max_tokens)[0]
+
+def _summarize(text: str, openai_api_key: str, max_tokens: int) -> Tuple[str, bool]:
+    """
+    (summary, True), or (the message summarize_text returns instead, False)
+    if there is no API key or the call fails.
+    """
     if not openai_api_key:
-        return "No OpenAI API key provided."
+        return "No OpenAI API key provided.", False
     
     prompt = f"""
     You are a professional resume summarizer.
@@ -215,10 +212,10 @@ def summarize_text(text: str, openai_api_key: str, max_tokens: int = 512) -> str
             temperature=0.5
         )
         summary = resp.choices[0].message.content.strip()
-        return summary
+        return summary, True
     except Exception as e:
         print("Error summarizing text:", e)
-        return f"Error summarizing text: {e}"
+        return f"Error summarizing text: {e}", False
 
 def ingest_supplier_pdf_with_summary(
     pdf_path: str,
@@ -237,6 +234,9 @@ def ingest_supplier_pdf_with_summary(
       5. Detect roles from the snippet using OpenAI.
       6. Detect key skills from the snippet.
       7. Generate a summary of the PDF content.
+      8. Add the skills and summary to the supplier's search profile.
+    The rest of the supplier's search state (lexical index, profile vector,
+    caches) is refreshed right after step 3.
       
     Returns a dictionary containing:
       - The number of chunks processed.
@@ -250,20 +250,10 @@ def ingest_supplier_pdf_with_summary(
     if not chunks:
         return {"error": "No text found in the PDF."}
     
-    # Step 2: Optionally clear old docs for this supplier from the vector DB.
-    pipeline.collection.delete_many({"supplier_id": supplier_id})
-    
-    # Step 3: Embed the chunks.
-    embs = batch_embed_texts(pipeline.embedding_model, chunks, batch_size=16)
-    docs_to_insert = []
-    for i, chunk_text in enumerate(chunks):
-        docs_to_insert.append({
-            "supplier_id": supplier_id,
-            "chunk_text": chunk_text,
-            "embedding": embs[i].tolist()
-        })
-    if docs_to_insert:
-        pipeline.collection.insert_many(docs_to_insert)
+    # Step 2+3: Embed the chunks and replace old docs for this supplier in the vector DB.
+    embs = batch_embed_texts(pipeline.embedding_model, chunks)
+    pipeline.vector_store.replace_supplier(supplier_id, chunks, embs)
+    pipeline.on_supplier_ingested(supplier_id, chunks, embeddings=embs)
     
     # Step 4: Combine first few chunks into a snippet.
     combined_text = " ".join(chunks[:3])
@@ -276,7 +266,12 @@ def ingest_supplier_pdf_with_summary(
     skills_detected = detect_skills_from_text(combined_text, openai_api_key, num_skills=5)
     
     # Step 7: Generate a summary.
-    summary_text = summarize_text(combined_text, openai_api_key, max_tokens=512)
+    summary_text, summarized = _summarize(combined_text, openai_api_key, max_tokens=512)
+
+    # Step 8: One profile update (one encode) for both; a failure message stays out of the profile.
+    pipeline.update_supplier_profile(
+        supplier_id, pdf_summary=summary_text if summarized else None, skills=skills_detected
+    )
     
     print("DEBUG: Detected roles:", roles_detected)
     print("DEBUG: Detected skills:", skills_detected)
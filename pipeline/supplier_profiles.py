@@ -0,0 +1,213 @@
+# pipeline/supplier_profiles.py
+import pickle
+import threading
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from .embedding_storage import decode_embedding
+from .log_util import log_info
+
+# profile components persisted per supplier; the profile vector is the
+# normalized mean of the ones present
+PROFILE_PARTS = ("chunk_mean", "summary", "skills")
+
+
+def _normalize(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class SupplierProfileIndex:
+    """
+    One profile vector per supplier, for the first stage of two-stage retrieval.
+
+    A profile is the normalized mean of:
+      - the mean of the supplier's (normalized) chunk embeddings
+      - the embedding of its pdf_summary, when present
+      - the embedding of its skills list, when present
+
+    The components are persisted in the supplier_profiles collection, so a
+    new summary or skills list only replaces its own part. Profiles live in a
+    small (n_suppliers x dim) matrix; top_suppliers() is one matrix product.
+    """
+
+    def __init__(self, collection=None, dim=384):
+        self.collection = collection
+        self.dim = dim
+        self._lock = threading.RLock()
+        self._parts: Dict[str, Dict[str, np.ndarray]] = {}
+        self._ids: List[str] = []
+        self._row = {}
+        self._matrix = np.zeros((0, dim), dtype=np.float32)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, supplier_id):
+        return supplier_id in self._row
+
+    # ---------- loading ----------
+    def load_from_collection(self):
+        if self.collection is None:
+            return 0
+        parts = {}
+        for doc in self.collection.find({}, {"_id": 0}):
+            if "supplier_id" not in doc:
+                continue
+            parts[doc["supplier_id"]] = {
+                name: np.asarray(doc[name], dtype=np.float32) for name in PROFILE_PARTS if doc.get(name)
+            }
+        with self._lock:
+            self._parts = parts
+            self._rebuild()
+        log_info("SupplierProfilesLoaded", f"{len(self._ids)} supplier profiles")
+        return len(self._ids)
+
+    def rebuild_from_chunks(self, chunk_collection):
+        """
+        Backfill the chunk_mean part of every supplier from the chunks collection
+        (summary / skills parts already stored are kept).
+        """
+        sums, counts = {}, {}
+        cursor = chunk_collection.find({}, {
+            "_id": 0, "supplier_id": 1, "embedding": 1, "embedding_format": 1, "embedding_scale": 1
+        })
+        for doc in cursor:
+            if "embedding" not in doc or "supplier_id" not in doc:
+                continue
+            sid = doc["supplier_id"]
+            vector = _normalize(decode_embedding(doc))
+            sums[sid] = sums[sid] + vector if sid in sums else vector
+            counts[sid] = counts.get(sid, 0) + 1
+        means = {sid: total / counts[sid] for sid, total in sums.items()}
+        if self.collection is not None and means:
+            from pymongo import UpdateOne
+            self.collection.bulk_write([
+                UpdateOne({"supplier_id": sid}, {"$set": {"chunk_mean": mean.tolist()}}, upsert=True)
+                for sid, mean in means.items()
+            ], ordered=False)
+        with self._lock:
+            for sid, mean in means.items():
+                self._parts.setdefault(sid, {})["chunk_mean"] = mean
+            self._rebuild()
+        log_info("SupplierProfilesRebuilt", f"{len(sums)} supplier profiles from chunks")
+        return len(sums)
+
+    def refresh_suppliers(self, supplier_ids):
+        """
+        Re-read these suppliers' profile parts from the collection.
+        """
+        if self.collection is None:
+            return
+        parts = {sid: {} for sid in supplier_ids}
+        for doc in self.collection.find({"supplier_id": {"$in": list(supplier_ids)}}, {"_id": 0}):
+            parts[doc["supplier_id"]] = {
+                name: np.asarray(doc[name], dtype=np.float32) for name in PROFILE_PARTS if doc.get(name)
+            }
+        with self._lock:
+            self._parts.update(parts)
+            self._rebuild()
+
+    # ---------- snapshots ----------
+    def snapshot_state(self) -> bytes:
+        with self._lock:
+            return pickle.dumps(self._parts, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def restore_state(self, state: bytes):
+        parts = pickle.loads(state)
+        with self._lock:
+            self._parts = parts
+            self._rebuild()
+        log_info("SupplierProfilesRestored", f"{len(self._ids)} supplier profiles")
+
+    # ---------- writes ----------
+    def update(self, supplier_id: str, chunk_embeddings=None, summary_embedding=None, skills_embedding=None):
+        """
+        Replace the given parts of one supplier's profile; None leaves a part as is.
+        """
+        parts = {}
+        if chunk_embeddings is not None and len(chunk_embeddings):
+            parts["chunk_mean"] = _normalize(chunk_embeddings).mean(axis=0)
+        if summary_embedding is not None:
+            parts["summary"] = _normalize(summary_embedding)
+        if skills_embedding is not None:
+            parts["skills"] = _normalize(skills_embedding)
+        if parts:
+            self._set_parts(supplier_id, parts)
+
+    def remove(self, supplier_id: str):
+        if self.collection is not None:
+            self.collection.delete_one({"supplier_id": supplier_id})
+        with self._lock:
+            if self._parts.pop(supplier_id, None) is not None:
+                self._rebuild()
+
+    def _set_parts(self, supplier_id: str, parts: Dict[str, np.ndarray]):
+        if self.collection is not None:
+            self.collection.update_one(
+                {"supplier_id": supplier_id},
+                {"$set": {name: vector.tolist() for name, vector in parts.items()}},
+                upsert=True
+            )
+        with self._lock:
+            self._parts.setdefault(supplier_id, {}).update(parts)
+            row = self._row.get(supplier_id)
+            if row is None:
+                self._rebuild()
+            else:
+                matrix = self._matrix.copy()
+                matrix[row] = self._profile(self._parts[supplier_id])
+                self._matrix = matrix
+
+    def _profile(self, parts: Dict[str, np.ndarray]) -> np.ndarray:
+        return _normalize(np.mean([parts[name] for name in PROFILE_PARTS if name in parts], axis=0))
+
+    def _rebuild(self):
+        ids = [sid for sid, parts in self._parts.items() if parts]
+        self._matrix = np.array([self._profile(self._parts[sid]) for sid in ids],
+                                dtype=np.float32).reshape(-1, self.dim)
+        self._ids = ids
+        self._row = {sid: i for i, sid in enumerate(ids)}
+
+    # ---------- reads ----------
+    def top_suppliers(self, query_vectors, top_m=20, supplier_ids=None) -> Tuple[List[set], Dict[str, float]]:
+        """
+        The top_m suppliers of each query by profile cosine, restricted to
+        supplier_ids if given. Allowed suppliers without a profile can't be
+        ranked, so they are always kept.
+
+        Returns ([selected supplier ids, one set per query],
+        {supplier_id: best profile cosine over the queries}).
+        """
+        with self._lock:
+            matrix, ids, row = self._matrix, self._ids, self._row
+        queries = _normalize(np.asarray(query_vectors, dtype=np.float32).reshape(-1, self.dim))
+
+        unprofiled = set()
+        if supplier_ids is None:
+            rows = np.arange(len(ids))
+        else:
+            rows = np.array(sorted(row[s] for s in supplier_ids if s in row), dtype=np.int64)
+            unprofiled = {s for s in supplier_ids if s not in row}
+        if rows.size == 0:
+            return [set(unprofiled) for _ in range(len(queries))], {}
+
+        sims = queries @ matrix[rows].T
+        m = min(top_m, rows.size)
+        if m < rows.size:
+            top = np.argpartition(-sims, m - 1, axis=1)[:, :m]
+        else:
+            top = np.tile(np.arange(rows.size), (len(queries), 1))
+        best = {}
+        selected = []
+        for q, cols in enumerate(top):
+            chosen = set(unprofiled)
+            for c in cols:
+                sid = ids[rows[c]]
+                chosen.add(sid)
+                best[sid] = max(best.get(sid, -1.0), float(sims[q, c]))
+            selected.append(chosen)
+        return selected, best
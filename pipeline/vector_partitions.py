@@ -0,0 +1,192 @@
+# pipeline/vector_partitions.py
+import threading
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+
+from .embedding_storage import decode_embedding
+from .log_util import log_info
+from .vector_store import InMemoryVectorStore, VectorStore
+
+
+class PartitionedVectorStore(VectorStore):
+    """
+    Per-service shards in front of another vector store.
+
+    A service's partition is an exact InMemoryVectorStore holding the chunks
+    of every supplier linked to it (so a chunk sits in each of its supplier's
+    services). A routed search (service=...) scans only that partition;
+    unrouted searches and all writes go to the wrapped store.
+
+    - Partitions are loaded from the chunks collection on first use.
+    - ServiceCatalog link / unlink / service events and re-ingestion keep
+      loaded partitions current; each access also compares the partition's
+      suppliers with the catalog's and syncs any difference, so links made
+      by another worker are picked up without waiting for an event.
+    - Loaded partitions are kept in LRU order; when their vectors exceed
+      max_bytes, the least recently searched ones are evicted (and reloaded
+      on their next search).
+    """
+
+    def __init__(self, base: VectorStore, collection, service_catalog, dim=384, max_bytes=256 * 1024 * 1024):
+        self.base = base
+        self.collection = collection
+        self.service_catalog = service_catalog
+        self.dim = dim
+        self.max_bytes = max_bytes
+        self._lock = threading.RLock()
+        self._partitions = OrderedDict()   # service name -> InMemoryVectorStore
+        self._members = {}                 # service name -> suppliers its partition was built for
+        self._generation = {}              # service name -> change counter, to detect races with loads
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        service_catalog.subscribe(self._on_catalog_change)
+
+    def __len__(self):
+        return len(self.base)
+
+    # ---------- partitions ----------
+    def _supplier_chunks(self, supplier_ids) -> dict:
+        """
+        supplier_id -> (chunk_texts, embeddings) read from the chunks collection.
+        """
+        by_supplier = {}
+        if not supplier_ids:
+            return by_supplier
+        cursor = self.collection.find({"supplier_id": {"$in": list(supplier_ids)}}, {
+            "_id": 0, "supplier_id": 1, "chunk_text": 1,
+            "embedding": 1, "embedding_format": 1, "embedding_scale": 1
+        })
+        for doc in cursor:
+            if "embedding" not in doc:
+                continue
+            texts, embs = by_supplier.setdefault(doc["supplier_id"], ([], []))
+            texts.append(doc.get("chunk_text", ""))
+            embs.append(decode_embedding(doc))
+        return by_supplier
+
+    def _load(self, service: str, members: set) -> InMemoryVectorStore:
+        partition = InMemoryVectorStore(dim=self.dim)
+        for supplier_id, (texts, embs) in self._supplier_chunks(members).items():
+            partition.add_supplier_chunks(supplier_id, texts, np.vstack(embs))
+        return partition
+
+    def _sync(self, service: str, partition: InMemoryVectorStore, members: set):
+        """
+        Add / drop the suppliers whose links changed since the partition was built.
+        """
+        with self._lock:
+            known = self._members.get(service, set())
+            added, removed = members - known, known - members
+            self._members[service] = set(members)
+        for supplier_id in removed:
+            partition.delete_supplier(supplier_id)
+        for supplier_id, (texts, embs) in self._supplier_chunks(added).items():
+            partition.replace_supplier(supplier_id, texts, np.vstack(embs))
+        if added or removed:
+            log_info("VectorPartitionSynced", f"{service}: +{len(added)} / -{len(removed)} suppliers")
+
+    def partition(self, service: str) -> InMemoryVectorStore:
+        members = self.service_catalog.suppliers_for(service)
+        with self._lock:
+            partition = self._partitions.get(service)
+            if partition is not None:
+                self._partitions.move_to_end(service)
+                self.hits += 1
+                stale = self._members.get(service) != members
+        if partition is not None:
+            if stale:
+                self._sync(service, partition, members)
+            return partition
+        while True:
+            with self._lock:
+                generation = self._generation.get(service, 0)
+            partition = self._load(service, members)
+            with self._lock:
+                if self._generation.get(service, 0) != generation:
+                    members = self.service_catalog.suppliers_for(service)
+                    continue  # membership changed while loading; load again
+                if service not in self._partitions:
+                    self._partitions[service] = partition
+                    self._members[service] = set(members)
+                self._partitions.move_to_end(service)
+                self.loads += 1
+                self._evict(keep=service)
+                log_info("VectorPartitionLoaded", f"{service}: {len(partition)} chunks")
+                return self._partitions[service]
+
+    def _evict(self, keep: str):
+        total = sum(p.nbytes for p in self._partitions.values())
+        for service in list(self._partitions):
+            if total <= self.max_bytes:
+                break
+            if service == keep:
+                continue
+            total -= self._partitions.pop(service).nbytes
+            self._members.pop(service, None)
+            self.evictions += 1
+
+    def _on_catalog_change(self, event_name: str, **details):
+        name = details.get("name")
+        with self._lock:
+            if name:
+                self._generation[name] = self._generation.get(name, 0) + 1
+            partition = self._partitions.get(name)
+            if event_name == "service_removed":
+                self._partitions.pop(name, None)
+                self._members.pop(name, None)
+                return
+            if partition is not None and event_name == "link_added":
+                self._members.setdefault(name, set()).add(details["supplier_id"])
+            elif partition is not None and event_name == "link_removed":
+                self._members.get(name, set()).discard(details["supplier_id"])
+        if partition is None:
+            return
+        if event_name == "link_added":
+            chunks = self._supplier_chunks([details["supplier_id"]]).get(details["supplier_id"])
+            if chunks:
+                partition.replace_supplier(details["supplier_id"], chunks[0], np.vstack(chunks[1]))
+        elif event_name == "link_removed":
+            partition.delete_supplier(details["supplier_id"])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "loaded": list(self._partitions),
+                "bytes": int(sum(p.nbytes for p in self._partitions.values())),
+                "hits": self.hits,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
+
+    # ---------- VectorStore ----------
+    def replace_supplier(self, supplier_id: str, chunk_texts: List[str], embeddings):
+        self.base.replace_supplier(supplier_id, chunk_texts, embeddings)
+        for partition in self._loaded_for(supplier_id):
+            partition.replace_supplier(supplier_id, chunk_texts, embeddings)
+
+    def delete_supplier(self, supplier_id: str):
+        self.base.delete_supplier(supplier_id)
+        for partition in self._loaded_for(supplier_id):
+            partition.delete_supplier(supplier_id)
+
+    def _loaded_for(self, supplier_id: str) -> List[InMemoryVectorStore]:
+        services = self.service_catalog.services_for_supplier(supplier_id)
+        with self._lock:
+            for service in services:
+                self._generation[service] = self._generation.get(service, 0) + 1
+            return [p for s, p in self._partitions.items() if s in services]
+
+    def search(self, query_vector, top_k=3, supplier_ids=None, service=None) -> List[dict]:
+        return self.search_many([query_vector], top_k=top_k, supplier_ids=supplier_ids, service=service)[0]
+
+    def search_many(self, query_vectors, top_k=3, supplier_ids=None, service=None) -> List[List[dict]]:
+        """
+        service: the routed service; its partition is searched instead of the
+        whole corpus (supplier_ids still narrows it further).
+        """
+        if service is None:
+            return self.base.search_many(query_vectors, top_k=top_k, supplier_ids=supplier_ids)
+        return self.partition(service).search_many(query_vectors, top_k=top_k, supplier_ids=supplier_ids)
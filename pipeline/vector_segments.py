@@ -0,0 +1,419 @@
+# pipeline/vector_segments.py
+import fcntl
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import List
+
+import numpy as np
+
+from .embedding_storage import check_format, decode_embedding
+from .log_util import log_info, log_error
+from .vector_store import VectorStore, _chunk_docs
+
+# Segment file layout (little endian), sections 64-byte aligned:
+#   header | matrix (rows x dim, float16/float32, L2-normalized) | supplier code per row (int32)
+#   | chunk_text offsets (int64, rows + 1) | chunk_text utf-8 blob | supplier id table (JSON)
+# Tombstones live in a sidecar "<segment>.tomb" bitmap (one bit per row), the only
+# part that changes after a segment is written.
+SEGMENT_MAGIC = b"RAGVSEG1"
+SEGMENT_VERSION = 1
+_HEADER = struct.Struct("<8sIIQB7xQQQQQQ")
+_DTYPE_CODES = {"float32": 0, "float16": 1}
+_DTYPES = {0: np.dtype("<f4"), 1: np.dtype("<f2")}
+MANIFEST_VERSION = 1
+
+
+def _align(offset: int, to=64) -> int:
+    return (offset + to - 1) // to * to
+
+
+def write_segment(path: str, supplier_ids: List[str], chunk_texts: List[str], matrix, dtype="float16"):
+    """
+    Write one immutable segment file (via a temp file + os.replace) and its
+    empty tombstone bitmap.
+    """
+    dtype_code = _DTYPE_CODES[dtype]
+    matrix = np.ascontiguousarray(matrix, dtype=_DTYPES[dtype_code])
+    rows, dim = matrix.shape
+
+    table = list(dict.fromkeys(supplier_ids))
+    code_of = {s: i for i, s in enumerate(table)}
+    codes = np.array([code_of[s] for s in supplier_ids], dtype="<i4")
+    encoded = [(t or "").encode("utf-8") for t in chunk_texts]
+    text_offsets = np.zeros(rows + 1, dtype="<i8")
+    np.cumsum([len(e) for e in encoded], out=text_offsets[1:])
+    supplier_blob = json.dumps(table).encode("utf-8")
+
+    matrix_offset = _align(_HEADER.size)
+    codes_offset = _align(matrix_offset + matrix.nbytes)
+    text_index_offset = _align(codes_offset + codes.nbytes)
+    text_blob_offset = _align(text_index_offset + text_offsets.nbytes)
+    supplier_offset = _align(text_blob_offset + int(text_offsets[-1]))
+    header = _HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, dim, rows, dtype_code, matrix_offset, codes_offset,
+                          text_index_offset, text_blob_offset, supplier_offset, len(supplier_blob))
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        for offset, payload in ((0, header), (matrix_offset, matrix.tobytes()), (codes_offset, codes.tobytes()),
+                                (text_index_offset, text_offsets.tobytes()), (text_blob_offset, b"".join(encoded)),
+                                (supplier_offset, supplier_blob)):
+            f.seek(offset)
+            f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    with open(path + ".tomb", "wb") as f:
+        f.write(b"\0" * max(1, (rows + 7) // 8))
+    os.replace(tmp, path)
+
+
+class _Segment:
+    """
+    A memory-mapped segment. The matrix, codes and texts are views into the
+    read-only mapping, so every process mapping the file shares the page cache;
+    the tombstone bitmap is a shared writable mapping.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, dim, rows, dtype_code, matrix_offset, codes_offset, text_index_offset,
+         self._text_blob_offset, supplier_offset, supplier_len) = _HEADER.unpack_from(self._mm, 0)
+        if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION:
+            raise ValueError(f"Not a vector segment (or unsupported version): {path}")
+        self.rows, self.dim = rows, dim
+        self.matrix = np.frombuffer(self._mm, dtype=_DTYPES[dtype_code], count=rows * dim,
+                                    offset=matrix_offset).reshape(rows, dim)
+        self.codes = np.frombuffer(self._mm, dtype="<i4", count=rows, offset=codes_offset)
+        self._text_offsets = np.frombuffer(self._mm, dtype="<i8", count=rows + 1, offset=text_index_offset)
+        self.supplier_ids = json.loads(self._mm[supplier_offset:supplier_offset + supplier_len])
+        self.code_of = {s: i for i, s in enumerate(self.supplier_ids)}
+        with open(path + ".tomb", "r+b") as f:
+            self._tomb_mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE)
+        self._tombstones = np.frombuffer(self._tomb_mm, dtype=np.uint8)
+
+    def chunk_text(self, row: int) -> str:
+        start = self._text_blob_offset + int(self._text_offsets[row])
+        end = self._text_blob_offset + int(self._text_offsets[row + 1])
+        return self._mm[start:end].decode("utf-8")
+
+    def live_mask(self) -> np.ndarray:
+        return np.unpackbits(self._tombstones, count=self.rows, bitorder="little") == 0
+
+    def dead_rows(self) -> int:
+        return self.rows - int(self.live_mask().sum())
+
+    def rows_of(self, supplier_id: str) -> np.ndarray:
+        code = self.code_of.get(supplier_id)
+        if code is None:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero((self.codes == code) & self.live_mask())
+
+    def tombstone(self, rows: np.ndarray):
+        if rows.size:
+            np.bitwise_or.at(self._tombstones, rows >> 3, (1 << (rows & 7)).astype(np.uint8))
+            self._tomb_mm.flush()
+
+
+class SegmentedVectorStore(VectorStore):
+    """
+    Exact local search over append-only, memory-mapped segment files, so
+    several uvicorn workers on one host share one page-cached copy of the
+    vectors and a cold start is an mmap instead of a reload from Mongo.
+
+    - manifest.json lists the live segments; it is replaced atomically
+      (os.replace), and readers reopen when it changes.
+    - Re-ingesting a supplier tombstones its old rows and appends a new segment.
+    - compact() merges all segments into one without the tombstoned rows; a
+      background thread runs it when there are too many segments or too many
+      dead rows.
+    - Writers (in any process) serialize on an fcntl lock file.
+
+    Mongo stays the system of record: writes go through to the collection
+    first, and the first start builds the initial segment from it.
+    """
+
+    def __init__(self, directory: str, collection=None, dim=384, dtype="float16", storage_format="array",
+                 compact_interval=300, max_segments=8, max_dead_fraction=0.2, block_rows=65536):
+        if dtype not in _DTYPE_CODES:
+            raise ValueError(f"Unknown segment dtype: {dtype}")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.collection = collection
+        self.dim = dim
+        self.dtype = dtype
+        self.storage_format = check_format(storage_format)
+        self.max_segments = max_segments
+        self.max_dead_fraction = max_dead_fraction
+        self.block_rows = block_rows
+        self._lock = threading.RLock()
+        self._segments = {}       # name -> _Segment
+        self._order = []          # segment names in manifest order
+        self._next_segment = 0
+        self._manifest_stamp = None
+        if compact_interval:
+            threading.Thread(target=self._compaction_loop, args=(compact_interval,),
+                             name="segment-compaction", daemon=True).start()
+
+    # ---------- manifest ----------
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _read_manifest(self):
+        try:
+            with open(self._path("manifest.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_manifest(self, segments: List[str], next_segment: int):
+        tmp = self._path("manifest.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"version": MANIFEST_VERSION, "dim": self.dim, "dtype": self.dtype,
+                       "segments": segments, "next_segment": next_segment}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path("manifest.json"))
+        self._refresh(force=True, locked=True)
+
+    def _refresh(self, force=False, locked=False):
+        """
+        Reopen the segment set if another process (or this one) changed the manifest.
+        Unless the caller already holds the writer lock (locked=True), the
+        manifest is read and its segments mapped under a shared flock, so a
+        compaction can't unlink a segment between the two.
+        """
+        try:
+            st = os.stat(self._path("manifest.json"))
+        except FileNotFoundError:
+            return
+        stamp = (st.st_ino, st.st_mtime_ns)
+        if stamp == self._manifest_stamp and not force:
+            return
+        with self._lock:
+            if locked:
+                self._reopen(stamp)
+            else:
+                with self._flock(fcntl.LOCK_SH):
+                    self._reopen(stamp)
+
+    def _reopen(self, stamp):
+        manifest = self._read_manifest()
+        if manifest is None:
+            return
+        segments = {name: self._segments.get(name) or _Segment(self._path(name)) for name in manifest["segments"]}
+        # dropped segments stay valid for searches still holding them (the mapping outlives the unlink)
+        self._segments, self._order = segments, list(manifest["segments"])
+        self._next_segment = manifest["next_segment"]
+        self._manifest_stamp = stamp
+
+    @contextmanager
+    def _flock(self, mode):
+        with open(self._path("LOCK"), "a+") as lock_file:
+            fcntl.flock(lock_file, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _writer(self):
+        with self._lock:
+            with self._flock(fcntl.LOCK_EX):
+                self._refresh(force=True, locked=True)
+                yield
+
+    # ---------- loading ----------
+    def load_from_collection(self):
+        """
+        Map the existing segments; only if there are none yet, build the first
+        segment from the chunks collection.
+        """
+        with self._writer():
+            if self._read_manifest() is None:
+                self._build_from_collection()
+        log_info("VectorStoreLoaded", f"{len(self)} chunks in {len(self._order)} mmapped segments")
+        return len(self)
+
+    def rebuild_from_collection(self):
+        """
+        Replace every segment with one freshly built from the chunks collection.
+        """
+        with self._writer():
+            old = list(self._order)
+            self._build_from_collection()
+            self._unlink(old)
+        return len(self)
+
+    def _build_from_collection(self):
+        supplier_ids, chunk_texts, embeddings = [], [], []
+        if self.collection is not None:
+            cursor = self.collection.find({}, {
+                "_id": 0, "supplier_id": 1, "chunk_text": 1,
+                "embedding": 1, "embedding_format": 1, "embedding_scale": 1
+            })
+            for doc in cursor:
+                if "embedding" not in doc or "supplier_id" not in doc:
+                    continue
+                supplier_ids.append(doc["supplier_id"])
+                chunk_texts.append(doc.get("chunk_text", ""))
+                embeddings.append(decode_embedding(doc))
+        segments = []
+        if supplier_ids:
+            segments.append(self._new_segment(supplier_ids, chunk_texts, np.vstack(embeddings)))
+        self._write_manifest(segments, self._next_segment)
+
+    def _new_segment(self, supplier_ids, chunk_texts, embeddings) -> str:
+        matrix = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        name = f"seg-{self._next_segment:06d}.vec"
+        self._next_segment += 1
+        write_segment(self._path(name), supplier_ids, chunk_texts, matrix / norms, dtype=self.dtype)
+        return name
+
+    def _unlink(self, names):
+        for name in names:
+            for path in (self._path(name), self._path(name) + ".tomb"):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    # ---------- writes ----------
+    def __len__(self):
+        self._refresh()
+        with self._lock:
+            return sum(int(seg.live_mask().sum()) for seg in self._segments.values())
+
+    def _tombstone_supplier(self, supplier_id: str):
+        for seg in self._segments.values():
+            seg.tombstone(seg.rows_of(supplier_id))
+
+    def replace_supplier(self, supplier_id: str, chunk_texts: List[str], embeddings):
+        if self.collection is not None:
+            self.collection.delete_many({"supplier_id": supplier_id})
+            docs = _chunk_docs(supplier_id, chunk_texts, embeddings, self.storage_format)
+            if docs:
+                self.collection.insert_many(docs)
+        with self._writer():
+            self._tombstone_supplier(supplier_id)
+            if len(chunk_texts):
+                name = self._new_segment([supplier_id] * len(chunk_texts), list(chunk_texts), embeddings)
+                self._write_manifest(self._order + [name], self._next_segment)
+
+    def delete_supplier(self, supplier_id: str):
+        if self.collection is not None:
+            self.collection.delete_many({"supplier_id": supplier_id})
+        with self._writer():
+            self._tombstone_supplier(supplier_id)
+
+    # ---------- compaction ----------
+    def _needs_compaction(self) -> bool:
+        with self._lock:
+            segments = list(self._segments.values())
+        total = sum(seg.rows for seg in segments)
+        dead = sum(seg.dead_rows() for seg in segments)
+        return len(segments) > self.max_segments or (total and dead / total > self.max_dead_fraction)
+
+    def compact(self):
+        """
+        Merge all segments into one holding only the live rows, swap the manifest,
+        then delete the old files.
+        """
+        with self._writer():
+            old = list(self._order)
+            if len(old) <= 1 and not any(seg.dead_rows() for seg in self._segments.values()):
+                return
+            supplier_ids, chunk_texts, blocks = [], [], []
+            for name in old:
+                seg = self._segments[name]
+                rows = np.flatnonzero(seg.live_mask())
+                supplier_ids.extend(seg.supplier_ids[c] for c in seg.codes[rows])
+                chunk_texts.extend(seg.chunk_text(r) for r in rows)
+                blocks.append(seg.matrix[rows].astype(np.float32))
+            segments = []
+            if supplier_ids:
+                segments.append(self._new_segment(supplier_ids, chunk_texts, np.vstack(blocks)))
+            self._write_manifest(segments, self._next_segment)
+            self._unlink(old)
+        log_info("SegmentsCompacted", f"{len(old)} segments -> {len(segments)}, {len(supplier_ids)} live rows")
+
+    def _compaction_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self._refresh()
+                if self._needs_compaction():
+                    self.compact()
+            except Exception as e:
+                log_error("SegmentCompactionError", str(e))
+
+    # ---------- search ----------
+    def search(self, query_vector, top_k=3, supplier_ids=None) -> List[dict]:
+        return self.search_many([query_vector], top_k=top_k, supplier_ids=supplier_ids)[0]
+
+    def search_many(self, query_vectors, top_k=3, supplier_ids=None) -> List[List[dict]]:
+        """
+        Score every segment's live (and allowed) rows in blocks, keep each
+        segment's top-k per query, then merge the per-segment lists.
+        """
+        self._refresh()
+        with self._lock:
+            segments = [self._segments[name] for name in self._order]
+        queries = np.asarray(query_vectors, dtype=np.float32).reshape(-1, self.dim)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        queries = queries / norms
+        n_queries = queries.shape[0]
+        if top_k <= 0:
+            return [[] for _ in range(n_queries)]
+
+        sims_parts, refs = [], []   # (n_queries x k) blocks, and (segment, row) per column
+        for seg in segments:
+            mask = seg.live_mask()
+            if supplier_ids is not None:
+                lookup = np.zeros(len(seg.supplier_ids), dtype=bool)
+                lookup[[seg.code_of[s] for s in supplier_ids if s in seg.code_of]] = True
+                mask &= lookup[seg.codes]
+            rows = np.flatnonzero(mask)
+            if rows.size == 0:
+                continue
+            sims = np.empty((n_queries, rows.size), dtype=np.float32)
+            for start in range(0, rows.size, self.block_rows):
+                block = rows[start:start + self.block_rows]
+                sims[:, start:start + block.size] = queries @ seg.matrix[block].astype(np.float32).T
+            k = min(top_k, rows.size)
+            if k < rows.size:
+                top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            else:
+                top = np.tile(np.arange(rows.size), (n_queries, 1))
+            sims_parts.append(np.take_along_axis(sims, top, axis=1))
+            refs.append((seg, rows[top]))
+
+        if not sims_parts:
+            return [[] for _ in range(n_queries)]
+        all_sims = np.hstack(sims_parts)
+        owners = [(seg, j) for seg, rows in refs for j in range(rows.shape[1])]
+        all_rows = np.hstack([rows for _, rows in refs])
+        k = min(top_k, all_sims.shape[1])
+        order = np.argsort(-all_sims, axis=1, kind="stable")[:, :k]
+
+        results = []
+        for q in range(n_queries):
+            docs = []
+            for col in order[q]:
+                seg = owners[col][0]
+                row = int(all_rows[q, col])
+                docs.append({
+                    "supplier_id": seg.supplier_ids[seg.codes[row]],
+                    "chunk_text": seg.chunk_text(row),
+                    "score": float((1.0 + all_sims[q, col]) / 2.0)
+                })
+            results.append(docs)
+        return results
@@ -0,0 +1,468 @@
+# pipeline/vector_shards.py
+import heapq
+import itertools
+import multiprocessing
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import List
+
+import numpy as np
+
+from .embedding_storage import check_format, decode_embedding
+from .log_util import log_info, log_warning
+from .vector_store import InMemoryVectorStore, VectorStore, _chunk_docs
+
+
+def shard_of(supplier_id: str, n_shards: int) -> int:
+    """
+    Stable shard number of a supplier (crc32, so it's the same in every process and run).
+    """
+    return zlib.crc32(str(supplier_id).encode("utf-8")) % n_shards
+
+
+class ShardError(RuntimeError):
+    pass
+
+
+# =============== Shard process ===============
+def _shard_main(conn, dim: int):
+    """
+    Shard worker loop: an exact InMemoryVectorStore answering requests
+    (request_id, op, args) from the coordinator, one at a time.
+    Every reply is (request_id, ok, payload, busy_ms).
+    """
+    store = InMemoryVectorStore(dim=dim)
+    while True:
+        try:
+            request_id, op, args = conn.recv()
+        except (EOFError, OSError):
+            return
+        start = time.perf_counter()
+        try:
+            if op == "search":
+                payload = store.search_many(args[0], top_k=args[1], supplier_ids=args[2])
+            elif op == "load":
+                for supplier_id, chunk_texts, embeddings in args[0]:
+                    store.add_supplier_chunks(supplier_id, chunk_texts, embeddings)
+                payload = len(store)
+            elif op == "replace":
+                store.replace_supplier(*args)
+                payload = len(store)
+            elif op == "delete":
+                store.delete_supplier(*args)
+                payload = len(store)
+            elif op == "ping":
+                payload = len(store)
+            elif op == "stop":
+                conn.send((request_id, True, None, 0.0))
+                return
+            else:
+                raise ValueError(f"Unknown shard op: {op}")
+            ok = True
+        except Exception as e:
+            ok, payload = False, repr(e)
+        conn.send((request_id, ok, payload, (time.perf_counter() - start) * 1000))
+
+
+# =============== Coordinator side ===============
+class _Shard:
+    """
+    Coordinator handle of one shard process: a pipe, a reader thread that
+    resolves per-request futures, and latency / health counters.
+    """
+
+    def __init__(self, number: int, context, dim: int, latency_window=1000):
+        self.number = number
+        self.context = context
+        self.dim = dim
+        self.process = None
+        self.conn = None
+        self.chunks = 0
+        self.requests = 0
+        self.failures = 0
+        self.restarts = -1
+        self.round_trip_ms = deque(maxlen=latency_window)
+        self.busy_ms = deque(maxlen=latency_window)
+        # set once the shard holds its suppliers; searches skip it until then
+        self.ready = threading.Event()
+        # held by writes and by restart + reload, so no write lands between the two
+        self.write_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._pending = {}
+        self._ids = itertools.count()
+
+    def start(self):
+        self.ready.clear()
+        parent_conn, child_conn = self.context.Pipe()
+        process = self.context.Process(
+            target=_shard_main, args=(child_conn, self.dim),
+            name=f"vector-shard-{self.number}", daemon=True
+        )
+        process.start()
+        child_conn.close()
+        self.process, self.conn = process, parent_conn
+        self.restarts += 1
+        threading.Thread(target=self._read_loop, args=(parent_conn,), daemon=True).start()
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def stop(self, timeout=1.0):
+        process, conn = self.process, self.conn
+        if process is None:
+            return
+        try:
+            self.call("stop", timeout=timeout)
+        except ShardError:
+            pass
+        process.join(timeout)
+        if process.is_alive():
+            process.kill()
+            process.join(timeout)
+        conn.close()
+
+    def _read_loop(self, conn):
+        while True:
+            try:
+                request_id, ok, payload, busy_ms = conn.recv()
+            except (EOFError, OSError):
+                break
+            future = self._pending.pop(request_id, None)
+            if future is None:
+                continue  # reply to a request that already timed out
+            if ok:
+                self.busy_ms.append(busy_ms)
+                future.set_result(payload)
+            else:
+                future.set_exception(ShardError(f"shard {self.number}: {payload}"))
+        # process gone: fail whatever is still waiting on this pipe
+        for request_id in list(self._pending):
+            future = self._pending.pop(request_id, None)
+            if future is not None and not future.done():
+                future.set_exception(ShardError(f"shard {self.number} exited"))
+
+    def submit(self, op: str, *args) -> Future:
+        future = Future()
+        future.sent_at = time.perf_counter()
+        future.generation = self.restarts
+        request_id = next(self._ids)
+        self._pending[request_id] = future
+        try:
+            with self._send_lock:
+                self.conn.send((request_id, op, args))
+        except (OSError, ValueError, AttributeError) as e:
+            self._pending.pop(request_id, None)
+            future.set_exception(ShardError(f"shard {self.number} unreachable: {e}"))
+        self.requests += 1
+        return future
+
+    def wait(self, future: Future, timeout: float):
+        """
+        Result of a submitted request; raises ShardError on failure or timeout.
+        """
+        try:
+            result = future.result(timeout=max(0.0, timeout))
+        except FutureTimeout:
+            self.failures += 1
+            raise ShardError(f"shard {self.number} timed out")
+        except ShardError:
+            self.failures += 1
+            raise
+        self.round_trip_ms.append((time.perf_counter() - future.sent_at) * 1000)
+        return result
+
+    def call(self, op: str, *args, timeout=30.0):
+        return self.wait(self.submit(op, *args), timeout)
+
+    def stats(self) -> dict:
+        round_trip = np.asarray(self.round_trip_ms, dtype=np.float64)
+        busy = np.asarray(self.busy_ms, dtype=np.float64)
+        return {
+            "shard": self.number,
+            "pid": self.process.pid if self.process is not None else None,
+            "alive": self.alive(),
+            "chunks": self.chunks,
+            "requests": self.requests,
+            "failures": self.failures,
+            "restarts": max(self.restarts, 0),
+            "p50_ms": float(np.percentile(round_trip, 50)) if round_trip.size else None,
+            "p95_ms": float(np.percentile(round_trip, 95)) if round_trip.size else None,
+            # time spent searching inside the shard; the rest of the round trip is IPC
+            "busy_p50_ms": float(np.percentile(busy, 50)) if busy.size else None,
+        }
+
+
+class ShardedVectorStore(VectorStore):
+    """
+    Scatter-gather search over K local shard processes.
+
+    Chunks are hash-partitioned by supplier_id (crc32 % K), so a supplier's
+    chunks all live in one shard. A search sends the query vectors to every
+    shard holding an allowed supplier; each shard returns its exact top-k,
+    and the sorted lists are merged with a heap.
+
+    - Mongo stays the system of record: the coordinator writes chunk docs,
+      shards only hold vectors in memory.
+    - A shard that times out or dies is left out of that search (the
+      result is partial, counted in stats()), then restarted and reloaded
+      from the collection. A health thread pings every shard periodically.
+    - stats() gives round-trip / in-shard latency percentiles per shard.
+
+    Shards are started with the "spawn" method, so run the app through
+    uvicorn (or behind an `if __name__ == "__main__"` guard).
+    """
+
+    def __init__(self, collection=None, dim=384, n_shards=4, storage_format="array",
+                 timeout=2.0, health_interval=10.0, start_method="spawn"):
+        if n_shards < 1:
+            raise ValueError("n_shards must be >= 1")
+        self.collection = collection
+        self.dim = dim
+        self.n_shards = n_shards
+        self.storage_format = check_format(storage_format)
+        self.timeout = timeout
+        self.health_interval = health_interval
+        self.partial_searches = 0
+        self._context = multiprocessing.get_context(start_method)
+        self._restart_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._shards = [_Shard(i, self._context, dim) for i in range(n_shards)]
+        for shard in self._shards:
+            shard.start()
+        if health_interval:
+            threading.Thread(target=self._health_loop, daemon=True).start()
+
+    def __len__(self):
+        return sum(shard.chunks for shard in self._shards)
+
+    def close(self):
+        self._closed.set()
+        for shard in self._shards:
+            shard.stop()
+
+    # ---------- loading ----------
+    def _read_collection(self, shard_numbers=None) -> List[list]:
+        """
+        Per shard, [(supplier_id, chunk_texts, embeddings)] read from the collection
+        (only for shard_numbers, if given).
+        """
+        by_supplier = {}
+        if self.collection is not None:
+            cursor = self.collection.find({}, {
+                "_id": 0, "supplier_id": 1, "chunk_text": 1,
+                "embedding": 1, "embedding_format": 1, "embedding_scale": 1
+            })
+            for doc in cursor:
+                if "embedding" not in doc or "supplier_id" not in doc:
+                    continue
+                supplier_id = doc["supplier_id"]
+                if shard_numbers is not None and shard_of(supplier_id, self.n_shards) not in shard_numbers:
+                    continue
+                texts, embs = by_supplier.setdefault(supplier_id, ([], []))
+                texts.append(doc.get("chunk_text", ""))
+                embs.append(decode_embedding(doc))
+        per_shard = [[] for _ in range(self.n_shards)]
+        for supplier_id, (texts, embs) in by_supplier.items():
+            per_shard[shard_of(supplier_id, self.n_shards)].append(
+                (supplier_id, texts, np.vstack(embs).astype(np.float32))
+            )
+        return per_shard
+
+    def _load(self, shards: List[_Shard], per_shard: List[list]):
+        futures = [(shard, shard.submit("load", per_shard[shard.number])) for shard in shards]
+        for shard, future in futures:
+            shard.chunks = shard.wait(future, timeout=max(self.timeout, 300.0))
+            shard.ready.set()
+
+    def load_from_collection(self):
+        """
+        Read the chunks collection once and hand each shard its suppliers.
+        """
+        for shard in self._shards:
+            if shard.chunks:
+                shard.stop()
+                shard.start()
+        self._load(self._shards, self._read_collection())
+        log_info("ShardedVectorStoreLoaded", f"{len(self)} chunks in {self.n_shards} shards: "
+                                             f"{[shard.chunks for shard in self._shards]}")
+        return len(self)
+
+    # ---------- health ----------
+    def _restart(self, shard: _Shard, reason: str, generation=None):
+        """
+        Replace the shard process and reload its suppliers from the collection.
+        generation: the shard's restart count when the failure was seen; if it
+        has been restarted since, there is nothing to do.
+        """
+        with self._restart_lock, shard.write_lock:
+            if self._closed.is_set() or (generation is not None and generation != shard.restarts):
+                return
+            log_warning("VectorShardRestart", f"shard {shard.number}: {reason}")
+            shard.stop(timeout=0.5)
+            shard.start()
+            try:
+                self._load([shard], self._read_collection({shard.number}))
+            except ShardError as e:
+                log_warning("VectorShardReloadFailed", str(e))
+
+    def _restart_async(self, shard: _Shard, reason: str, generation=None):
+        threading.Thread(target=self._restart, args=(shard, reason, generation), daemon=True).start()
+
+    def check_health(self):
+        """
+        Ping every shard; restart the ones that are dead or don't answer in time.
+        """
+        futures = [(shard, shard.submit("ping")) for shard in self._shards if shard.ready.is_set()]
+        for shard, future in futures:
+            try:
+                shard.chunks = shard.wait(future, timeout=self.timeout)
+            except ShardError as e:
+                self._restart(shard, str(e), future.generation)
+
+    def _health_loop(self):
+        while not self._closed.wait(self.health_interval):
+            try:
+                self.check_health()
+            except Exception as e:
+                log_warning("VectorShardHealthCheckFailed", repr(e))
+
+    # ---------- writes ----------
+    def replace_supplier(self, supplier_id: str, chunk_texts: List[str], embeddings):
+        if self.collection is not None:
+            self.collection.delete_many({"supplier_id": supplier_id})
+            docs = _chunk_docs(supplier_id, chunk_texts, embeddings, self.storage_format)
+            if docs:
+                self.collection.insert_many(docs)
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        self._write(supplier_id, "replace", supplier_id, list(chunk_texts), embeddings)
+
+    def delete_supplier(self, supplier_id: str):
+        if self.collection is not None:
+            self.collection.delete_many({"supplier_id": supplier_id})
+        self._write(supplier_id, "delete", supplier_id)
+
+    def _write(self, supplier_id: str, op: str, *args):
+        shard = self._shards[shard_of(supplier_id, self.n_shards)]
+        with shard.write_lock:
+            if not shard.ready.is_set():
+                return  # never loaded; load_from_collection will pick the write up
+            future = shard.submit(op, *args)
+            try:
+                shard.chunks = shard.wait(future, timeout=max(self.timeout, 30.0))
+                return
+            except ShardError as e:
+                failure = str(e)
+        # the reload after the restart reads the collection, which already has the write
+        self._restart_async(shard, failure, future.generation)
+
+    # ---------- reads ----------
+    def search(self, query_vector, top_k=3, supplier_ids=None) -> List[dict]:
+        return self.search_many([query_vector], top_k=top_k, supplier_ids=supplier_ids)[0]
+
+    def search_many(self, query_vectors, top_k=3, supplier_ids=None) -> List[List[dict]]:
+        """
+        Scatter the query vectors to the shards, gather each shard's top-k
+        and heap-merge them per query. With supplier_ids, only shards owning
+        one of them are asked, each with just its own suppliers.
+        """
+        queries = np.ascontiguousarray(query_vectors, dtype=np.float32).reshape(-1, self.dim)
+        n_queries = queries.shape[0]
+        if top_k <= 0:
+            return [[] for _ in range(n_queries)]
+
+        if supplier_ids is None:
+            targets = [(shard, None) for shard in self._shards]
+        else:
+            owned = {}
+            for supplier_id in supplier_ids:
+                owned.setdefault(shard_of(supplier_id, self.n_shards), []).append(supplier_id)
+            targets = [(self._shards[n], ids) for n, ids in sorted(owned.items())]
+
+        futures = [(shard, shard.submit("search", queries, top_k, ids)) for shard, ids in targets
+                   if shard.ready.is_set()]
+        partial = len(futures) < len(targets)
+        deadline = time.perf_counter() + self.timeout
+        gathered = []
+        for shard, future in futures:
+            try:
+                gathered.append(shard.wait(future, timeout=deadline - time.perf_counter()))
+            except ShardError as e:
+                partial = True
+                log_warning("VectorShardSearchFailed", str(e))
+                self._restart_async(shard, str(e), future.generation)
+        if partial:
+            self.partial_searches += 1
+
+        # each shard's lists are already sorted by descending score
+        return [
+            list(itertools.islice(
+                heapq.merge(*(per_shard[q] for per_shard in gathered), key=lambda d: -d["score"]), top_k
+            ))
+            for q in range(n_queries)
+        ]
+
+    def stats(self) -> dict:
+        return {
+            "shards": [shard.stats() for shard in self._shards],
+            "chunks": len(self),
+            "partial_searches": self.partial_searches,
+        }
+
+
+def benchmark_shards(vectors, n_shards=4, n_queries=200, top_k=10, batch=8, seed=0) -> dict:
+    """
+    Latency of sharded vs. single-process exact search over the same vectors
+    (20 chunks per synthetic supplier), plus the per-shard breakdown.
+    "match" says whether both returned the same top-k.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    dim = vectors.shape[1]
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.choice(len(vectors), size=n_queries, replace=False)]
+    suppliers = [
+        (f"supplier-{start // 20}", [str(i) for i in range(start, min(start + 20, len(vectors)))],
+         vectors[start:start + 20])
+        for start in range(0, len(vectors), 20)
+    ]
+
+    single = InMemoryVectorStore(dim=dim)
+    for supplier_id, chunk_texts, embeddings in suppliers:
+        single.add_supplier_chunks(supplier_id, chunk_texts, embeddings)
+    sharded = ShardedVectorStore(dim=dim, n_shards=n_shards, timeout=30.0, health_interval=0)
+    try:
+        per_shard = [[] for _ in range(n_shards)]
+        for supplier in suppliers:
+            per_shard[shard_of(supplier[0], n_shards)].append(supplier)
+        sharded._load(sharded._shards, per_shard)
+
+        report, found = {}, {}
+        for name, store in (("single", single), ("sharded", sharded)):
+            start = time.perf_counter()
+            results = []
+            for i in range(0, n_queries, batch):
+                results.extend(store.search_many(queries[i:i + batch], top_k=top_k))
+            report[f"{name}_ms_per_batch"] = (time.perf_counter() - start) * 1000 / -(-n_queries // batch)
+            found[name] = [[d["chunk_text"] for d in r] for r in results]
+        report["match"] = found["single"] == found["sharded"]
+        report["shards"] = sharded.stats()["shards"]
+        return report
+    finally:
+        sharded.close()
+
+
+if __name__ == "__main__":
+    # python -m pipeline.vector_shards [n_vectors] [n_shards]
+    import sys
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    k = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    data = np.random.default_rng(1).standard_normal((n, 384)).astype(np.float32)
+    result = benchmark_shards(data, n_shards=k)
+    print(f"single  {result['single_ms_per_batch']:.2f} ms/batch")
+    print(f"sharded {result['sharded_ms_per_batch']:.2f} ms/batch  (same results: {result['match']})")
+    for shard in result["shards"]:
+        print(f"  shard {shard['shard']}: {shard['chunks']} chunks  round trip p50 {shard['p50_ms']:.2f} ms  "
+              f"p95 {shard['p95_ms']:.2f} ms  in-shard p50 {shard['busy_p50_ms']:.2f} ms")
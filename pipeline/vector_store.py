@@ -0,0 +1,678 @@
+# pipeline/vector_store.py
+import pickle
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import numpy as np
+
+from .embedding_storage import ATLAS_FORMATS, check_format, decode_embedding, encode_embeddings, encode_query
+from .log_util import log_info
+
+
+def _chunk_docs(supplier_id: str, chunk_texts: List[str], embeddings, storage_format="array") -> List[dict]:
+    """
+    Build the Mongo chunk documents for one supplier, with the embedding
+    written in storage_format (see embedding_storage).
+    """
+    docs = []
+    for chunk_text, fields in zip(chunk_texts, encode_embeddings(embeddings, storage_format)):
+        docs.append(dict(fields, supplier_id=supplier_id, chunk_text=chunk_text))
+    return docs
+
+
+def _read_supplier_chunks(collection, supplier_ids) -> dict:
+    """
+    supplier_id -> (chunk_texts, embeddings) for the given suppliers, from the chunks collection.
+    """
+    by_supplier = {}
+    cursor = collection.find({"supplier_id": {"$in": list(supplier_ids)}}, {
+        "_id": 0, "supplier_id": 1, "chunk_text": 1,
+        "embedding": 1, "embedding_format": 1, "embedding_scale": 1
+    })
+    for doc in cursor:
+        if "embedding" not in doc:
+            continue
+        texts, embs = by_supplier.setdefault(doc["supplier_id"], ([], []))
+        texts.append(doc.get("chunk_text", ""))
+        embs.append(decode_embedding(doc))
+    return {sid: (texts, np.vstack(embs)) for sid, (texts, embs) in by_supplier.items()}
+
+
+class VectorStore:
+    """
+    What the pipelines need from a vector backend:
+    search by query vector, and replace / delete one supplier's chunks.
+
+    search() returns docs shaped like the Atlas projection:
+    {"supplier_id": ..., "chunk_text": ..., "score": ...}
+    """
+
+    def search(self, query_vector, top_k=3, supplier_ids=None) -> List[dict]:
+        """
+        supplier_ids: optional collection of allowed suppliers. The filter is
+        applied inside the search, so the top_k budget only goes to them.
+        """
+        raise NotImplementedError
+
+    def search_many(self, query_vectors, top_k=3, supplier_ids=None) -> List[List[dict]]:
+        """
+        One result list per query vector, in the same order.
+        """
+        return [self.search(q, top_k=top_k, supplier_ids=supplier_ids) for q in query_vectors]
+
+    def replace_supplier(self, supplier_id: str, chunk_texts: List[str], embeddings):
+        raise NotImplementedError
+
+    def delete_supplier(self, supplier_id: str):
+        raise NotImplementedError
+
+
+class AtlasVectorStore(VectorStore):
+    """
+    MongoDB Atlas $vectorSearch over the chunks collection (the original backend).
+    """
+
+    def __init__(self, collection, index_name="default", num_candidates=50, max_parallel=8,
+                 storage_format="array"):
+        self.collection = collection
+        self.index_name = index_name
+        self.num_candidates = num_candidates
+        storage_format = check_format(storage_format)
+        if storage_format not in ATLAS_FORMATS:
+            raise ValueError(f"Atlas $vectorSearch can't index {storage_format} embeddings")
+        self.storage_format = storage_format
+        # $vectorSearch can't be batched into one stage, so search_many fans
+        # the aggregates out over a small thread pool (pymongo is thread-safe)
+        self._executor = ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix="atlas-search")
+
+    def search(self, query_vector, top_k=3, supplier_ids=None) -> List[dict]:
+        vector_search = {
+            "index": self.index_name,
+            "queryVector": encode_query(query_vector, self.storage_format),
+            "path": "embedding",
+            "limit": top_k,
+            "numCandidates": self.num_candidates
+        }
+        if supplier_ids is not None:
+            # pre-filter: needs supplier_id declared as a "filter" field in the index
+            vector_search["filter"] = {"supplier_id": {"$in": list(supplier_ids)}}
+        pipeline = [
+            {"$vectorSearch": vector_search},
+            {
+                "$project": {
+                    "_id": 0,
+                    "supplier_id": 1,
+                    "chunk_text": 1,
+                    "score": {"$meta": "vectorSearchScore"}
+                }
+            }
+        ]
+        return list(self.collection.aggregate(pipeline))
+
+    def search_many(self, query_vectors, top_k=3, supplier_ids=None) -> List[List[dict]]:
+        query_vectors = list(query_vectors)
+        if len(query_vectors) <= 1:
+            return [self.search(q, top_k=top_k, supplier_ids=supplier_ids) for q in query_vectors]
+        return list(self._executor.map(
+            lambda q: self.search(q, top_k=top_k, supplier_ids=supplier_ids), query_vectors
+        ))
+
+    def replace_supplier(self, supplier_id: str, chunk_texts: List[str], embeddings):
+        self.collection.delete_many({"supplier_id": supplier_id})
+        docs = _chunk_docs(supplier_id, chunk_texts, embeddings, self.storage_format)
+        if docs:
+            self.collection.insert_many(docs)
+
+    def delete_supplier(self, supplier_id: str):
+        self.collection.delete_many({"supplier_id": supplier_id})
+
+
+class InMemoryVectorStore(VectorStore):
+    """
+    Exact in-process search. All chunk embeddings live in one contiguous
+    float32 matrix (rows L2-normalized) with parallel supplier / chunk columns,
+    so a query is one matrix-vector product plus argpartition.
+
+    Supplier ids are stored as int32 codes so a supplier filter is a single
+    vectorized lookup that masks rows out before they are scored.
+
+    Scores use the same scale as Atlas cosine vectorSearchScore, (1 + cos) / 2,
+    so thresholds like min_score=0.6 mean the same thing on both backends.
+
+    If a collection is given, writes go through to Mongo (still the system of
+    record, embeddings written in storage_format) and load_from_collection()
+    rebuilds the matrix on startup from docs in any storage format.
+    """
+
+    def __init__(self, collection=None, dim=384, storage_format="array"):
+        self.collection = collection
+        self.dim = dim
+        self.storage_format = check_format(storage_format)
+        self._lock = threading.RLock()
+        self._matrix = np.zeros((0, dim), dtype=np.float32)
+        self._size = 0
+        self._codes = np.zeros(0, dtype=np.int32)
+        self._chunk_texts = np.zeros(0, dtype=object)
+        self._code_of = {}   # supplier_id -> code
+        self._id_of = []     # code -> supplier_id
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory held by the embedding matrix (including spare capacity).
+        """
+        return self._matrix.nbytes
+
+    @staticmethod
+    def _normalize(vectors) -> np.ndarray:
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _code(self, supplier_id: str) -> int:
+        code = self._code_of.get(supplier_id)
+        if code is None:
+            code = len(self._id_of)
+            self._code_of[supplier_id] = code
+            self._id_of.append(supplier_id)
+        return code
+
+    def load_from_collection(self):
+        """
+        (Re)build the in-memory matrix from every chunk doc in the collection.
+        """
+        if self.collection is None:
+            return 0
+        cursor = self.collection.find({}, {
+            "_id": 0, "supplier_id": 1, "chunk_text": 1,
+            "embedding": 1, "embedding_format": 1, "embedding_scale": 1
+        })
+        supplier_ids, chunk_texts, embeddings = [], [], []
+        for doc in cursor:
+            if "embedding" not in doc or "supplier_id" not in doc:
+                continue
+            supplier_ids.append(doc["supplier_id"])
+            chunk_texts.append(doc.get("chunk_text", ""))
+            embeddings.append(decode_embedding(doc))
+
+        matrix = self._normalize(np.array(embeddings, dtype=np.float32).reshape(-1, self.dim))
+        with self._lock:
+            self._code_of, self._id_of = {}, []
+            self._codes = np.array([self._code(s) for s in supplier_ids], dtype=np.int32)
+            self._matrix = matrix
+            self._size = len(supplier_ids)
+            self._chunk_texts = np.array(chunk_texts, dtype=object)
+        log_info("VectorStoreLoaded", f"{self._size} chunks in memory")
+        return self._size
+
+    def _append(self, supplier_id: str, chunk_texts: List[str], embeddings):
+        rows = self._normalize(np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim))
+        n_new = rows.shape[0]
+        if n_new == 0:
+            return
+        needed = self._size + n_new
+        if needed > self._matrix.shape[0]:
+            # grow geometrically so repeated ingestion stays amortized O(1) per row;
+            # readers keep their reference to the old buffer
+            capacity = max(needed, 2 * self._matrix.shape[0], 64)
+            grown = np.zeros((capacity, self.dim), dtype=np.float32)
+            grown[:self._size] = self._matrix[:self._size]
+            self._matrix = grown
+            codes = np.zeros(capacity, dtype=np.int32)
+            codes[:self._size] = self._codes[:self._size]
+            self._codes = codes
+            texts = np.empty(capacity, dtype=object)
+            texts[:self._size] = self._chunk_texts[:self._size]
+            self._chunk_texts = texts
+        self._matrix[self._size:needed] = rows
+        self._codes[self._size:needed] = self._code(supplier_id)
+        self._chunk_texts[self._size:needed] = list(chunk_texts)
+        self._size = needed
+
+    def _remove(self, supplier_id: str):
+        code = self._code_of.get(supplier_id)
+        if code is None:
+            return
+        keep = self._codes[:self._size] != code
+        if keep.all():
+            return
+        # build fresh arrays instead of compacting in place, so a concurrent
+        # search keeps a consistent view of the old ones
+        self._matrix = np.ascontiguousarray(self._matrix[:self._size][keep])
+        self._codes = self._codes[:self._size][keep]
+        self._chunk_texts = self._chunk_texts[:self._size][keep]
+        self._size = int(keep.sum())
+
+    def add_supplier_chunks(self, supplier_id: str, chunk_texts: List[str], embeddings):
+        """
+        Append chunks for a supplier in memory only (no write to Mongo).
+        """
+        with self._lock:
+            self._append(supplier_id, chunk_texts, embeddings)
+
+    def replace_supplier(self, supplier_id: str, chunk_texts: List[str], embeddings):
+        if self.collection is not None:
+            self.collection.delete_many({"supplier_id": supplier_id})
+            docs = _chunk_docs(supplier_id, chunk_texts, embeddings, self.storage_format)
+            if docs:
+                self.collection.insert_many(docs)
+        with self._lock:
+            self._remove(supplier_id)
+            self._append(supplier_id, chunk_texts, embeddings)
+
+    def delete_supplier(self, supplier_id: str):
+        if self.collection is not None:
+            self.collection.delete_many({"supplier_id": supplier_id})
+        with self._lock:
+            self._remove(supplier_id)
+
+    def refresh_suppliers(self, supplier_ids):
+        """
+        Re-read these suppliers' chunks from the collection into memory
+        (no writes to Mongo); suppliers without chunks are dropped.
+        """
+        chunks = _read_supplier_chunks(self.collection, supplier_ids)
+        with self._lock:
+            for supplier_id in supplier_ids:
+                self._remove(supplier_id)
+                if supplier_id in chunks:
+                    self._append(supplier_id, *chunks[supplier_id])
+
+    # ---------- snapshots ----------
+    def snapshot_state(self) -> bytes:
+        with self._lock:
+            return pickle.dumps({
+                "matrix": self._matrix[:self._size],
+                "codes": self._codes[:self._size],
+                "chunk_texts": self._chunk_texts[:self._size],
+                "id_of": self._id_of,
+            }, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def restore_state(self, state: bytes):
+        state = pickle.loads(state)
+        if state["matrix"].shape[1] != self.dim:
+            raise ValueError(f"snapshot has dim {state['matrix'].shape[1]}, expected {self.dim}")
+        with self._lock:
+            self._matrix = np.ascontiguousarray(state["matrix"], dtype=np.float32)
+            self._size = self._matrix.shape[0]
+            self._codes = state["codes"]
+            self._chunk_texts = state["chunk_texts"]
+            self._id_of = list(state["id_of"])
+            self._code_of = {supplier_id: code for code, supplier_id in enumerate(self._id_of)}
+        log_info("VectorStoreRestored", f"{self._size} chunks in memory")
+
+    def search(self, query_vector, top_k=3, supplier_ids=None) -> List[dict]:
+        return self.search_many([query_vector], top_k=top_k, supplier_ids=supplier_ids)[0]
+
+    def search_many(self, query_vectors, top_k=3, supplier_ids=None) -> List[List[dict]]:
+        """
+        All queries at once: one (n_queries x n_chunks) matrix product,
+        then a row-wise argpartition for the top-k of every query.
+        With supplier_ids, only those suppliers' rows are scored.
+        """
+        with self._lock:
+            matrix, size = self._matrix, self._size
+            codes, chunk_texts = self._codes, self._chunk_texts
+            id_of = self._id_of
+            allowed = None
+            if supplier_ids is not None:
+                allowed = [self._code_of[s] for s in supplier_ids if s in self._code_of]
+        queries = self._normalize(np.asarray(query_vectors, dtype=np.float32).reshape(-1, self.dim))
+        n_queries = queries.shape[0]
+        if size == 0 or top_k <= 0:
+            return [[] for _ in range(n_queries)]
+
+        if allowed is None:
+            rows = None
+            candidates = matrix[:size]
+        else:
+            lookup = np.zeros(len(id_of), dtype=bool)
+            lookup[allowed] = True
+            rows = np.flatnonzero(lookup[codes[:size]])
+            if rows.size == 0:
+                return [[] for _ in range(n_queries)]
+            candidates = matrix[rows]
+
+        n = candidates.shape[0]
+        sims = queries @ candidates.T
+        k = min(top_k, n)
+        if k < n:
+            top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(n), (n_queries, 1))
+        top_sims = np.take_along_axis(sims, top, axis=1)
+        order = np.argsort(-top_sims, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        top_sims = np.take_along_axis(top_sims, order, axis=1)
+        if rows is not None:
+            top = rows[top]
+
+        results = []
+        for row, row_sims in zip(top, top_sims):
+            results.append([
+                {
+                    "supplier_id": id_of[codes[i]],
+                    "chunk_text": chunk_texts[i],
+                    "score": float((1.0 + s) / 2.0)
+                }
+                for i, s in zip(row, row_sims)
+            ])
+        return results
+
+
+class HnswVectorStore(VectorStore):
+    """
+    Approximate in-process search over an hnswlib graph (cosine space), for
+    corpora where exact scoring gets expensive.
+
+    - M / ef_construction shape the graph, ef_search trades recall for latency.
+    - Inserts are incremental; the index grows with resize_index().
+    - A supplier's old chunks are tombstoned with mark_deleted() on
+      re-ingestion. Their labels go on a free list and get reused by later
+      inserts, which revive and overwrite the tombstoned slot.
+    - With supplier_ids, the graph search uses a label filter. If only a few
+      chunks are allowed (at most exact_threshold), those rows are scored
+      exactly instead, which is both faster and exact for small routed sets.
+
+    Scores use the same (1 + cos) / 2 scale as the other backends.
+    """
+
+    def __init__(self, collection=None, dim=384, M=16, ef_construction=200, ef_search=64,
+                 initial_capacity=10000, exact_threshold=2000, storage_format="array"):
+        import hnswlib
+
+        self.collection = collection
+        self.dim = dim
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.exact_threshold = exact_threshold
+        self.storage_format = check_format(storage_format)
+        self._lock = threading.RLock()
+        self._index = hnswlib.Index(space="cosine", dim=dim)
+        self._index.init_index(max_elements=initial_capacity, M=M, ef_construction=ef_construction)
+        self._index.set_ef(ef_search)
+        self._capacity = initial_capacity
+        self._next_label = 0
+        self._free_labels = []
+        self._codes = np.full(initial_capacity, -1, dtype=np.int32)   # label -> supplier code, -1 = deleted
+        self._chunk_texts = np.empty(initial_capacity, dtype=object)
+        self._labels_of = {}  # supplier_id -> [label]
+        self._code_of = {}
+        self._id_of = []
+
+    def __len__(self):
+        return self._next_label - len(self._free_labels)
+
+    def _code(self, supplier_id: str) -> int:
+        code = self._code_of.get(supplier_id)
+        if code is None:
+            code = len(self._id_of)
+            self._code_of[supplier_id] = code
+            self._id_of.append(supplier_id)
+        return code
+
+    def set_ef(self, ef_search: int):
+        with self._lock:
+            self.ef_search = ef_search
+            self._index.set_ef(ef_search)
+
+    def load_from_collection(self):
+        if self.collection is None:
+            return 0
+        cursor = self.collection.find({}, {
+            "_id": 0, "supplier_id": 1, "chunk_text": 1,
+            "embedding": 1, "embedding_format": 1, "embedding_scale": 1
+        })
+        by_supplier = {}
+        for doc in cursor:
+            if "embedding" not in doc or "supplier_id" not in doc:
+                continue
+            texts, embs = by_supplier.setdefault(doc["supplier_id"], ([], []))
+            texts.append(doc.get("chunk_text", ""))
+            embs.append(decode_embedding(doc))
+        with self._lock:
+            for supplier_id, (texts, embs) in by_supplier.items():
+                self._append(supplier_id, texts, np.vstack(embs))
+        log_info("VectorStoreLoaded", f"{len(self)} chunks in HNSW index (M={self.M}, ef_search={self.ef_search})")
+        return len(self)
+
+    def _append(self, supplier_id: str, chunk_texts: List[str], embeddings):
+        rows = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        n_new = rows.shape[0]
+        if n_new == 0:
+            return
+        reused = [self._free_labels.pop() for _ in range(min(n_new, len(self._free_labels)))]
+        fresh = list(range(self._next_label, self._next_label + n_new - len(reused)))
+        self._next_label += len(fresh)
+        if self._next_label > self._capacity:
+            capacity = max(self._next_label, 2 * self._capacity)
+            self._index.resize_index(capacity)
+            codes = np.full(capacity, -1, dtype=np.int32)
+            codes[:self._capacity] = self._codes
+            texts = np.empty(capacity, dtype=object)
+            texts[:self._capacity] = self._chunk_texts
+            self._codes, self._chunk_texts, self._capacity = codes, texts, capacity
+        labels = np.array(reused + fresh, dtype=np.int64)
+        # re-adding a tombstoned label un-deletes it and overwrites its vector
+        self._index.add_items(rows, labels)
+        self._codes[labels] = self._code(supplier_id)
+        self._chunk_texts[labels] = list(chunk_texts)
+        self._labels_of.setdefault(supplier_id, []).extend(labels.tolist())
+
+    def _remove(self, supplier_id: str):
+        labels = self._labels_of.pop(supplier_id, [])
+        for label in labels:
+            self._index.mark_deleted(label)
+        if labels:
+            self._codes[labels] = -1
+            self._chunk_texts[labels] = None
+            self._free_labels.extend(labels)
+
+    def add_supplier_chunks(self, supplier_id: str, chunk_texts: List[str], embeddings):
+        with self._lock:
+            self._append(supplier_id, chunk_texts, embeddings)
+
+    def replace_supplier(self, supplier_id: str, chunk_texts: List[str], embeddings):
+        if self.collection is not None:
+            self.collection.delete_many({"supplier_id": supplier_id})
+            docs = _chunk_docs(supplier_id, chunk_texts, embeddings, self.storage_format)
+            if docs:
+                self.collection.insert_many(docs)
+        with self._lock:
+            self._remove(supplier_id)
+            self._append(supplier_id, chunk_texts, embeddings)
+
+    def delete_supplier(self, supplier_id: str):
+        if self.collection is not None:
+            self.collection.delete_many({"supplier_id": supplier_id})
+        with self._lock:
+            self._remove(supplier_id)
+
+    def refresh_suppliers(self, supplier_ids):
+        """
+        Re-read these suppliers' chunks from the collection into the graph
+        (no writes to Mongo); suppliers without chunks are dropped.
+        """
+        chunks = _read_supplier_chunks(self.collection, supplier_ids)
+        with self._lock:
+            for supplier_id in supplier_ids:
+                self._remove(supplier_id)
+                if supplier_id in chunks:
+                    self._append(supplier_id, *chunks[supplier_id])
+
+    # ---------- snapshots ----------
+    _SNAPSHOT_FIELDS = ("_index", "_capacity", "_next_label", "_free_labels", "_codes",
+                        "_chunk_texts", "_labels_of", "_code_of", "_id_of")
+
+    def snapshot_state(self) -> bytes:
+        # hnswlib indexes pickle with their graph and deletion marks
+        with self._lock:
+            return pickle.dumps({name: getattr(self, name) for name in self._SNAPSHOT_FIELDS},
+                                protocol=pickle.HIGHEST_PROTOCOL)
+
+    def restore_state(self, state: bytes):
+        state = pickle.loads(state)
+        if state["_index"].dim != self.dim:
+            raise ValueError(f"snapshot has dim {state['_index'].dim}, expected {self.dim}")
+        with self._lock:
+            for name in self._SNAPSHOT_FIELDS:
+                setattr(self, name, state[name])
+            self._index.set_ef(self.ef_search)
+        log_info("VectorStoreRestored", f"{len(self)} chunks in HNSW index")
+
+    def search(self, query_vector, top_k=3, supplier_ids=None) -> List[dict]:
+        return self.search_many([query_vector], top_k=top_k, supplier_ids=supplier_ids)[0]
+
+    def search_many(self, query_vectors, top_k=3, supplier_ids=None) -> List[List[dict]]:
+        queries = np.asarray(query_vectors, dtype=np.float32).reshape(-1, self.dim)
+        n_queries = queries.shape[0]
+        with self._lock:
+            live = len(self)
+            if live == 0 or top_k <= 0:
+                return [[] for _ in range(n_queries)]
+            if supplier_ids is None:
+                k = min(top_k, live)
+                labels, distances = self._index.knn_query(queries, k=k)
+                sims = 1.0 - distances
+            else:
+                allowed = [self._code_of[s] for s in supplier_ids if s in self._code_of]
+                rows = np.array(
+                    [label for s in supplier_ids for label in self._labels_of.get(s, ())], dtype=np.int64
+                )
+                if rows.size == 0:
+                    return [[] for _ in range(n_queries)]
+                if rows.size <= self.exact_threshold:
+                    labels, sims = self._exact(queries, rows, top_k)
+                else:
+                    lookup = np.zeros(len(self._id_of) + 1, dtype=bool)
+                    lookup[allowed] = True  # code -1 maps to the extra last slot, which stays False
+                    codes = self._codes
+                    k = min(top_k, rows.size)
+                    try:
+                        labels, distances = self._index.knn_query(
+                            queries, k=k, num_threads=1, filter=lambda label: bool(lookup[codes[label]])
+                        )
+                        sims = 1.0 - distances
+                    except RuntimeError:
+                        # the filtered graph walk found fewer than k neighbours
+                        labels, sims = self._exact(queries, rows, top_k)
+            codes, chunk_texts, id_of = self._codes, self._chunk_texts, self._id_of
+
+        results = []
+        for row, row_sims in zip(labels, sims):
+            results.append([
+                {
+                    "supplier_id": id_of[codes[label]],
+                    "chunk_text": chunk_texts[label],
+                    "score": float((1.0 + s) / 2.0)
+                }
+                for label, s in zip(row, row_sims)
+            ])
+        return results
+
+    def _exact(self, queries, rows, top_k):
+        vectors = InMemoryVectorStore._normalize(self._index.get_items(rows, return_type="numpy"))
+        sims = InMemoryVectorStore._normalize(queries) @ vectors.T
+        k = min(top_k, rows.size)
+        top = np.argsort(-sims, axis=1, kind="stable")[:, :k]
+        return rows[top], np.take_along_axis(sims, top, axis=1)
+
+
+def benchmark_ann(vectors, n_queries=200, top_k=10, ef_values=(16, 32, 64, 128, 256),
+                  M=16, ef_construction=200, seed=0) -> List[dict]:
+    """
+    Recall@top_k and mean per-query latency of HnswVectorStore at several
+    ef_search values, against exact InMemoryVectorStore search on the same vectors.
+    Queries are perturbed copies of stored vectors.
+    """
+    import time
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)
+    queries = vectors[picks] + 0.1 * rng.standard_normal((len(picks), vectors.shape[1])).astype(np.float32)
+    texts = [str(i) for i in range(len(vectors))]
+
+    exact = InMemoryVectorStore(dim=vectors.shape[1])
+    exact.add_supplier_chunks("bench", texts, vectors)
+    start = time.perf_counter()
+    truth = [{d["chunk_text"] for d in docs} for docs in exact.search_many(queries, top_k=top_k)]
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    ann = HnswVectorStore(dim=vectors.shape[1], M=M, ef_construction=ef_construction,
+                          initial_capacity=len(vectors))
+    start = time.perf_counter()
+    ann.add_supplier_chunks("bench", texts, vectors)
+    build_s = time.perf_counter() - start
+
+    report = [{"method": "exact", "ef_search": None, "recall_at_k": 1.0, "ms_per_query": exact_ms}]
+    for ef in ef_values:
+        ann.set_ef(ef)
+        start = time.perf_counter()
+        found = [ann.search(q, top_k=top_k) for q in queries]
+        ms = (time.perf_counter() - start) * 1000 / len(queries)
+        hits = sum(len(t & {d["chunk_text"] for d in f}) for t, f in zip(truth, found))
+        report.append({
+            "method": "hnsw", "ef_search": ef, "recall_at_k": hits / float(top_k * len(queries)),
+            "ms_per_query": ms, "build_s": build_s
+        })
+    return report
+
+
+def build_vector_store(backend: str, collection, index_name="default", storage_format="array",
+                       load=True, **options) -> VectorStore:
+    """
+    backend: "atlas" (Mongo $vectorSearch), "local" (exact in-process NumPy
+    index), "hnsw" (approximate in-process hnswlib graph) or "sharded" (exact
+    search scattered over local shard processes); the non-Atlas backends are
+    loaded from the same collection.
+    storage_format: how new embeddings are written (see embedding_storage).
+    options: backend-specific settings, e.g. M / ef_construction / ef_search for "hnsw",
+    segment_dir (+ dtype) to make "local" persist to memory-mapped segment files,
+    or n_shards / timeout for "sharded".
+    load: False skips loading "local" / "hnsw" from the collection (their state
+    is restored from a snapshot instead); segment files and shards always load.
+    """
+    backend = (backend or "atlas").lower()
+    if backend == "atlas":
+        return AtlasVectorStore(collection, index_name=index_name, storage_format=storage_format, **options)
+    if backend == "local" and options.get("segment_dir"):
+        from .vector_segments import SegmentedVectorStore
+
+        store = SegmentedVectorStore(options.pop("segment_dir"), collection, storage_format=storage_format, **options)
+        store.load_from_collection()
+        return store
+    if backend == "local":
+        store = InMemoryVectorStore(collection, storage_format=storage_format, **options)
+        if load:
+            store.load_from_collection()
+        return store
+    if backend == "hnsw":
+        store = HnswVectorStore(collection, storage_format=storage_format, **options)
+        if load:
+            store.load_from_collection()
+        return store
+    if backend == "sharded":
+        from .vector_shards import ShardedVectorStore
+
+        store = ShardedVectorStore(collection, storage_format=storage_format, **options)
+        store.load_from_collection()
+        return store
+    raise ValueError(f"Unknown vector backend: {backend}")
+
+
+if __name__ == "__main__":
+    # python -m pipeline.vector_store [n_vectors]  -- recall / latency of HNSW vs exact search
+    import sys
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    data = np.random.default_rng(1).standard_normal((n, 384)).astype(np.float32)
+    for row in benchmark_ann(data):
+        print(f"{row['method']:5s} ef={str(row['ef_search']):>4s}  recall@10 {row['recall_at_k']:.3f}  "
+              f"{row['ms_per_query']:.2f} ms/query")
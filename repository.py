@@ -324,14 +324,15 @@ def get_service_by_name(db: Session, name: str) -> Optional[models.Service]:
     return db.query(models.Service).filter(models.Service.name == name.lower()).first()
 
 def get_suppliers_for_service(db: Session, service_name: str):
-    # 1) Get the service object by name
-    svc = get_service_by_name(db, service_name)
-    if not svc:
-        return []
-    # 2) Find all association rows for that service
-    rows = db.query(models.SupplierService).filter_by(service_id=svc.id).all()
-    # 3) Collect the supplier_ids
-    supplier_ids = [row.supplier_id for row in rows]
+    # One query: join the association rows to the service with that name
+    rows = (
+        db.query(models.SupplierService.supplier_id)
+        .join(models.Service, models.Service.id == models.SupplierService.service_id)
+        .filter(models.Service.name == service_name.lower())
+        .all()
+    )
+    # Collect the supplier_ids
+    supplier_ids = [row[0] for row in rows]
     return supplier_ids
 
 def list_services_for_supplier(db: Session, supplier_id: str):
@@ -356,6 +356,8 @@ class AppointmentCreate(BaseModel):
 class SearchRequest(BaseModel):
     query: str
     requester_id: str
+    # "cross_encoder", "score" or "llm"; None uses the server default
+    rerank: Optional[str] = None
 
 
 
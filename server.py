@@ -1,5 +1,7 @@
-from fastapi import FastAPI, Depends, HTTPException, File, UploadFile, Body
+from fastapi import FastAPI, Depends, HTTPException, File, UploadFile, Body, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from pipeline.supplier_pdf_ingestion import ingest_supplier_pdf, ingest_supplier_pdf_with_summary
 
@@ -16,12 +18,92 @@ app = FastAPI()
 
 # MONGO_URI, OPENAI_API_KEY from .env
 from dotenv import load_dotenv
+import json
 import os
 from pipeline.enhance_rag_pipeline import EnhancedRAGPipeline
+from pipeline.llm_cache import LLMResponseCache
+from pipeline.semantic_cache import SemanticResultCache
+from pipeline.embedding_utils import get_embedding_model
+from pipeline.reranker import RERANK_MODES
 from pipeline.log_util import log_info, log_event
 load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# run routing / decomposition / vector search of a search concurrently
+RAG_CONCURRENT_STAGES = os.getenv("RAG_CONCURRENT_STAGES", "false").lower() == "true"
+# "atlas" ($vectorSearch), "local" (in-process NumPy index, works on plain Mongo), "hnsw" (in-process ANN)
+# or "sharded" (exact search scattered over local shard processes)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "atlas")
+# HNSW graph settings (VECTOR_BACKEND=hnsw only)
+HNSW_OPTIONS = {
+    "M": int(os.getenv("HNSW_M", "16")),
+    "ef_construction": int(os.getenv("HNSW_EF_CONSTRUCTION", "200")),
+    "ef_search": int(os.getenv("HNSW_EF_SEARCH", "64")),
+}
+# VECTOR_BACKEND=local only: persist to memory-mapped segment files shared by all workers on the host
+VECTOR_SEGMENT_DIR = os.getenv("VECTOR_SEGMENT_DIR")
+VECTOR_SEGMENT_DTYPE = os.getenv("VECTOR_SEGMENT_DTYPE", "float16")
+# VECTOR_BACKEND=sharded only: number of shard processes, and how long a search waits for each
+VECTOR_SHARDS = int(os.getenv("VECTOR_SHARDS", "4"))
+VECTOR_SHARD_TIMEOUT = float(os.getenv("VECTOR_SHARD_TIMEOUT", "2.0"))
+VECTOR_STORE_OPTIONS = None
+if VECTOR_BACKEND == "hnsw":
+    VECTOR_STORE_OPTIONS = HNSW_OPTIONS
+elif VECTOR_BACKEND == "sharded":
+    VECTOR_STORE_OPTIONS = {"n_shards": VECTOR_SHARDS, "timeout": VECTOR_SHARD_TIMEOUT}
+elif VECTOR_BACKEND == "local" and VECTOR_SEGMENT_DIR:
+    VECTOR_STORE_OPTIONS = {"segment_dir": VECTOR_SEGMENT_DIR, "dtype": VECTOR_SEGMENT_DTYPE}
+# how chunk embeddings are stored in Mongo: "array", "float32", "int8" or "float16" (local backend only)
+EMBEDDING_STORAGE_FORMAT = os.getenv("EMBEDDING_STORAGE_FORMAT", "array")
+# cache for routing / decomposition / multi-query answers; set a path to keep it across restarts
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH")
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(24 * 3600)))
+# "embedding" (local nearest-centroid router, LLM below the threshold) or "llm"
+SERVICE_ROUTER = os.getenv("SERVICE_ROUTER", "embedding")
+ROUTER_MIN_CONFIDENCE = float(os.getenv("ROUTER_MIN_CONFIDENCE", "0.5"))
+# default re-rank mode: "llm" (the original re-rank step), "score", or "cross_encoder" (local model, loaded on first use)
+RERANK_MODE = os.getenv("RERANK_MODE", "llm")
+# per-supplier summaries: "batch" (one structured call) or "concurrent" (parallel calls)
+SUMMARY_MODE = os.getenv("SUMMARY_MODE", "batch")
+SUMMARY_MAX_CONCURRENCY = int(os.getenv("SUMMARY_MAX_CONCURRENCY", "4"))
+# cache for structured summaries (dropped per supplier when it re-ingests a PDF)
+SUMMARY_CACHE_PATH = os.getenv("SUMMARY_CACHE_PATH")
+SUMMARY_CACHE_TTL = int(os.getenv("SUMMARY_CACHE_TTL", str(6 * 3600)))
+# reuse the final results of a near-duplicate query (cosine of the query embeddings >= threshold)
+SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE", "false").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", "600"))
+# "vector" or "hybrid" (reciprocal rank fusion of vector hits and BM25 hits)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector")
+# hybrid: min BM25 score for chunks only the lexical side found (e.g. an exact certification name)
+HYBRID_MIN_BM25 = float(os.getenv("HYBRID_MIN_BM25", "2.0"))
+# two-stage retrieval: pick the top PROFILE_TOP_M suppliers by profile vector, then search their chunks
+TWO_STAGE_RETRIEVAL = os.getenv("TWO_STAGE_RETRIEVAL", "false").lower() == "true"
+PROFILE_TOP_M = int(os.getenv("PROFILE_TOP_M", "20"))
+# keep per-service vector shards in memory so routed searches scan only their service
+PARTITION_BY_SERVICE = os.getenv("PARTITION_BY_SERVICE", "false").lower() == "true"
+PARTITION_MAX_MB = int(os.getenv("PARTITION_MAX_MB", "256"))
+# warm start: restore in-memory search state from this file, then catch up from the change log
+SEARCH_SNAPSHOT_PATH = os.getenv("SEARCH_SNAPSHOT_PATH")
+SEARCH_SNAPSHOT_INTERVAL = int(os.getenv("SEARCH_SNAPSHOT_INTERVAL", "600"))
+
+# one embedding model per process; concurrent small encodes are coalesced into micro-batches
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "5"))
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "32"))
+# "torch" (SentenceTransformer), "onnx" or "onnx-int8" (ONNX Runtime, exported to ONNX_MODEL_DIR on first start)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "onnx_model")
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0")) or None
+# SQLite file for chunk embeddings keyed by content hash (off if unset)
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH") or None
+EMBEDDING_CACHE_MAX_MB = float(os.getenv("EMBEDDING_CACHE_MAX_MB", "512"))
+# worker processes (each with its own model) for large ingestions; 0 = encode in-process
+BULK_EMBED_WORKERS = int(os.getenv("BULK_EMBED_WORKERS", "0"))
+BULK_EMBED_THREADS = int(os.getenv("BULK_EMBED_THREADS", "1"))
+get_embedding_model(batch_window_ms=EMBED_BATCH_WINDOW_MS, max_batch_size=EMBED_MAX_BATCH,
+                    backend=EMBEDDING_BACKEND, model_dir=ONNX_MODEL_DIR, num_threads=ONNX_THREADS,
+                    cache_path=EMBEDDING_CACHE_PATH, cache_max_mb=EMBEDDING_CACHE_MAX_MB,
+                    bulk_workers=BULK_EMBED_WORKERS, bulk_threads=BULK_EMBED_THREADS)
 
 # We pass a "db_session_factory" -> a function that returns a fresh DB session
 def db_session_factory():
@@ -31,8 +113,35 @@ def db_session_factory():
 rag_pipeline = EnhancedRAGPipeline(
     mongo_uri=MONGO_URI,
     openai_api_key=OPENAI_API_KEY,
-    db_session_factory=db_session_factory
+    db_session_factory=db_session_factory,
+    concurrent_stages=RAG_CONCURRENT_STAGES,
+    vector_backend=VECTOR_BACKEND,
+    embedding_format=EMBEDDING_STORAGE_FORMAT,
+    vector_store_options=VECTOR_STORE_OPTIONS,
+    llm_cache=LLMResponseCache(ttl_seconds=LLM_CACHE_TTL, sqlite_path=LLM_CACHE_PATH),
+    router=SERVICE_ROUTER,
+    router_min_confidence=ROUTER_MIN_CONFIDENCE,
+    rerank=RERANK_MODE,
+    summary_cache=LLMResponseCache(max_entries=2048, ttl_seconds=SUMMARY_CACHE_TTL, sqlite_path=SUMMARY_CACHE_PATH),
+    retrieval=RETRIEVAL_MODE,
+    hybrid_min_bm25=HYBRID_MIN_BM25,
+    two_stage=TWO_STAGE_RETRIEVAL,
+    profile_top_m=PROFILE_TOP_M,
+    partition_by_service=PARTITION_BY_SERVICE,
+    partition_max_bytes=PARTITION_MAX_MB * 1024 * 1024,
+    snapshot_path=SEARCH_SNAPSHOT_PATH,
+    snapshot_interval=SEARCH_SNAPSHOT_INTERVAL,
+    semantic_cache=SemanticResultCache(
+        threshold=SEMANTIC_CACHE_THRESHOLD, ttl_seconds=SEMANTIC_CACHE_TTL
+    ) if SEMANTIC_CACHE else None
 )
+
+@app.on_event("shutdown")
+def save_search_snapshot():
+    rag_pipeline.save_snapshot()
+    if rag_pipeline.embedding_model.bulk_pool is not None:
+        rag_pipeline.embedding_model.bulk_pool.close()
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -133,39 +242,28 @@ def upload_pdf_summary_for_supplier(
     )
     return result
 # ---------- Search for Supplier (AI-Assisted) ----------
-@app.post("/search_for_supplier")
-def search_for_supplier(
-    payload: SearchRequest,
-    db: Session = Depends(get_db)
-):
+def _open_post_for_query(db: Session, query: str, requester_id: str):
     """
-    1) do a vector search in Mongo
-    2) if no match => create an open post
-    3) if match => return them sorted
+    No direct match => fallback open post that suppliers can bid on.
     """
-    query = payload.query
-    requester_id = payload.requester_id
-     # 1) advanced pipeline search
-    chunk_matches = rag_pipeline.advanced_search(user_query=query, top_k=5)
-    if not chunk_matches:
-        # no direct match => fallback open post
-        new_post_data = schemas.PostCreate(
-            title=f"Request from advanced search: {query[:30]}",
-            description=query,
-            category="general",
-            status="open",
-            requester_id=requester_id
-        )
-        new_post = repository.create_post(db, new_post_data)
-        return {
-            "results": [],
-            "summary": "No direct matches found. Created an open request.",
-            "post_id": new_post.id
-        }
+    new_post_data = schemas.PostCreate(
+        title=f"Request from advanced search: {query[:30]}",
+        description=query,
+        category="general",
+        status="open",
+        requester_id=requester_id
+    )
+    return repository.create_post(db, new_post_data)
 
-    # 2) build final results
+def _build_supplier_cards(db: Session, chunk_matches: list):
+    """
+    Turn ranked chunk matches into supplier cards (user fields, score, rating).
+    Returns (cards, matches) where matches are the docs behind the cards,
+    in the same order, for the per-supplier summaries.
+    """
     # chunk_matches is a list of e.g. {"supplier_id":..., "chunk_text":..., "score":...}
     results_list = []
+    summarized_matches = []
     for m in chunk_matches:
         if "supplier_id" not in m:
             # Skip documents without a supplier_id
@@ -176,10 +274,7 @@ def search_for_supplier(
         if not sp_user:
             continue
         rating = repository.get_supplier_avg_rating(db, sp_id)
-
-        # 2.5) For doc-level summary, pass [match_doc] to get_structured_summary
-        # so it only uses that single chunk doc as 'context' for GPT:
-        doc_summary = rag_pipeline.get_structured_summary(query, [m])  # pass a list of 1 doc
+        summarized_matches.append(m)
 
         results_list.append({
             "supplier_id": sp_id,
@@ -191,11 +286,56 @@ def search_for_supplier(
             "score": m["score"],
             "rating": rating,
             # "chunk_text": m["chunk_text"]
-            "structured_summary": doc_summary
+            "structured_summary": None
         })
+    return results_list, summarized_matches
+
+async def _advanced_search(query: str, rerank=None):
+    """
+    Awaited directly with RAG_CONCURRENT_STAGES (advanced_search would have to
+    asyncio.run inside the server's loop); the serial path runs in the threadpool.
+    """
+    if RAG_CONCURRENT_STAGES:
+        return await rag_pipeline.advanced_search_async(user_query=query, top_k=5, rerank=rerank)
+    return await run_in_threadpool(rag_pipeline.advanced_search, user_query=query, top_k=5, rerank=rerank)
+
+@app.post("/search_for_supplier")
+async def search_for_supplier(
+    payload: SearchRequest,
+    db: Session = Depends(get_db)
+):
+    """
+    1) do a vector search in Mongo
+    2) if no match => create an open post
+    3) if match => return them sorted
+    """
+    query = payload.query
+    requester_id = payload.requester_id
+    if payload.rerank and payload.rerank not in RERANK_MODES:
+        raise HTTPException(400, f"rerank must be one of {list(RERANK_MODES)}")
+     # 1) advanced pipeline search
+    chunk_matches = await _advanced_search(query, payload.rerank)
+    # DB and LLM calls below block, so they run in the threadpool, off the event loop
+    if not chunk_matches:
+        new_post = await run_in_threadpool(_open_post_for_query, db, query, requester_id)
+        return {
+            "results": [],
+            "summary": "No direct matches found. Created an open request.",
+            "post_id": new_post.id
+        }
+
+    # 2) build final results
+    results_list, summarized_matches = await run_in_threadpool(_build_supplier_cards, db, chunk_matches)
+
+    # 2.5) Doc-level summaries: each supplier is summarized from its single
+    # match doc, but all of them in one batched call (or concurrently)
+    summaries = await run_in_threadpool(
+        rag_pipeline.get_structured_summaries,
+        query, summarized_matches, mode=SUMMARY_MODE, max_concurrency=SUMMARY_MAX_CONCURRENCY
+    )
+    for r in results_list:
+        r["structured_summary"] = summaries.get(r["supplier_id"])
 
-    # 3) Optionally call structured summary 
-    #    We'll do a single summary for all top docs        
     print("DEBUG: Final supplier matches:", results_list)
 
     
@@ -204,6 +344,89 @@ def search_for_supplier(
         "report": "Found matches for the query."
     }
 
+def _stream_event(event: dict, fmt: str) -> str:
+    data = json.dumps(event, default=str)
+    if fmt == "sse":
+        return f"event: {event['event']}\ndata: {data}\n\n"
+    return data + "\n"
+
+@app.post("/search_for_supplier/stream")
+async def search_for_supplier_stream(
+    payload: SearchRequest,
+    fmt: str = Query("ndjson", alias="format"),
+    db: Session = Depends(get_db)
+):
+    """
+    Streaming variant of /search_for_supplier (NDJSON, or SSE with ?format=sse).
+
+    Events, in order:
+      {"event": "results", "results": [...cards without summaries...]}  as soon as retrieval is done
+      {"event": "summary", "supplier_id": ..., "structured_summary": ...}  one per supplier, as each completes
+      {"event": "done"}
+    or, with no match, {"event": "no_match", "post_id": ...} then {"event": "done"}.
+    """
+    if fmt not in ("ndjson", "sse"):
+        raise HTTPException(400, "format must be 'ndjson' or 'sse'")
+    if payload.rerank and payload.rerank not in RERANK_MODES:
+        raise HTTPException(400, f"rerank must be one of {list(RERANK_MODES)}")
+    query = payload.query
+
+    # Retrieval and every DB read happen before streaming starts, so the
+    # request's session isn't needed once the response is being sent.
+    chunk_matches = await _advanced_search(query, payload.rerank)
+    if chunk_matches:
+        results_list, summarized_matches = await run_in_threadpool(_build_supplier_cards, db, chunk_matches)
+        no_match_post_id = None
+    else:
+        results_list, summarized_matches = [], []
+        no_match_post_id = (await run_in_threadpool(_open_post_for_query, db, query, payload.requester_id)).id
+
+    def events():
+        if no_match_post_id is not None:
+            yield _stream_event({
+                "event": "no_match",
+                "summary": "No direct matches found. Created an open request.",
+                "post_id": no_match_post_id
+            }, fmt)
+        else:
+            yield _stream_event({
+                "event": "results",
+                "results": results_list,
+                "report": "Found matches for the query."
+            }, fmt)
+            for supplier_id, summary in rag_pipeline.iter_structured_summaries(
+                query, summarized_matches, max_concurrency=SUMMARY_MAX_CONCURRENCY
+            ):
+                yield _stream_event({
+                    "event": "summary",
+                    "supplier_id": supplier_id,
+                    "structured_summary": summary
+                }, fmt)
+        yield _stream_event({"event": "done"}, fmt)
+
+    media_type = "text/event-stream" if fmt == "sse" else "application/x-ndjson"
+    return StreamingResponse(events(), media_type=media_type)
+
+@app.get("/search/cache_stats")
+def search_cache_stats():
+    """
+    Hit/miss counters of the search-side caches.
+    """
+    stats = {
+        "llm_cache": rag_pipeline.llm_cache.stats(),
+        "summary_cache": rag_pipeline.summary_cache.stats()
+    }
+    if rag_pipeline.semantic_cache is not None:
+        stats["semantic_cache"] = rag_pipeline.semantic_cache.stats()
+    stats["embedding_batches"] = rag_pipeline.embedding_model.stats()
+    if rag_pipeline.embedding_model.chunk_cache is not None:
+        stats["embedding_cache"] = rag_pipeline.embedding_model.chunk_cache.stats()
+    if rag_pipeline.embedding_model.bulk_pool is not None:
+        stats["bulk_embedding"] = rag_pipeline.embedding_model.bulk_pool.stats()
+    if hasattr(rag_pipeline.vector_store, "stats"):
+        stats["vector_store"] = rag_pipeline.vector_store.stats()
+    return stats
+
 @app.put("/suppliers/{supplier_id}/profile")
 def update_user_profile_endpoint(
     supplier_id: str,
@@ -233,6 +456,9 @@ def update_user_profile_endpoint(
         pdf_summary=pdf_summary,
         skills=skills
     )
+    if user:
+        # keep the supplier's profile vector in step with the new summary / skills
+        rag_pipeline.update_supplier_profile(supplier_id, pdf_summary=pdf_summary, skills=skills)
     if role:
         # If you want to handle multiple roles, you could do:
         # for r in (role if isinstance(role, list) else [role]):
@@ -0,0 +1,38 @@
+import asyncio
+
+import numpy as np
+
+from pipeline.embedding_utils import EmbeddingService
+
+
+class _OnesModel:
+    def get_sentence_embedding_dimension(self):
+        return 4
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        return np.ones((len(texts), 4), dtype=np.float32)
+
+
+def test_cancelled_encode_async_does_not_stop_batcher():
+    service = EmbeddingService(_OnesModel(), batch_window_ms=50)
+
+    async def cancel_one():
+        task = asyncio.ensure_future(service.encode_async(["a"]))
+        await asyncio.sleep(0)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(cancel_one())
+    assert service.submit(["b"]).result(timeout=2).shape == (1, 4)
+
+
+def test_failed_batch_does_not_stop_batcher():
+    service = EmbeddingService(_OnesModel())
+    service.model = None  # encode raises AttributeError
+    future = service.submit(["a"])
+    assert isinstance(future.exception(timeout=2), AttributeError)
+    service.model = _OnesModel()
+    assert service.submit(["b"]).result(timeout=2).shape == (1, 4)
@@ -0,0 +1,35 @@
+from pipeline.enhance_rag_pipeline import EnhancedRAGPipeline
+from pipeline.lexical_index import BM25Index
+
+
+def _index():
+    index = BM25Index()
+    index.replace_supplier("s1", [f"general plumbing repairs and boiler servicing, job {i}" for i in range(20)])
+    index.replace_supplier("s2", ["NICEIC approved contractor for domestic installations"])
+    return index
+
+
+def test_hybrid_keeps_exact_term_hit_below_min_score():
+    query = "NICEIC registered electrician"
+    niceic = ("s2", "NICEIC approved contractor for domestic installations")
+    # the NICEIC chunk scored 0.41 on the vector side, below min_score=0.6
+    all_vector_docs = [
+        {"supplier_id": "s1", "chunk_text": "general plumbing repairs and boiler servicing, job 0", "score": 0.71},
+        {"supplier_id": niceic[0], "chunk_text": niceic[1], "score": 0.41},
+    ]
+    vector_docs = [d for d in all_vector_docs if d["score"] >= 0.6]
+    lexical_docs = _index().search(query, top_k=6)
+
+    fused = EnhancedRAGPipeline._fuse_hybrid(vector_docs, lexical_docs, top_k=6, all_vector_docs=all_vector_docs)
+
+    hit = next(d for d in fused if (d["supplier_id"], d["chunk_text"]) == niceic)
+    assert hit["score"] == 0.41
+    assert hit["bm25_score"] >= 2.0
+    assert hit["rrf_score"] > 0
+
+
+def test_hybrid_drops_weak_lexical_hits():
+    lexical_docs = _index().search("plumbing", top_k=6)
+    assert lexical_docs and all(d["bm25_score"] < 2.0 for d in lexical_docs)
+
+    assert EnhancedRAGPipeline._fuse_hybrid([], lexical_docs, top_k=6) == []